@@ -7,9 +7,13 @@ import { PatientForm } from "@/components/PatientForm";
 import { ReportDisplay } from "@/components/ReportDisplay";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
+import {
+  CHUNKED_UPLOAD_THRESHOLD,
+  uploadInChunks,
+} from "@/lib/chunkedUpload";
 import { API_CONFIG, buildApiUrl } from "@/lib/config";
 import { FileText, Stethoscope, User } from "lucide-react";
-import { useState } from "react";
+import { useRef, useState } from "react";
 
 interface PatientData {
   age: string;
@@ -17,6 +21,12 @@ interface PatientData {
   clinicalHistory: string;
 }
 
+// Imagem já enviada ao backend (pré-processada em segundo plano)
+interface PreUpload {
+  file: File;
+  imageId: Promise<string | null>;
+}
+
 function MainApp() {
   const [uploadedFile, setUploadedFile] = useState<File | null>(null);
   const [patientData, setPatientData] = useState<PatientData>({
@@ -26,11 +36,51 @@ function MainApp() {
   });
   const [report, setReport] = useState<string>("");
   const [isGenerating, setIsGenerating] = useState(false);
+  const preUpload = useRef<PreUpload | null>(null);
 
   const handleFileUpload = (file: File) => {
     setUploadedFile(file);
+    preUpload.current = { file, imageId: preUploadImage(file) };
+  };
+
+  // Envia a imagem assim que selecionada, enquanto o formulário é preenchido
+  const preUploadImage = async (file: File): Promise<string | null> => {
+    try {
+      // Imagens grandes: envio em blocos, retomável em conexões instáveis
+      if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        return await uploadInChunks(file);
+      }
+      const formData = new FormData();
+      formData.append("file", file);
+      const response = await fetch(buildApiUrl(API_CONFIG.ENDPOINTS.IMAGES), {
+        method: "POST",
+        body: formData,
+      });
+      if (!response.ok) {
+        return null;
+      }
+      const data = await response.json();
+      return data.image_id ?? null;
+    } catch (error) {
+      console.warn("⚠️ Pré-envio da imagem falhou, usando base64:", error);
+      return null;
+    }
   };
 
+  const requestReport = (image: { image?: string; image_id?: string }) =>
+    fetch(buildApiUrl(API_CONFIG.ENDPOINTS.GENERATE_REPORT), {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        ...image,
+        age: patientData.age,
+        weight: patientData.weight,
+        clinical_history: patientData.clinicalHistory,
+      }),
+    });
+
   const handlePatientDataChange = (data: PatientData) => {
     setPatientData(data);
   };
@@ -53,25 +103,21 @@ function MainApp() {
     setIsGenerating(true);
 
     try {
-      // Convert file to base64
-      const base64Image = await fileToBase64(uploadedFile);
-
-      // Chamar diretamente o backend Python
-      const response = await fetch(
-        buildApiUrl(API_CONFIG.ENDPOINTS.GENERATE_REPORT),
-        {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-          },
-          body: JSON.stringify({
-            image: base64Image,
-            age: patientData.age,
-            weight: patientData.weight,
-            clinical_history: patientData.clinicalHistory,
-          }),
-        }
-      );
+      // Usa a imagem pré-enviada quando disponível; senão envia em base64
+      const imageId =
+        preUpload.current?.file === uploadedFile
+          ? await preUpload.current.imageId
+          : null;
+
+      let response = imageId
+        ? await requestReport({ image_id: imageId })
+        : null;
+
+      // Handle expirado ou pré-envio indisponível: reenvia a imagem completa
+      if (!response || response.status === 404) {
+        const base64Image = await fileToBase64(uploadedFile);
+        response = await requestReport({ image: base64Image });
+      }
 
       if (!response.ok) {
         throw new Error("Erro ao gerar relatório");
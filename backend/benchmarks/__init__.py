@@ -0,0 +1,3 @@
+"""
+Benchmarks de desempenho do backend (executar a partir de backend/ com python -m benchmarks.<nome>).
+"""
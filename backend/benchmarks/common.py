@@ -0,0 +1,76 @@
+"""
+Utilitários compartilhados pelos benchmarks.
+"""
+
+import base64
+import io
+import json
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_study(size: int = 512, seed: int = 0) -> Image.Image:
+    """Imagem em tons de cinza com estruturas suaves e ruído, parecida com uma radiografia."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    pixels = 120 + 60 * np.sin(6 * x + seed) * np.cos(4 * y) + 40 * np.exp(-((x - 0.5) ** 2 + (y - 0.5) ** 2) * 8)
+    pixels += rng.normal(0, 8, (size, size))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def image_to_b64(image: Image.Image, format: str = "JPEG") -> str:
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format=format, quality=90)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * pct / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def parse_int_list(spec: str) -> List[int]:
+    return [int(value) for value in spec.split(",") if value.strip()]
+
+
+def markdown_table(rows: List[Dict[str, Any]], columns: Sequence[str]) -> str:
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for row in rows:
+        cells = []
+        for column in columns:
+            value = row.get(column)
+            cells.append(f"{value:.3f}" if isinstance(value, float) else "" if value is None else str(value))
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def write_json(path: Optional[str], data: Any) -> None:
+    if path:
+        with open(path, "w", encoding="utf-8") as output:
+            json.dump(data, output, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados salvos em {path}")
+
+
+def rss_bytes() -> Dict[str, Optional[int]]:
+    """RSS atual e pico do processo (Linux: /proc; outros: apenas o pico via resource)."""
+    current = peak = None
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        import resource
+        import sys
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss if sys.platform == "darwin" else maxrss * 1024
+    return {"rss_bytes": current, "peak_rss_bytes": peak}
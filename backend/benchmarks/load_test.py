@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Teste de carga ponta a ponta de /generate_report.
+
+Sobe o servidor mock do endpoint HF (mock_hf_server.py) e o backend
+(uvicorn main:app) apontando para ele, e dispara requisições com um corpus
+de imagens em tamanhos reais:
+
+- malha aberta: chegadas de Poisson a cada taxa de --rates (req/s), sem
+  esperar as respostas anteriores;
+- malha fechada: --concurrency clientes, cada um enviando a próxima
+  requisição assim que recebe a anterior.
+
+Variantes: "inline" (imagem em base64 no corpo) e "preupload" (POST /images
+seguido de /generate_report com image_id). Relata p50/p95/p99 de latência e
+de TTFB, vazão, taxa de erros por status e RSS do backend, em JSON e Markdown.
+
+Uso (a partir de backend/):
+    python -m benchmarks.load_test --mode both --rates 1,2,4 --concurrency 1,4,8 --duration 30
+    python -m benchmarks.load_test --backend-url http://localhost:8000 --server-pid 1234 --mode closed
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import os
+import random
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+from benchmarks.common import markdown_table, parse_int_list, percentile, synthetic_study, write_json
+
+CORPUS_SIZES = [(2048, "PNG"), (2500, "JPEG"), (3000, "PNG"), (1024, "JPEG")]
+
+
+def parse_float_list(spec: str) -> List[float]:
+    return [float(value) for value in spec.split(",") if value.strip()]
+
+
+def load_corpus(args) -> List[bytes]:
+    """Imagens de --image-dir ou estudos sintéticos em resoluções típicas de radiografia."""
+    if args.image_dir:
+        names = sorted(os.listdir(args.image_dir))[:args.images]
+        corpus = []
+        for name in names:
+            with open(os.path.join(args.image_dir, name), "rb") as image_file:
+                corpus.append(image_file.read())
+        return corpus
+    corpus = []
+    for seed in range(args.images):
+        size, format = CORPUS_SIZES[seed % len(CORPUS_SIZES)]
+        buffer = io.BytesIO()
+        synthetic_study(size, seed=seed).save(buffer, format=format)
+        corpus.append(buffer.getvalue())
+    return corpus
+
+
+def process_rss(pid: Optional[int]) -> Optional[int]:
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    """Amostra o RSS do processo do backend durante um cenário."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            rss = process_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        if not self.samples:
+            return {"rss_start_mb": None, "rss_max_mb": None, "rss_end_mb": None}
+        return {
+            "rss_start_mb": self.samples[0] / 2**20,
+            "rss_max_mb": max(self.samples) / 2**20,
+            "rss_end_mb": self.samples[-1] / 2**20,
+        }
+
+
+async def one_request(client: httpx.AsyncClient, args, image: bytes, index: int) -> Dict[str, Any]:
+    """Executa uma geração de relatório e mede latência total e tempo até o primeiro byte."""
+    body = {
+        "age": "45",
+        "weight": "70",
+        "clinical_history": f"Paciente com tosse persistente há 3 semanas (requisição {index}).",
+        "force_regenerate": not args.allow_reuse,
+    }
+    started = time.perf_counter()
+    try:
+        if args.variant == "preupload":
+            uploaded = await client.post("/images", files={"file": ("study.png", image)})
+            if uploaded.status_code != 200:
+                return {"status": uploaded.status_code, "latency": time.perf_counter() - started, "ttfb": None}
+            body["image_id"] = uploaded.json()["image_id"]
+        else:
+            body["image"] = base64.b64encode(image).decode("utf-8")
+
+        async with client.stream("POST", "/generate_report", json=body) as response:
+            ttfb = None
+            async for _ in response.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+            status = response.status_code
+    except httpx.HTTPError as error:
+        return {"status": type(error).__name__, "latency": time.perf_counter() - started, "ttfb": None}
+    return {"status": status, "latency": time.perf_counter() - started, "ttfb": ttfb}
+
+
+def summarize(label: str, results: List[Dict[str, Any]], elapsed: float, rss: Dict[str, Any]) -> Dict[str, Any]:
+    ok = [result for result in results if result["status"] == 200]
+    latencies = [result["latency"] for result in ok]
+    ttfbs = [result["ttfb"] for result in ok if result["ttfb"] is not None]
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    return {
+        "scenario": label,
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else None,
+        "statuses": statuses,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else None,
+        "reports_per_min": 60 * len(ok) / elapsed if elapsed else None,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "ttfb_p50_s": percentile(ttfbs, 50),
+        "ttfb_p95_s": percentile(ttfbs, 95),
+        "ttfb_p99_s": percentile(ttfbs, 99),
+        **rss,
+    }
+
+
+async def open_loop(client, args, corpus, rate: float, pid: Optional[int]) -> Dict[str, Any]:
+    """Chegadas de Poisson: intervalos exponenciais independentes das respostas."""
+    rng = random.Random(args.seed)
+    tasks = []
+    with RssSampler(pid) as sampler:
+        started = time.perf_counter()
+        next_arrival = started
+        index = 0
+        while next_arrival - started < args.duration:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            tasks.append(asyncio.create_task(one_request(client, args, corpus[index % len(corpus)], index)))
+            index += 1
+            next_arrival += rng.expovariate(rate)
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    row = summarize(f"open {rate:g} req/s", results, elapsed, sampler.summary())
+    row["offered_rps"] = len(tasks) / args.duration
+    return row
+
+
+async def closed_loop(client, args, corpus, concurrency: int, pid: Optional[int]) -> Dict[str, Any]:
+    """Clientes fixos: cada um envia a próxima requisição ao receber a anterior."""
+    results: List[Dict[str, Any]] = []
+    counter = iter(range(10**9))
+
+    async def worker(deadline: float) -> None:
+        while time.perf_counter() < deadline:
+            index = next(counter)
+            results.append(await one_request(client, args, corpus[index % len(corpus)], index))
+
+    with RssSampler(pid) as sampler:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(started + args.duration) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    row = summarize(f"closed {concurrency}", results, elapsed, sampler.summary())
+    row["concurrency"] = concurrency
+    return row
+
+
+def start_process(command: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+async def wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"❌ {url} não respondeu em {timeout:.0f}s")
+
+
+def stop_process(process: Optional[subprocess.Popen]) -> None:
+    if process and process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["open", "closed", "both"], default="both")
+    parser.add_argument("--rates", default="1,2,4", help="taxas de chegada (req/s) da malha aberta")
+    parser.add_argument("--concurrency", default="1,4,8", help="níveis de concorrência da malha fechada")
+    parser.add_argument("--duration", type=float, default=20, help="segundos por cenário")
+    parser.add_argument("--variant", choices=["inline", "preupload"], default="inline")
+    parser.add_argument("--images", type=int, default=8, help="tamanho do corpus")
+    parser.add_argument("--image-dir", help="diretório com imagens reais (padrão: estudos sintéticos)")
+    parser.add_argument("--allow-reuse", action="store_true", help="não força regeneração (permite reuso de laudos)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend-url", help="backend já em execução (não sobe mock nem backend)")
+    parser.add_argument("--server-pid", type=int, help="PID do backend externo, para medir RSS")
+    parser.add_argument("--backend-port", type=int, default=8765)
+    parser.add_argument("--mock-port", type=int, default=8766)
+    parser.add_argument("--mock-args", default="--latency lognormal:300:0.3 --tokens-per-second 80",
+                        help="argumentos repassados a mock_hf_server.py")
+    parser.add_argument("--log-dir", default=tempfile.gettempdir(), help="onde gravar os logs do mock e do backend")
+    parser.add_argument("--json", help="arquivo de saída com os resultados")
+    parser.add_argument("--markdown", help="arquivo de saída com a tabela em Markdown")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    sizes = [Image.open(io.BytesIO(image)).size for image in corpus]
+    print(f"🖼️ Corpus: {len(corpus)} imagens, {sum(map(len, corpus)) / 2**20:.1f} MB ({sizes[:4]}...)")
+
+    mock = backend = None
+    base_url, pid = args.backend_url, args.server_pid
+    try:
+        if not base_url:
+            env = dict(os.environ)
+            env.update({
+                "MEDGEMMA_MODEL_URL": f"http://127.0.0.1:{args.mock_port}",
+                "HUGGINGFACE_API_TOKEN": "mock",
+                "LOCAL_MODEL_MODE": "off",
+            })
+            mock = start_process(
+                [sys.executable, "mock_hf_server.py", "--port", str(args.mock_port)] + shlex.split(args.mock_args),
+                env, os.path.join(args.log_dir, "load_test_mock.log"),
+            )
+            backend = start_process(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.backend_port), "--log-level", "warning"],
+                env, os.path.join(args.log_dir, "load_test_backend.log"),
+            )
+            base_url, pid = f"http://127.0.0.1:{args.backend_port}", backend.pid
+            await wait_ready(f"http://127.0.0.1:{args.mock_port}/health")
+            await wait_ready(f"{base_url}/")
+
+        rows = []
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+        async with httpx.AsyncClient(base_url=base_url, timeout=300.0, limits=limits) as client:
+            if args.mode in ("open", "both"):
+                for rate in parse_float_list(args.rates):
+                    rows.append(await open_loop(client, args, corpus, rate, pid))
+                    print(f"⏱️ {rows[-1]['scenario']}: {rows[-1]['throughput_rps']:.2f} req/s, "
+                          f"p95 {rows[-1]['p95_s'] or 0:.2f}s, erros {rows[-1]['error_rate']:.1%}")
+            if args.mode in ("closed", "both"):
+                for concurrency in parse_int_list(args.concurrency):
+                    rows.append(await closed_loop(client, args, corpus, concurrency, pid))
+                    print(f"⏱️ {rows[-1]['scenario']}: {rows[-1]['throughput_rps']:.2f} req/s, "
+                          f"p95 {rows[-1]['p95_s'] or 0:.2f}s, erros {rows[-1]['error_rate']:.1%}")
+    finally:
+        stop_process(backend)
+        stop_process(mock)
+
+    table = markdown_table(rows, [
+        "scenario", "requests", "ok", "error_rate", "throughput_rps", "reports_per_min",
+        "p50_s", "p95_s", "p99_s", "ttfb_p50_s", "ttfb_p95_s", "ttfb_p99_s", "rss_max_mb",
+    ])
+    print()
+    print(table)
+    if args.markdown:
+        with open(args.markdown, "w", encoding="utf-8") as output:
+            output.write(f"# Teste de carga de /generate_report ({args.variant})\n\n{table}\n")
+        print(f"💾 Tabela salva em {args.markdown}")
+    write_json(args.json, {
+        "variant": args.variant,
+        "duration_s": args.duration,
+        "corpus": {"images": len(corpus), "sizes": sizes, "bytes": sum(map(len, corpus))},
+        "mock_args": None if args.backend_url else args.mock_args,
+        "scenarios": rows,
+    })
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: lotes dinâmicos vs uma requisição por vez no modelo local.
+
+Para cada nível de concorrência envia o mesmo número de requisições com o
+agendador desativado (lote máximo 1) e ativado, e compara vazão
+(requisições/s e tokens/s), latência e ocupação média dos lotes.
+
+Uso (a partir de backend/):
+    python -m benchmarks.local_batching --concurrency 1,2,4,8 --requests 16
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import image_to_b64, markdown_table, parse_int_list, percentile, synthetic_study, write_json
+from services.batch_scheduler import BatchScheduler
+from services.local_model_service import LOCAL_MODEL_AVAILABLE, LocalModelService
+
+
+async def run_level(service, images, concurrency: int, max_batch_size: int, max_wait_ms: float):
+    # Agendador novo por nível, para que as estatísticas não se misturem
+    service.scheduler = BatchScheduler(service._run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(image_b64):
+        async with semaphore:
+            started = time.perf_counter()
+            await service.generate(image_b64)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(image_b64) for image_b64 in images))
+    elapsed = time.perf_counter() - started
+    stats = service.scheduler.stats()
+    return {
+        "concurrency": concurrency,
+        "max_batch_size": max_batch_size,
+        "requests": len(images),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(images) / elapsed,
+        "tokens_per_s": stats["generated_tokens"] / elapsed,
+        "p50_latency_s": percentile(latencies, 50),
+        "p95_latency_s": percentile(latencies, 95),
+        "batches": stats["batches"],
+        "mean_occupancy": stats["mean_occupancy"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,2,4,8", help="níveis de concorrência (ex.: 1,2,4,8)")
+    parser.add_argument("--requests", type=int, default=16, help="requisições por nível")
+    parser.add_argument("--max-batch-size", type=int, default=4)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--model", default=None, help="modelo (padrão: LOCAL_MODEL_NAME)")
+    parser.add_argument("--json", help="arquivo de saída com os resultados")
+    args = parser.parse_args()
+
+    if not LOCAL_MODEL_AVAILABLE:
+        raise SystemExit("❌ transformers/torch não instalados - pip install transformers torch")
+
+    # Sem cache de embeddings: cada nível repete as mesmas imagens e mediria o cache, não o agrupamento
+    service = LocalModelService(
+        max_new_tokens=args.max_new_tokens, embedding_cache_mb=0, **({"model_name": args.model} if args.model else {})
+    )
+    images = [image_to_b64(synthetic_study(seed=seed)) for seed in range(args.requests)]
+
+    print(f"📥 Carregando {service.model_name} (aquecimento)...")
+    await service.generate(images[0])
+    print(f"✅ Carregado em {service.load_seconds:.1f}s")
+
+    rows = []
+    for concurrency in parse_int_list(args.concurrency):
+        for max_batch_size in (1, args.max_batch_size):
+            row = await run_level(service, images, concurrency, max_batch_size, args.max_wait_ms)
+            row["mode"] = "unbatched" if max_batch_size == 1 else "batched"
+            rows.append(row)
+            print(f"⏱️ concorrência {concurrency:>3} | {row['mode']:>9}: "
+                  f"{row['requests_per_s']:.2f} req/s, {row['tokens_per_s']:.1f} tokens/s, "
+                  f"ocupação {row['mean_occupancy']}")
+
+    print()
+    print(markdown_table(rows, [
+        "concurrency", "mode", "requests_per_s", "tokens_per_s", "p50_latency_s", "p95_latency_s", "batches", "mean_occupancy"
+    ]))
+    write_json(args.json, {"model": service.model_name, "load_seconds": service.load_seconds, "results": rows})
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark: tempo até o primeiro token com e sem reuso do prefixo estático.
+
+Gera relatórios com o prompt completo (modo "template") para pacientes
+diferentes, medindo o tempo até o primeiro token (geração de 1 token) com
+prefill completo e partindo de uma cópia do estado do bloco estático.
+Também confere se as saídas gulosas coincidem nos dois modos.
+
+Requer um modelo decoder-only que receba a imagem como tokens (ex.: família
+LLaVA); em captioners com cross-attention (BLIP) o reuso é desativado.
+
+Uso (a partir de backend/):
+    python -m benchmarks.local_prefix_cache --model <modelo> --requests 8
+"""
+
+import argparse
+import time
+
+from benchmarks.common import image_to_b64, markdown_table, percentile, synthetic_study, write_json
+from services.local_model_service import LOCAL_MODEL_AVAILABLE, LocalModelService
+from services.prompts import get_prompt_template
+from services.token_budget import estimate_tokens
+
+PATIENTS = [
+    ("45", "70", "Tosse seca há 3 semanas, sem febre."),
+    ("62", "81", "Dispneia aos esforços, tabagista 40 anos-maço."),
+    ("8", "25", "Febre e taquipneia há 2 dias."),
+    ("71", "64", "Controle pós-operatório de cirurgia cardíaca."),
+]
+
+
+def measure(service, images, prompts, template, reuse_prefix, max_new_tokens):
+    prefix_key = f"{template.key}:{template.prefix_hash}"
+    latencies, outputs = [], []
+    for image_b64, prompt in zip(images, prompts):
+        started = time.perf_counter()
+        output, _ = service._generate_prefixed_sync(
+            image_b64, prompt, max_new_tokens, template.static_prefix, prefix_key, reuse_prefix=reuse_prefix
+        )
+        latencies.append(time.perf_counter() - started)
+        outputs.append(output)
+    return latencies, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="modelo (padrão: LOCAL_MODEL_NAME)")
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--language", default="pt")
+    parser.add_argument("--modality", default="raio-x")
+    parser.add_argument("--check-tokens", type=int, default=24, help="tokens gerados na conferência das saídas")
+    parser.add_argument("--json", help="arquivo de saída com os resultados")
+    args = parser.parse_args()
+
+    if not LOCAL_MODEL_AVAILABLE:
+        raise SystemExit("❌ transformers/torch não instalados - pip install transformers torch")
+
+    # Sem cache de embeddings: as mesmas imagens passam por todos os modos, e os
+    # embeddings guardados na primeira passada baixariam o TTFT do reuso de prefixo
+    service = LocalModelService(
+        prompt_mode="template", embedding_cache_mb=0, **({"model_name": args.model} if args.model else {})
+    )
+    template = get_prompt_template(args.language, args.modality)
+    images = [image_to_b64(synthetic_study(seed=seed)) for seed in range(args.requests)]
+    prompts = [template.render(*PATIENTS[index % len(PATIENTS)]).strip() for index in range(args.requests)]
+
+    service._ensure_loaded()
+    supported = service.prefix_reuse_supported()
+    print(f"✅ {service.model_name} carregado em {service.load_seconds:.1f}s | reuso de prefixo suportado: {supported}")
+
+    # Aquecimento e construção do estado do prefixo (medido à parte)
+    measure(service, images[:1], prompts[:1], template, False, 1)
+    build_started = time.perf_counter()
+    measure(service, images[:1], prompts[:1], template, True, 1)
+    build_seconds = time.perf_counter() - build_started
+
+    cold, cold_outputs = measure(service, images, prompts, template, False, 1)
+    warm, warm_outputs = measure(service, images, prompts, template, True, 1)
+    _, reference = measure(service, images, prompts, template, False, args.check_tokens)
+    _, reused = measure(service, images, prompts, template, True, args.check_tokens)
+
+    prefix_stats = service.prefix_cache.stats()
+    rows = [
+        {
+            "mode": mode,
+            "mean_ttft_ms": 1000 * sum(values) / len(values),
+            "p50_ttft_ms": 1000 * percentile(values, 50),
+            "p95_ttft_ms": 1000 * percentile(values, 95),
+        }
+        for mode, values in (("full_prefill", cold), ("prefix_reuse", warm))
+    ]
+    agreement = sum(a == b for a, b in zip(reference, reused)) / len(reference)
+
+    print()
+    print(markdown_table(rows, ["mode", "mean_ttft_ms", "p50_ttft_ms", "p95_ttft_ms"]))
+    print()
+    print(f"📏 Prefixo: {prefix_stats['prefixes']} tokens | sufixo médio ≈ "
+          f"{sum(estimate_tokens(p[len(template.static_prefix):]) for p in prompts) / len(prompts):.0f} tokens")
+    print(f"⚙️ Construção do estado do prefixo (1ª requisição): {1000 * build_seconds:.0f} ms")
+    print(f"🎯 Saídas idênticas com e sem reuso ({args.check_tokens} tokens): {agreement:.0%}")
+    write_json(args.json, {
+        "model": service.model_name,
+        "prefix_reuse_supported": supported,
+        "prefix_cache": prefix_stats,
+        "prefix_build_seconds": build_seconds,
+        "results": rows,
+        "output_agreement": agreement,
+        "first_token_outputs_equal": cold_outputs == warm_outputs,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark: modelo local em fp32 vs int8 dinâmico vs bf16.
+
+Cada precisão roda em um subprocesso próprio (RSS não contaminado pelos
+outros modelos) sobre o mesmo conjunto fixo de imagens, com decodificação
+gulosa. Relata tempo de carga, RSS, latência por token e concordância das
+saídas com o modelo fp32 (igualdade exata e similaridade por palavras).
+
+Uso (a partir de backend/):
+    python -m benchmarks.local_quantization --precisions fp32,int8,bf16 --images 8
+"""
+
+import argparse
+import base64
+import difflib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import image_to_b64, markdown_table, rss_bytes, synthetic_study, write_json
+
+
+def load_images(args):
+    """Imagens fixas: arquivos de --image-dir ou estudos sintéticos com sementes fixas."""
+    if args.image_dir:
+        names = sorted(os.listdir(args.image_dir))[:args.images]
+        from PIL import Image
+        return [image_to_b64(Image.open(os.path.join(args.image_dir, name))) for name in names]
+    return [image_to_b64(synthetic_study(seed=seed)) for seed in range(args.images)]
+
+
+def run_worker(args):
+    import torch
+    from PIL import Image
+    from services.local_model_service import load_local_model
+
+    torch.set_num_threads(args.threads)
+    started = time.perf_counter()
+    processor, model, effective = load_local_model(args.model, args.worker)
+    load_seconds = time.perf_counter() - started
+    memory_after_load = rss_bytes()
+
+    outputs, token_latencies = [], []
+    generated_total = 0
+    for image_b64 in load_images(args):
+        image = Image.open(io.BytesIO(base64.b64decode(image_b64))).convert("RGB")
+        inputs = processor(images=image, return_tensors="pt")
+        if effective == "bf16":
+            inputs["pixel_values"] = inputs["pixel_values"].to(torch.bfloat16)
+        started = time.perf_counter()
+        with torch.inference_mode():
+            output_ids = model.generate(**inputs, max_new_tokens=args.max_new_tokens, do_sample=False)
+        elapsed = time.perf_counter() - started
+        generated = max(int(output_ids.shape[-1]) - 1, 1)
+        generated_total += generated
+        token_latencies.append(elapsed / generated)
+        outputs.append(processor.batch_decode(output_ids, skip_special_tokens=True)[0].strip())
+
+    print(json.dumps({
+        "precision": args.worker,
+        "effective_precision": effective,
+        "load_seconds": load_seconds,
+        "rss_after_load_bytes": memory_after_load["rss_bytes"],
+        "peak_rss_bytes": rss_bytes()["peak_rss_bytes"],
+        "per_token_ms": 1000 * sum(token_latencies) / len(token_latencies),
+        "generated_tokens": generated_total,
+        "outputs": outputs,
+    }, ensure_ascii=False))
+
+
+def agreement(reference, outputs):
+    exact = sum(a == b for a, b in zip(reference, outputs)) / len(reference)
+    similarity = sum(
+        difflib.SequenceMatcher(None, a.split(), b.split()).ratio() for a, b in zip(reference, outputs)
+    ) / len(reference)
+    return exact, similarity
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--precisions", default="fp32,int8,bf16")
+    parser.add_argument("--images", type=int, default=8, help="quantidade de imagens do conjunto fixo")
+    parser.add_argument("--image-dir", help="diretório com imagens reais (padrão: estudos sintéticos)")
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--model", default=None, help="modelo (padrão: LOCAL_MODEL_NAME)")
+    parser.add_argument("--json", help="arquivo de saída com os resultados")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.model is None:
+        from config import LOCAL_MODEL_NAME
+        args.model = LOCAL_MODEL_NAME
+    if args.worker:
+        return run_worker(args)
+
+    precisions = [p.strip() for p in args.precisions.split(",") if p.strip()]
+    if "fp32" not in precisions:
+        precisions.insert(0, "fp32")  # referência para a concordância
+
+    results = {}
+    for precision in precisions:
+        print(f"⏳ Executando {precision}...")
+        command = [
+            sys.executable, "-m", "benchmarks.local_quantization", "--worker", precision,
+            "--images", str(args.images), "--max-new-tokens", str(args.max_new_tokens),
+            "--threads", str(args.threads), "--model", args.model,
+        ] + (["--image-dir", args.image_dir] if args.image_dir else [])
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"❌ {precision} falhou:\n{completed.stderr[-2000:]}")
+            continue
+        results[precision] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    if "fp32" not in results:
+        raise SystemExit("❌ Execução de referência (fp32) falhou")
+    rows = []
+    for precision, result in results.items():
+        exact, similarity = agreement(results["fp32"]["outputs"], result["outputs"])
+        rows.append({
+            "precision": precision,
+            "effective": result["effective_precision"],
+            "load_s": result["load_seconds"],
+            "rss_mb": result["rss_after_load_bytes"] / 2**20 if result["rss_after_load_bytes"] else None,
+            "peak_rss_mb": result["peak_rss_bytes"] / 2**20 if result["peak_rss_bytes"] else None,
+            "per_token_ms": result["per_token_ms"],
+            "exact_match": exact,
+            "word_similarity": similarity,
+        })
+
+    print()
+    print(markdown_table(rows, [
+        "precision", "effective", "load_s", "rss_mb", "peak_rss_mb", "per_token_ms", "exact_match", "word_similarity"
+    ]))
+    write_json(args.json, {"model": args.model, "images": args.images, "summary": rows, "runs": results})
+
+
+if __name__ == "__main__":
+    main()
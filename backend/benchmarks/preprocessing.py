@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark do pré-processamento de imagens do HuggingFaceService.
+
+Para cada combinação de tamanho, modo (L, I;16, RGB, RGBA, P) e formato de
+entrada (PNG, JPEG, TIFF) chama, etapa por etapa, os mesmos métodos do
+serviço: decode (_open_image), convert (_convert_image), resize
+(_resize_image), encode (_encode_jpeg) e base64 (_to_base64), as etapas de
+_normalize_image e _encode_image. Para cada etapa registra a mediana
+do tempo, o pico de alocações Python (tracemalloc) e, no Linux, o aumento
+do pico de RSS (que inclui os buffers de pixels alocados pelo Pillow).
+
+Os resultados vão para um JSON; com --baseline, cada etapa é comparada com
+uma execução anterior e regressões acima de --threshold são sinalizadas.
+
+Uso (a partir de backend/):
+    python -m benchmarks.preprocessing --json prep.json
+    python -m benchmarks.preprocessing --sizes 256,1024 --baseline prep.json --fail-on-regression
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from benchmarks.common import markdown_table, parse_int_list, rss_bytes, synthetic_study, write_json
+from services.huggingface_service import HuggingFaceService
+
+STAGES = ["decode", "convert", "resize", "encode", "base64"]
+MODES = ["L", "I;16", "RGB", "RGBA", "P"]
+FORMATS = ["PNG", "JPEG", "TIFF"]
+JPEG_MODES = {"L", "RGB"}
+
+
+def make_input(size: int, mode: str, format: str) -> bytes:
+    """Estudo sintético no modo e formato pedidos (gerado em até 2048 px e ampliado)."""
+    base = synthetic_study(min(size, 2048))
+    if base.size[0] != size:
+        base = base.resize((size, size), Image.Resampling.BILINEAR)
+    if mode == "I;16":
+        image = Image.fromarray(np.asarray(base, dtype=np.uint16) * 257)
+    elif mode == "RGB":
+        image = Image.merge("RGB", (base, base.point(lambda v: v * 0.9), base))
+    elif mode == "RGBA":
+        image = Image.merge("RGBA", (base, base, base, base.point(lambda v: 255)))
+    elif mode == "P":
+        image = base.convert("RGB").convert("P", palette=Image.Palette.ADAPTIVE)
+    else:
+        image = base
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def reset_peak_rss() -> bool:
+    """Zera o pico de RSS (VmHWM) do processo; só disponível no Linux."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def run_pipeline(data: bytes) -> Dict[str, Dict[str, Any]]:
+    """Uma execução das cinco etapas, com tempo, pico tracemalloc e pico de RSS de cada uma."""
+    measurements: Dict[str, Dict[str, Any]] = {}
+    state: Dict[str, Any] = {}
+
+    def decode():
+        state["image"] = HuggingFaceService._open_image(data)
+
+    def convert():
+        state["image"] = HuggingFaceService._convert_image(state["image"])
+
+    def resize():
+        state["image"] = HuggingFaceService._resize_image(state["image"])
+
+    def encode():
+        state["jpeg"] = HuggingFaceService._encode_jpeg(state["image"])
+
+    def encode_base64():
+        state["b64"] = HuggingFaceService._to_base64(state["jpeg"])
+
+    for stage, step in zip(STAGES, [decode, convert, resize, encode, encode_base64]):
+        rss_before = rss_bytes()["rss_bytes"]
+        can_track_rss = reset_peak_rss() and rss_before is not None
+        tracemalloc.start()
+        started = time.perf_counter()
+        step()
+        elapsed = time.perf_counter() - started
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak = rss_bytes()["peak_rss_bytes"] if can_track_rss else None
+        measurements[stage] = {
+            "ms": elapsed * 1000,
+            "py_peak_kb": python_peak / 1024,
+            "rss_peak_delta_kb": max(0, peak - rss_before) / 1024 if peak is not None else None,
+        }
+    measurements["_output"] = {"base64_chars": len(state["b64"]), "size": state["image"].size}
+    return measurements
+
+
+def bench_case(size: int, mode: str, format: str, repeat: int) -> Dict[str, Any]:
+    case = {"size": size, "mode": mode, "format": format}
+    if format == "JPEG" and mode not in JPEG_MODES:
+        return {**case, "skipped": f"JPEG não suporta o modo {mode}"}
+    try:
+        data = make_input(size, mode, format)
+        runs = [run_pipeline(data) for _ in range(repeat)]
+    except Exception as e:
+        return {**case, "error": str(e)}
+
+    stages = {}
+    for stage in STAGES:
+        rss_deltas = [run[stage]["rss_peak_delta_kb"] for run in runs if run[stage]["rss_peak_delta_kb"] is not None]
+        stages[stage] = {
+            "ms": statistics.median(run[stage]["ms"] for run in runs),
+            "min_ms": min(run[stage]["ms"] for run in runs),
+            "py_peak_kb": max(run[stage]["py_peak_kb"] for run in runs),
+            "rss_peak_delta_kb": max(rss_deltas) if rss_deltas else None,
+        }
+    return {
+        **case,
+        "input_bytes": len(data),
+        "output_size": list(runs[0]["_output"]["size"]),
+        "base64_chars": runs[0]["_output"]["base64_chars"],
+        "stages": stages,
+        "total_ms": sum(stage["ms"] for stage in stages.values()),
+    }
+
+
+def case_key(case: Dict[str, Any]) -> str:
+    return f"{case['size']}/{case['mode']}/{case['format']}"
+
+
+def compare(cases: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float, min_ms: float) -> List[Dict[str, Any]]:
+    """Etapas mais lentas que a referência em mais de ``threshold`` (e ``min_ms`` em valor absoluto)."""
+    previous = {case_key(case): case for case in baseline.get("cases", []) if "stages" in case}
+    regressions = []
+    for case in cases:
+        reference = previous.get(case_key(case))
+        if reference is None or "stages" not in case:
+            continue
+        for stage in STAGES + ["total"]:
+            current_ms = case["total_ms"] if stage == "total" else case["stages"][stage]["ms"]
+            reference_ms = reference["total_ms"] if stage == "total" else reference["stages"][stage]["ms"]
+            if current_ms - reference_ms > min_ms and current_ms > reference_ms * (1 + threshold):
+                regressions.append({
+                    "case": case_key(case),
+                    "stage": stage,
+                    "baseline_ms": reference_ms,
+                    "current_ms": current_ms,
+                    "change": current_ms / reference_ms - 1 if reference_ms else None,
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="256,1024,2048,4096,8000", help="lados das imagens em px")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--repeat", type=int, default=3, help="execuções por combinação (mediana)")
+    parser.add_argument("--json", help="arquivo de saída com os resultados")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regressão relativa tolerada (0.2 = 20%%)")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="diferença absoluta mínima para sinalizar")
+    parser.add_argument("--fail-on-regression", action="store_true", help="sai com código 1 se houver regressões")
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    formats = [format.strip().upper() for format in args.formats.split(",") if format.strip()]
+
+    cases = []
+    for size in parse_int_list(args.sizes):
+        for mode in modes:
+            for format in formats:
+                case = bench_case(size, mode, format, args.repeat)
+                cases.append(case)
+                if "stages" in case:
+                    print(f"⏱️ {case_key(case):>18}: {case['total_ms']:8.1f} ms | " + ", ".join(
+                        f"{stage} {case['stages'][stage]['ms']:.1f}" for stage in STAGES
+                    ))
+                else:
+                    print(f"⏭️ {case_key(case):>18}: {case.get('skipped') or case.get('error')}")
+
+    rows = [
+        {
+            "case": case_key(case),
+            "input_kb": case["input_bytes"] / 1024,
+            **{f"{stage}_ms": case["stages"][stage]["ms"] for stage in STAGES},
+            "total_ms": case["total_ms"],
+            "peak_rss_mb": max(
+                (case["stages"][stage]["rss_peak_delta_kb"] or 0) for stage in STAGES
+            ) / 1024,
+        }
+        for case in cases if "stages" in case
+    ]
+    print()
+    print(markdown_table(rows, ["case", "input_kb"] + [f"{stage}_ms" for stage in STAGES] + ["total_ms", "peak_rss_mb"]))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(cases, baseline, args.threshold, args.min_ms)
+        print()
+        if regressions:
+            print(f"🚨 {len(regressions)} regressões acima de {args.threshold:.0%}:")
+            print(markdown_table(regressions, ["case", "stage", "baseline_ms", "current_ms", "change"]))
+        else:
+            print(f"✅ Nenhuma regressão acima de {args.threshold:.0%} em relação a {args.baseline}")
+
+    write_json(args.json, {
+        "environment": {
+            "python": sys.version.split()[0],
+            "pillow": PIL.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "repeat": args.repeat,
+        "cases": cases,
+        "baseline": args.baseline,
+        "regressions": regressions,
+    })
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
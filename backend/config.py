@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -20,6 +21,112 @@ MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "32000"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.3"))
 TOP_P = float(os.getenv("TOP_P", "0.95"))
 
+# Image Quality Gate - verificação rápida antes de chamar o modelo
+# Modos: "reject" (recusa a imagem), "flag" (gera o relatório com aviso), "off"
+IMAGE_QUALITY_GATE = os.getenv("IMAGE_QUALITY_GATE", "reject").lower()
+IMAGE_QUALITY_MIN_DIMENSION = int(os.getenv("IMAGE_QUALITY_MIN_DIMENSION", "128"))
+IMAGE_QUALITY_MIN_DYNAMIC_RANGE = float(os.getenv("IMAGE_QUALITY_MIN_DYNAMIC_RANGE", "12"))
+IMAGE_QUALITY_MAX_CLIPPED_FRACTION = float(os.getenv("IMAGE_QUALITY_MAX_CLIPPED_FRACTION", "0.85"))
+IMAGE_QUALITY_MIN_LAPLACIAN_VARIANCE = float(os.getenv("IMAGE_QUALITY_MIN_LAPLACIAN_VARIANCE", "2.0"))
+
+# Near-Duplicate Detection - reaproveita relatórios de estudos reenviados
+# Modos: "offer" (gera um novo relatório e indica o anterior como candidato),
+# "serve" (devolve o relatório existente sem chamar o modelo), "off"
+NEAR_DUPLICATE_MODE = os.getenv("NEAR_DUPLICATE_MODE", "offer").lower()
+NEAR_DUPLICATE_ALGORITHM = os.getenv("NEAR_DUPLICATE_ALGORITHM", "phash").lower()
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "8"))
+NEAR_DUPLICATE_INDEX_SIZE = int(os.getenv("NEAR_DUPLICATE_INDEX_SIZE", "5000"))
+
+# Streaming - permite encerrar a geração cedo (echo do prompt ou relatório completo)
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
+STREAM_ECHO_CHECK_CHARS = int(os.getenv("STREAM_ECHO_CHECK_CHARS", "300"))
+
+# Token Budget - max_tokens aprendido a partir dos tamanhos observados
+# (MAX_NEW_TOKENS é o teto absoluto)
+TOKEN_BUDGET_PERCENTILE = float(os.getenv("TOKEN_BUDGET_PERCENTILE", "95"))
+TOKEN_BUDGET_MARGIN = float(os.getenv("TOKEN_BUDGET_MARGIN", "0.25"))
+TOKEN_BUDGET_MIN_SAMPLES = int(os.getenv("TOKEN_BUDGET_MIN_SAMPLES", "20"))
+
+# Two-Stage Pipeline - achados da imagem em cache, síntese apenas em texto
+TWO_STAGE_ENABLED = os.getenv("TWO_STAGE_ENABLED", "false").lower() == "true"
+FINDINGS_CACHE_SIZE = int(os.getenv("FINDINGS_CACHE_SIZE", "512"))
+FINDINGS_CACHE_TTL_SECONDS = float(os.getenv("FINDINGS_CACHE_TTL_SECONDS", "86400"))
+
+# Follow-up Sessions - perguntas sobre um estudo já analisado
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MEMORY_BUDGET_MB = int(os.getenv("SESSION_MEMORY_BUDGET_MB", "256"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+FOLLOWUP_MAX_TOKENS = int(os.getenv("FOLLOWUP_MAX_TOKENS", "1024"))
+
+# Pre-upload - imagens pré-processadas enquanto o formulário é preenchido
+IMAGE_STORE_SIZE = int(os.getenv("IMAGE_STORE_SIZE", "64"))
+IMAGE_STORE_TTL_SECONDS = float(os.getenv("IMAGE_STORE_TTL_SECONDS", "900"))
+
+# Resumable Uploads - envio em blocos com retomada (spool em disco)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "medical-ai-uploads"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_KB", "512")) * 1024
+UPLOAD_TTL_SECONDS = float(os.getenv("UPLOAD_TTL_SECONDS", "86400"))
+
+# Upstream Micro-batching - agrupa relatórios pendentes em uma única chamada
+# (apenas quando o formato negociado aceita entradas em lista)
+UPSTREAM_BATCH_ENABLED = os.getenv("UPSTREAM_BATCH_ENABLED", "true").lower() == "true"
+UPSTREAM_BATCH_MAX_SIZE = int(os.getenv("UPSTREAM_BATCH_MAX_SIZE", "8"))
+UPSTREAM_BATCH_MAX_WAIT_MS = float(os.getenv("UPSTREAM_BATCH_MAX_WAIT_MS", "20"))
+
+# Local Model - inferência em CPU com transformers
+# Modos: "off", "fallback" (usado quando o endpoint está inacessível), "only"
+LOCAL_MODEL_MODE = os.getenv("LOCAL_MODEL_MODE", "off").lower()
+LOCAL_MODEL_NAME = os.getenv("LOCAL_MODEL_NAME", "Salesforce/blip-image-captioning-base")
+LOCAL_MODEL_THREADS = int(os.getenv("LOCAL_MODEL_THREADS", "4"))
+LOCAL_MODEL_CPUS = os.getenv("LOCAL_MODEL_CPUS", "")  # ex.: "0-3"
+LOCAL_MODEL_MAX_NEW_TOKENS = int(os.getenv("LOCAL_MODEL_MAX_NEW_TOKENS", "256"))
+LOCAL_MODEL_TEXT_PREFIX = os.getenv("LOCAL_MODEL_TEXT_PREFIX", "")
+# Precisão: "fp32", "int8" (Linear quantizado dinamicamente) ou "bf16" (se a CPU suportar)
+LOCAL_MODEL_PRECISION = os.getenv("LOCAL_MODEL_PRECISION", "fp32").lower()
+# Prompt: "prefix" (captioner, usa LOCAL_MODEL_TEXT_PREFIX) ou "template" (modelo que
+# segue instruções, recebe o prompt completo com o estado do bloco estático reaproveitado)
+LOCAL_MODEL_PROMPT_MODE = os.getenv("LOCAL_MODEL_PROMPT_MODE", "prefix").lower()
+LOCAL_PREFIX_CACHE_ENABLED = os.getenv("LOCAL_PREFIX_CACHE_ENABLED", "true").lower() == "true"
+# Cache de embeddings da imagem (torre de visão); 0 desativa, spill em .npy opcional
+LOCAL_EMBEDDING_CACHE_MB = int(os.getenv("LOCAL_EMBEDDING_CACHE_MB", "256"))
+LOCAL_EMBEDDING_SPILL_DIR = os.getenv("LOCAL_EMBEDDING_SPILL_DIR", "")
+LOCAL_EMBEDDING_SPILL_MAX_MB = int(os.getenv("LOCAL_EMBEDDING_SPILL_MAX_MB", "2048"))
+# Lotes dinâmicos no modelo local (LOCAL_BATCH_MAX_SIZE=1 desativa)
+LOCAL_BATCH_MAX_SIZE = int(os.getenv("LOCAL_BATCH_MAX_SIZE", "4"))
+LOCAL_BATCH_MAX_WAIT_MS = float(os.getenv("LOCAL_BATCH_MAX_WAIT_MS", "10"))
+# Gravação/reprodução do tráfego com o endpoint (off | record | replay); arquivo .jsonl.gz
+# e velocidade da reprodução (1 = ritmo original, 0 = sem esperas)
+UPSTREAM_TRAFFIC_MODE = os.getenv("UPSTREAM_TRAFFIC_MODE", "off").lower()
+UPSTREAM_TRAFFIC_ARCHIVE = os.getenv("UPSTREAM_TRAFFIC_ARCHIVE", "upstream_traffic.jsonl.gz")
+UPSTREAM_REPLAY_SPEED = float(os.getenv("UPSTREAM_REPLAY_SPEED", "1.0"))
+# Endpoint /metrics (formato Prometheus) e métricas por rota
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Logs estruturados: nível, formato (text | json) e fração de respostas do endpoint
+# despejadas por completo em DEBUG; corpos recentes ficam em memória (ver /debug/upstream-bodies)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+UPSTREAM_BODY_BUFFER_SIZE = int(os.getenv("UPSTREAM_BODY_BUFFER_SIZE", "50"))
+UPSTREAM_BODY_MAX_CHARS = int(os.getenv("UPSTREAM_BODY_MAX_CHARS", "20000"))
+# Tracing por requisição: exportação dos spans (off | file | otlp) para um arquivo
+# JSON Lines (OTLP/JSON) ou um coletor OTLP/HTTP, e cabeçalho Server-Timing nas respostas
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "off").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "medai-backend")
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+# Token exigido (cabeçalho X-Admin-Token) pelos endpoints de diagnóstico; vazio os desativa
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Duração máxima de um perfil de CPU sob demanda (/debug/profile/cpu)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Monitor de atraso do event loop: intervalo da sonda e atraso a partir do qual
+# o bloqueio é registrado com a pilha da chamada responsável
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+
 # Validation
 def validate_config():
     """Validate that required configuration is present."""
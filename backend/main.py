@@ -3,11 +3,18 @@ Medical AI Report Backend
 FastAPI server for generating medical reports using a dedicated Hugging Face service.
 """
 
+import secrets
 import sys
-from fastapi import FastAPI, HTTPException
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Header, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, Optional
 
 # Import configuration
 from config import (
@@ -15,7 +22,45 @@ from config import (
     MEDGEMMA_MODEL_URL,
     API_HOST,
     API_PORT,
-    CORS_ORIGINS
+    CORS_ORIGINS,
+    UPLOAD_SPOOL_DIR,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_TTL_SECONDS,
+    LOCAL_MODEL_MODE,
+    METRICS_ENABLED,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_PAYLOAD_SAMPLE_RATE,
+    ADMIN_TOKEN,
+    PROFILE_MAX_SECONDS,
+    LOOP_MONITOR_ENABLED,
+    LOOP_MONITOR_INTERVAL_MS,
+    LOOP_BLOCK_THRESHOLD_MS,
+    TRACING_EXPORTER,
+    TRACING_FILE,
+    TRACING_OTLP_ENDPOINT,
+    TRACING_SERVICE_NAME,
+    SERVER_TIMING_ENABLED
+)
+from services.loop_monitor import LoopLagMonitor
+from services.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, REGISTRY
+from services.structured_logging import configure_logging, get_logger
+from services.profiling import (
+    ProfilerBusyError,
+    memory_snapshot,
+    sample_cpu,
+    start_memory_tracing,
+    stop_memory_tracing,
+    task_stacks
+)
+from services.tracing import configure_tracing, server_timing, start_span, tracing_enabled
+
+# Logs saem por uma fila e são escritos em uma thread própria (fora do event loop)
+configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_PAYLOAD_SAMPLE_RATE)
+logger = get_logger("api")
+configure_tracing(
+    TRACING_EXPORTER, TRACING_FILE, TRACING_OTLP_ENDPOINT, TRACING_SERVICE_NAME, server_timing=SERVER_TIMING_ENABLED
 )
 
 # --- LÓGICA DE INICIALIZAÇÃO DO SERVIÇO CORRIGIDA ---
@@ -27,26 +72,45 @@ SERVICE_INITIALIZATION_ERROR = None
 try:
     # Tenta importar as classes de serviço
     from services.huggingface_service import HuggingFaceService, DemoHuggingFaceService
+    from services.image_quality import ImageQualityError
+    from services.sessions import SessionNotFoundError
+    from services.image_store import ImageNotFoundError
     
     # Decide qual serviço instanciar com base no token da API
-    if HUGGINGFACE_API_TOKEN:
+    if LOCAL_MODEL_MODE == "only":
+        from services.local_model_service import LocalModelService
+        ai_service = LocalModelService()
+        logger.info(f"🖥️ Local model service initialized ({ai_service.model_name}, loaded on first request).")
+    elif HUGGINGFACE_API_TOKEN:
         ai_service = HuggingFaceService(
             api_token=HUGGINGFACE_API_TOKEN,
             model_url=MEDGEMMA_MODEL_URL
         )
-        print("✅ Real Hugging Face service initialized.")
-        print(f"🔗 Primary endpoint: {MEDGEMMA_MODEL_URL}")
+        logger.info("✅ Real Hugging Face service initialized.")
+        logger.info(f"🔗 Primary endpoint: {MEDGEMMA_MODEL_URL}")
+        if LOCAL_MODEL_MODE == "fallback":
+            from services.local_model_service import LocalModelService
+            ai_service.local_fallback = LocalModelService()
+            logger.info(f"🖥️ Local fallback model: {ai_service.local_fallback.model_name}")
     else:
         ai_service = DemoHuggingFaceService()
-        print("⚠️  Hugging Face token not found. Initializing in DEMO mode.")
+        logger.warning("⚠️  Hugging Face token not found. Initializing in DEMO mode.")
+
+    # Gauges de filas e caches apontam só para a instância que atende a API
+    if hasattr(ai_service, "register_metrics"):
+        ai_service.register_metrics()
 
 except ImportError:
     # Captura o erro se 'huggingface_service.py' não for encontrado
     SERVICE_INITIALIZATION_ERROR = "CRITICAL: 'huggingface_service.py' not found. The API cannot process reports."
-    print(f"❌ {SERVICE_INITIALIZATION_ERROR}")
+    logger.error(f"❌ {SERVICE_INITIALIZATION_ERROR}")
 except Exception as e:
     SERVICE_INITIALIZATION_ERROR = f"CRITICAL: An unexpected error occurred while initializing services: {e}"
-    print(f"❌ {SERVICE_INITIALIZATION_ERROR}")
+    logger.error(f"❌ {SERVICE_INITIALIZATION_ERROR}")
+
+# Spool em disco para uploads em blocos (retomáveis)
+from services.uploads import UploadError, UploadNotFoundError, UploadOffsetError, UploadSpool
+upload_spool = UploadSpool(UPLOAD_SPOOL_DIR, max_upload_bytes=UPLOAD_MAX_BYTES, ttl_seconds=UPLOAD_TTL_SECONDS)
 
 # Import de dependências adicionais
 try:
@@ -56,8 +120,19 @@ except ImportError:
     PIL_AVAILABLE = False
 # ----------------------------------------------------
 
+loop_monitor = LoopLagMonitor(LOOP_MONITOR_INTERVAL_MS / 1000, LOOP_BLOCK_THRESHOLD_MS / 1000)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the event-loop lag monitor while the app is serving."""
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    yield
+    await loop_monitor.stop()
+
 # Initialize the main FastAPI application
 app = FastAPI(
+    lifespan=lifespan,
     title="Medical AI Report API",
     version="2.1.0",
     description="Refactored API with robust service initialization.",
@@ -74,17 +149,87 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _route_template(request: Request) -> str:
+    """Route path template (e.g. /images/{image_id}), keeping metric labels bounded."""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Latency and in-flight count per route for /metrics."""
+    if not METRICS_ENABLED:
+        return await call_next(request)
+    route = _route_template(request)
+    started = time.perf_counter()
+    status = "500"
+    HTTP_IN_FLIGHT.inc(route=route)
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec(route=route)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, status=status)
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """Root span per request; its stage breakdown goes back in the Server-Timing header."""
+    if not tracing_enabled():
+        return await call_next(request)
+    route = _route_template(request)
+    with start_span(
+        f"{request.method} {route}", kind="server",
+        **{
+            "http.method": request.method,
+            "http.route": route,
+            "http.request_content_length": int(request.headers.get("content-length") or 0),
+        }
+    ) as span:
+        response = await call_next(request)
+        span.set_attributes(**{
+            "http.status_code": response.status_code,
+            "http.response_content_length": int(response.headers.get("content-length") or 0),
+        })
+        if SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = server_timing(span)
+        return response
+
 # Pydantic models
 class ReportRequest(BaseModel):
-    image: str
+    image: Optional[str] = None
+    image_id: Optional[str] = None
     age: str
     weight: str
     clinical_history: str
+    force_regenerate: bool = False
+    modality: Optional[str] = None
+    language: Optional[str] = None
+    create_session: bool = False
 
 class ReportResponse(BaseModel):
     report: str
     success: bool
     message: Optional[str] = None
+    session_id: Optional[str] = None
+    reused_candidate: Optional[Dict[str, Any]] = None
+
+class UploadInitRequest(BaseModel):
+    total_size: int
+    filename: Optional[str] = None
+
+class UploadCommitRequest(BaseModel):
+    sha256: Optional[str] = None
+
+class FollowUpRequest(BaseModel):
+    question: str
+
+class FollowUpResponse(BaseModel):
+    answer: str
+    session_id: str
+    success: bool
 
 
 # API Endpoints
@@ -107,6 +252,202 @@ async def health_check():
         "service_status": service_status
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the pipeline metrics."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _require_admin(token: Optional[str]) -> None:
+    """Diagnostic endpoints are only enabled with ADMIN_TOKEN and require it in X-Admin-Token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Diagnostic endpoints are disabled.")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+@app.get("/debug/upstream-bodies")
+async def upstream_bodies(limit: int = Query(20, ge=1, le=500), x_admin_token: Optional[str] = Header(None)):
+    """Most recent upstream response bodies (newest first), kept in memory instead of being logged."""
+    _require_admin(x_admin_token)
+    if not ai_service or not hasattr(ai_service, 'upstream_bodies'):
+        raise HTTPException(status_code=501, detail="Upstream bodies are not available in this mode.")
+    return {"bodies": ai_service.upstream_bodies.recent(limit)}
+
+def _profile_response(result: dict, format: str):
+    """Collapsed stacks as plain text (flamegraph.pl, speedscope) or the full result as JSON."""
+    if format == "collapsed":
+        return PlainTextResponse(result["collapsed"])
+    return result
+
+@app.get("/debug/profile/cpu")
+async def profile_cpu(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    include_idle: bool = False,
+    format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Sample every thread's stack for a few seconds (the sampler runs off the event loop)."""
+    _require_admin(x_admin_token)
+    if seconds > PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {PROFILE_MAX_SECONDS:g}.")
+    try:
+        result = await asyncio.to_thread(sample_cpu, seconds, interval_ms / 1000, include_idle)
+    except ProfilerBusyError as busy:
+        raise HTTPException(status_code=409, detail=str(busy))
+    logger.info("🔥 Perfil de CPU coletado", extra={k: v for k, v in result.items() if k != "collapsed"})
+    return _profile_response(result, format)
+
+@app.post("/debug/profile/memory/start")
+async def start_memory_profile(frames: int = Query(25, ge=1, le=100), x_admin_token: Optional[str] = Header(None)):
+    """Start tracemalloc (allocations are only traced from now on, until stopped)."""
+    _require_admin(x_admin_token)
+    return {"started": start_memory_tracing(frames)}
+
+@app.post("/debug/profile/memory/stop")
+async def stop_memory_profile(x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    stop_memory_tracing()
+    return {"stopped": True}
+
+@app.get("/debug/profile/memory")
+async def profile_memory(
+    limit: int = Query(25, ge=1, le=500),
+    compare: bool = False,
+    format: str = Query("json", pattern="^(collapsed|json)$"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Top allocators since tracing started (or growth since the previous snapshot with compare=true)."""
+    _require_admin(x_admin_token)
+    try:
+        result = await asyncio.to_thread(memory_snapshot, limit, compare)
+    except RuntimeError as not_tracing:
+        raise HTTPException(status_code=409, detail=f"{not_tracing}: POST /debug/profile/memory/start first.")
+    return _profile_response(result, format)
+
+@app.get("/debug/loop-blocks")
+async def loop_blocks(limit: int = Query(20, ge=1, le=500), x_admin_token: Optional[str] = Header(None)):
+    """Recent event-loop blocks over LOOP_BLOCK_THRESHOLD_MS with the stack of the blocking call."""
+    _require_admin(x_admin_token)
+    return {
+        "enabled": LOOP_MONITOR_ENABLED,
+        "threshold_ms": LOOP_BLOCK_THRESHOLD_MS,
+        "blocks": loop_monitor.recent_blocks(limit)
+    }
+
+@app.get("/debug/tasks")
+async def asyncio_tasks(
+    format: str = Query("json", pattern="^(collapsed|json)$"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Where each pending asyncio task is currently suspended."""
+    _require_admin(x_admin_token)
+    return _profile_response(task_stacks(), format)
+
+@app.post("/images")
+async def upload_image(file: UploadFile = File(...)):
+    """
+    Pre-upload an image as soon as it is selected.
+
+    Preprocessing starts in the background and the returned image_id can be
+    sent to /generate_report instead of the base64 image.
+    """
+    if not ai_service or not hasattr(ai_service, 'submit_image'):
+        raise HTTPException(status_code=501, detail="Image pre-upload is not available in this mode.")
+
+    image_data = await file.read()
+    if not image_data:
+        raise HTTPException(status_code=400, detail="Empty image.")
+
+    try:
+        image_id = ai_service.submit_image(image_data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+    return {"image_id": image_id, "status": "processing"}
+
+@app.get("/images/{image_id}")
+async def image_status(image_id: str):
+    """Preprocessing status of a pre-uploaded image (processing, ready, rejected)."""
+    if not ai_service or not hasattr(ai_service, 'image_store'):
+        raise HTTPException(status_code=501, detail="Image pre-upload is not available in this mode.")
+    try:
+        return ai_service.image_store.status(image_id)
+    except ImageNotFoundError as not_found:
+        raise HTTPException(status_code=404, detail=str(not_found))
+
+def _upload_http_error(error: UploadError) -> HTTPException:
+    """Map spool errors to HTTP status codes (404 unknown, 409 wrong offset, 400 invalid)."""
+    if isinstance(error, UploadNotFoundError):
+        return HTTPException(status_code=404, detail=str(error))
+    if isinstance(error, UploadOffsetError):
+        return HTTPException(
+            status_code=409,
+            detail={"message": str(error), "offset": error.expected_offset}
+        )
+    return HTTPException(status_code=400, detail=str(error))
+
+@app.post("/uploads")
+async def init_upload(request: UploadInitRequest):
+    """Start a resumable chunked upload for a large image."""
+    try:
+        upload = await asyncio.to_thread(upload_spool.init, request.total_size, request.filename)
+    except UploadError as upload_error:
+        raise _upload_http_error(upload_error)
+    return {**upload, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Current offset of an upload, used by the client to resume after a drop."""
+    try:
+        return await asyncio.to_thread(upload_spool.status, upload_id)
+    except UploadError as upload_error:
+        raise _upload_http_error(upload_error)
+
+@app.put("/uploads/{upload_id}")
+async def append_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    x_chunk_sha256: Optional[str] = Header(None)
+):
+    """Append one chunk (raw request body) at the given offset."""
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty chunk.")
+    try:
+        return await asyncio.to_thread(upload_spool.append, upload_id, offset, data, x_chunk_sha256)
+    except UploadError as upload_error:
+        raise _upload_http_error(upload_error)
+
+@app.post("/uploads/{upload_id}/commit")
+async def commit_upload(upload_id: str, request: UploadCommitRequest):
+    """
+    Finish the upload and start preprocessing; content already seen reuses
+    its preprocessed result. Returns the image_id for /generate_report.
+    """
+    if not ai_service or not hasattr(ai_service, 'submit_image'):
+        raise HTTPException(status_code=501, detail="Image pre-upload is not available in this mode.")
+    try:
+        upload = await asyncio.to_thread(upload_spool.commit, upload_id, request.sha256)
+    except UploadError as upload_error:
+        raise _upload_http_error(upload_error)
+
+    try:
+        image_id = ai_service.submit_image(upload["data"], content_hash=upload["sha256"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+    return {"image_id": image_id, "sha256": upload["sha256"], "status": "processing"}
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    """Abort an upload and delete its spooled bytes."""
+    try:
+        await asyncio.to_thread(upload_spool.abort, upload_id)
+    except UploadError as upload_error:
+        raise _upload_http_error(upload_error)
+    return {"success": True, "upload_id": upload_id}
+
 @app.post("/generate_report", response_model=ReportResponse)
 async def generate_report(request: ReportRequest):
     """
@@ -120,31 +461,85 @@ async def generate_report(request: ReportRequest):
         )
 
     try:
-        if not all([request.image, request.age, request.weight, request.clinical_history]):
+        if not all([request.image or request.image_id, request.age, request.weight, request.clinical_history]):
             raise HTTPException(status_code=400, detail="All fields are required.")
 
-        print(f"🚀 Initiating AI processing for patient aged {request.age}...")
+        logger.info("🚀 Initiating AI processing", extra={"image_id": request.image_id, "modality": request.modality})
+        
+        # Sessões só existem no serviço real (o modo demo não guarda estado)
+        session_id = None
+        if request.create_session and hasattr(ai_service, 'ask_followup'):
+            session_id = uuid.uuid4().hex
         
+        details: Dict[str, Any] = {}
         report_text = await ai_service.analyze_medical_image(
             image_base64=request.image,
             patient_age=request.age,
             patient_weight=request.weight,
-            clinical_history=request.clinical_history
+            clinical_history=request.clinical_history,
+            force_regenerate=request.force_regenerate,
+            modality=request.modality,
+            language=request.language,
+            session_id=session_id,
+            image_id=request.image_id,
+            details=details
         )
 
         message = "Report generated successfully."
         if isinstance(ai_service, DemoHuggingFaceService):
             message = "API running in demonstration mode. This is a sample report."
 
-        print("✅ AI processing completed successfully!")
-        return ReportResponse(report=report_text, success=True, message=message)
+        logger.info("✅ AI processing completed successfully!")
+        return ReportResponse(
+            report=report_text, success=True, message=message, session_id=session_id,
+            reused_candidate=details.get("reused_candidate")
+        )
 
     except HTTPException as http_exc:
         raise http_exc
+    except ImageQualityError as quality_exc:
+        # Imagem inutilizável: responde com o motivo estruturado sem chamar o modelo
+        raise HTTPException(
+            status_code=422,
+            detail={"message": str(quality_exc), "quality": quality_exc.assessment}
+        )
+    except ImageNotFoundError as not_found:
+        # Handle expirado: o cliente deve reenviar a imagem em base64
+        raise HTTPException(status_code=404, detail=str(not_found))
+    except Exception as e:
+        logger.error(f"❌ An unexpected error occurred during report generation: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+
+@app.post("/sessions/{session_id}/ask", response_model=FollowUpResponse)
+async def ask_followup(session_id: str, request: FollowUpRequest):
+    """
+    Ask a follow-up question about a study analyzed with create_session=true.
+    """
+    if not ai_service or not hasattr(ai_service, 'ask_followup'):
+        raise HTTPException(status_code=501, detail="Follow-up sessions are not available in this mode.")
+
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="The question is required.")
+
+    try:
+        answer = await ai_service.ask_followup(session_id, request.question.strip())
+        return FollowUpResponse(answer=answer, session_id=session_id, success=True)
+    except SessionNotFoundError as not_found:
+        raise HTTPException(status_code=404, detail=str(not_found))
     except Exception as e:
-        print(f"❌ An unexpected error occurred during report generation: {str(e)}")
+        logger.error(f"❌ An unexpected error occurred during the follow-up: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
+@app.delete("/sessions/{session_id}")
+async def close_session(session_id: str):
+    """Discard a follow-up session and its preprocessed image."""
+    if not ai_service or not hasattr(ai_service, 'sessions'):
+        raise HTTPException(status_code=501, detail="Follow-up sessions are not available in this mode.")
+    if not ai_service.sessions.remove(session_id):
+        raise HTTPException(status_code=404, detail=f"Session not found: {session_id}")
+    return {"success": True, "session_id": session_id}
+
 
 # Main entry point
 if __name__ == "__main__":
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita o endpoint do Hugging Face (TGI/OpenAI compatível).
+
+Implementa /v1/chat/completions, /v1/completions e a rota base de inferência
+HF, com latência configurável (distribuições), streaming SSE a uma taxa de
+tokens, janelas de cold start (503), limites de taxa (429), echo do prompt,
+truncamento por max_tokens e rejeição de formatos escolhidos. Tudo é
+determinístico para uma mesma semente.
+
+Uso:
+    python mock_hf_server.py --port 8081 --latency lognormal:400:0.3 --tokens-per-second 40
+    MEDGEMMA_MODEL_URL=http://localhost:8081 HUGGINGFACE_API_TOKEN=mock python main.py
+
+Configuração em tempo de execução: POST /mock/config (JSON com os mesmos
+campos), POST /mock/cold-start, POST /mock/reset e GET /mock/stats.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPORT_SECTIONS = [
+    "1. QUALIDADE DA IMAGEM:",
+    "2. ESTRUTURAS ANATÔMICAS:",
+    "3. ACHADOS ANORMAIS:",
+    "4. IMPRESSÃO DIAGNÓSTICA:",
+    "5. RECOMENDAÇÕES:",
+]
+
+_VOCABULARY = (
+    "imagem adequada penetração simétrica campos pulmonares transparência preservada seios "
+    "costofrênicos livres área cardíaca dentro limites normalidade mediastino centrado opacidade "
+    "discreta base direita sem derrame pleural trama broncovascular acentuada correlação clínica "
+    "sugerida controle evolutivo estruturas ósseas íntegras hilo pulmonar habitual"
+).split()
+
+PAYLOAD_FORMATS = [
+    "ChatCompletions-Image-URL", "Simple-Completions", "ChatCompletions-Text", "HF-Inference",
+    "MedGemma-Format", "Direct-Image-Payload", "Simple-MedGemma",
+]
+
+
+def parse_latency(spec: str):
+    """
+    Latency distribution in milliseconds: "fixed:300", "uniform:100:500",
+    "normal:300:50", "lognormal:300:0.4" (median, sigma) or "exponential:300".
+    Returns a function ``rng -> seconds``.
+    """
+    kind, *values = spec.split(":")
+    params = [float(value) for value in values]
+    samplers = {
+        "fixed": lambda rng: params[0],
+        "uniform": lambda rng: rng.uniform(params[0], params[1]),
+        "normal": lambda rng: rng.gauss(params[0], params[1]),
+        "lognormal": lambda rng: params[0] * math.exp(rng.gauss(0, params[1])),
+        "exponential": lambda rng: rng.expovariate(1 / params[0]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Distribuição de latência desconhecida: {spec}")
+    sampler = samplers[kind]
+    return lambda rng: max(0.0, sampler(rng)) / 1000
+
+
+def classify_payload(route: str, payload: Dict[str, Any]) -> str:
+    """Name of the HuggingFaceService payload format this request corresponds to."""
+    if "messages" in payload:
+        content = payload["messages"][0].get("content") if payload["messages"] else ""
+        if isinstance(content, list):
+            return "ChatCompletions-Image-URL"
+        if "images" in payload:
+            return "MedGemma-Format"
+        if isinstance(content, str) and content.startswith("<image>\nDescreva"):
+            return "Simple-MedGemma"
+        return "ChatCompletions-Text"
+    if "prompt" in payload:
+        return "Simple-Completions"
+    inputs = payload.get("inputs")
+    if isinstance(inputs, list):
+        inputs = inputs[0] if inputs else None
+    return "Direct-Image-Payload" if isinstance(inputs, dict) else "HF-Inference"
+
+
+def prompt_text(payload: Dict[str, Any]) -> str:
+    """Text prompt of a (single) request, as the model would read it."""
+    if "messages" in payload:
+        for message in payload["messages"]:
+            if message.get("role") != "user":
+                continue
+            content = message.get("content")
+            if isinstance(content, list):
+                return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+            return content or ""
+        return ""
+    if "prompt" in payload:
+        return payload["prompt"] if isinstance(payload["prompt"], str) else payload["prompt"][0]
+    inputs = payload.get("inputs")
+    if isinstance(inputs, list):
+        inputs = inputs[0] if inputs else ""
+    return inputs.get("text", "") if isinstance(inputs, dict) else inputs or ""
+
+
+class MockConfig:
+    """Behaviour of the mock server; every field can be changed at runtime."""
+
+    FIELDS = {
+        "latency": "lognormal:300:0.3",
+        "tokens_per_second": 50.0,
+        "report_words": 320,
+        "report_text": "",
+        "cold_start_seconds": 0.0,
+        "cold_start_estimated_time": 20.0,
+        "rate_limit_rps": 0.0,
+        "rate_limit_burst": 5,
+        "error_429_probability": 0.0,
+        "echo_probability": 0.0,
+        "reject_formats": [],
+        "accept_batches": True,
+        "seed": 1234,
+    }
+
+    def __init__(self, **overrides: Any):
+        for name, default in self.FIELDS.items():
+            setattr(self, name, overrides.get(name, default))
+        self._sampler = parse_latency(self.latency)
+
+    def update(self, values: Dict[str, Any]) -> None:
+        unknown = set(values) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Campos desconhecidos: {sorted(unknown)}")
+        for name, value in values.items():
+            setattr(self, name, value)
+        self._sampler = parse_latency(self.latency)
+
+    def sample_latency(self, rng: random.Random) -> float:
+        return self._sampler(rng)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class MockState:
+    """Counters, cold-start window, rate-limit bucket and per-request RNG."""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started_at = time.monotonic()
+            self.request_count = 0
+            self.bucket_tokens = float(self.config.rate_limit_burst)
+            self.bucket_updated = time.monotonic()
+            self.in_flight = 0
+            self.stats: Dict[str, Dict[str, int]] = {}
+
+    def next_rng(self) -> random.Random:
+        # Um gerador por requisição, derivado da semente: resultados reprodutíveis
+        with self.lock:
+            self.request_count += 1
+            return random.Random(f"{self.config.seed}:{self.request_count}")
+
+    def cold_start_remaining(self) -> float:
+        return max(0.0, self.config.cold_start_seconds - (time.monotonic() - self.started_at))
+
+    def take_rate_token(self) -> bool:
+        if self.config.rate_limit_rps <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.bucket_tokens = min(
+                float(self.config.rate_limit_burst),
+                self.bucket_tokens + (now - self.bucket_updated) * self.config.rate_limit_rps
+            )
+            self.bucket_updated = now
+            if self.bucket_tokens < 1:
+                return False
+            self.bucket_tokens -= 1
+            return True
+
+    def count(self, route: str, payload_format: str, status: int) -> None:
+        with self.lock:
+            entry = self.stats.setdefault(f"{route} {payload_format}", {})
+            entry[str(status)] = entry.get(str(status), 0) + 1
+
+
+def build_report(rng: random.Random, words: int) -> List[str]:
+    """Structured report (five sections) split into word tokens."""
+    per_section = max(4, words // len(REPORT_SECTIONS))
+    tokens: List[str] = []
+    for header in REPORT_SECTIONS:
+        tokens.append(("\n\n" if tokens else "") + header + "\n-")
+        tokens.extend(rng.choice(_VOCABULARY) for _ in range(per_section))
+        tokens[-1] += "."
+    return tokens
+
+
+def completion_tokens(payload: Dict[str, Any], rng: random.Random, config: MockConfig) -> Tuple[List[str], str]:
+    """Tokens to answer with and the finish reason (echo, continuation and max_tokens aware)."""
+    prompt = prompt_text(payload)
+    if rng.random() < config.echo_probability:
+        tokens = prompt.split(" ")
+    else:
+        # Texto fixo (cenários de teste) ou relatório sintético com as cinco seções
+        tokens = config.report_text.split(" ") if config.report_text else build_report(rng, config.report_words)
+        # Continuação de um relatório truncado: continua a partir do que já foi escrito
+        partial = next(
+            (m.get("content") for m in reversed(payload.get("messages", [])) if m.get("role") == "assistant"),
+            None
+        )
+        if partial:
+            tokens = tokens[len(partial.split(" ")):]
+
+    limit = payload.get("max_tokens") or (payload.get("parameters") or {}).get("max_new_tokens")
+    if limit and len(tokens) > limit:
+        return tokens[:limit], "length"
+    return tokens, "stop"
+
+
+def join_tokens(tokens: List[str]) -> str:
+    return " ".join(tokens).replace(" \n", "\n")
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    config = config or MockConfig()
+    state = MockState(config)
+    app = FastAPI(title="Mock Hugging Face Endpoint")
+    app.state.mock = state
+
+    def error(route: str, payload_format: str, status: int, message: str, headers=None, **extra) -> JSONResponse:
+        state.count(route, payload_format, status)
+        return JSONResponse(status_code=status, content={"error": message, **extra}, headers=headers)
+
+    async def handle(route: str, request: Request):
+        try:
+            payload = await request.json()
+        except json.JSONDecodeError:
+            return error(route, "invalid", 400, "Invalid JSON body")
+        payload_format = classify_payload(route, payload)
+        rng = state.next_rng()
+
+        if state.cold_start_remaining() > 0:
+            return error(route, payload_format, 503, "Model is currently loading",
+                         estimated_time=config.cold_start_estimated_time)
+        if not state.take_rate_token() or rng.random() < config.error_429_probability:
+            return error(route, payload_format, 429, "Rate limit reached", headers={"Retry-After": "1"})
+        if payload_format in config.reject_formats:
+            return error(route, payload_format, 422, f"Unsupported payload format: {payload_format}")
+
+        batch_field = "prompt" if route == "/v1/completions" else "inputs" if route == "/" else None
+        batch = payload.get(batch_field) if batch_field else None
+        if isinstance(batch, list):
+            if not config.accept_batches:
+                return error(route, payload_format, 422, f"{batch_field} must be a string")
+            return await respond_batch(route, payload_format, payload, batch_field, batch, rng)
+
+        tokens, finish_reason = completion_tokens(payload, rng, config)
+        prompt_tokens = len(prompt_text(payload).split())
+        ttft = config.sample_latency(rng)
+        per_token = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+        if payload.get("stream") and route != "/":
+            state.count(route, payload_format, 200)
+            return StreamingResponse(
+                stream(route, tokens, finish_reason, prompt_tokens, ttft, per_token),
+                media_type="text/event-stream",
+            )
+
+        state.in_flight += 1
+        try:
+            await asyncio.sleep(ttft + per_token * len(tokens))
+        finally:
+            state.in_flight -= 1
+        state.count(route, payload_format, 200)
+        return JSONResponse(content=single_response(route, join_tokens(tokens), finish_reason, prompt_tokens, len(tokens)))
+
+    def single_response(route, text, finish_reason, prompt_tokens, generated):
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": generated,
+                 "total_tokens": prompt_tokens + generated}
+        if route == "/v1/chat/completions":
+            return {
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+        if route == "/v1/completions":
+            return {"object": "text_completion",
+                    "choices": [{"index": 0, "text": text, "finish_reason": finish_reason}], "usage": usage}
+        return [{"generated_text": text, "details": {"finish_reason": finish_reason, "generated_tokens": generated}}]
+
+    async def respond_batch(route, payload_format, payload, batch_field, batch, rng):
+        answers = [completion_tokens(dict(payload, **{batch_field: item}), rng, config) for item in batch]
+        longest = max((len(tokens) for tokens, _ in answers), default=0)
+        per_token = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        state.in_flight += len(batch)
+        try:
+            await asyncio.sleep(config.sample_latency(rng) + per_token * longest)
+        finally:
+            state.in_flight -= len(batch)
+        state.count(route, f"{payload_format}[batch]", 200)
+        if route == "/v1/completions":
+            return JSONResponse(content={"object": "text_completion", "choices": [
+                {"index": index, "text": join_tokens(tokens), "finish_reason": finish_reason}
+                for index, (tokens, finish_reason) in enumerate(answers)
+            ]})
+        return JSONResponse(content=[
+            [{"generated_text": join_tokens(tokens), "details": {"finish_reason": finish_reason}}]
+            for tokens, finish_reason in answers
+        ])
+
+    async def stream(route, tokens, finish_reason, prompt_tokens, ttft, per_token):
+        state.in_flight += 1
+        try:
+            await asyncio.sleep(ttft)
+            for index, token in enumerate(tokens):
+                piece = token if index == 0 or token.startswith("\n") else f" {token}"
+                choice = {"index": 0, "finish_reason": None}
+                if route == "/v1/chat/completions":
+                    choice["delta"] = {"content": piece}
+                else:
+                    choice["text"] = piece
+                yield f"data: {json.dumps({'choices': [choice]}, ensure_ascii=False)}\n\n"
+                if per_token:
+                    await asyncio.sleep(per_token)
+            final = {"index": 0, "finish_reason": finish_reason}
+            if route == "/v1/chat/completions":
+                final["delta"] = {}
+            else:
+                final["text"] = ""
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)}
+            yield f"data: {json.dumps({'choices': [final], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            state.in_flight -= 1
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await handle("/v1/chat/completions", request)
+
+    @app.post("/v1/completions")
+    async def completions(request: Request):
+        return await handle("/v1/completions", request)
+
+    @app.post("/")
+    async def inference(request: Request):
+        return await handle("/", request)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "loading" if state.cold_start_remaining() > 0 else "ok"}
+
+    @app.get("/mock/stats")
+    async def mock_stats():
+        return {"requests": state.request_count, "in_flight": state.in_flight,
+                "by_route_format_status": state.stats, "config": config.as_dict()}
+
+    @app.post("/mock/config")
+    async def mock_config(request: Request):
+        try:
+            config.update(await request.json())
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        return config.as_dict()
+
+    @app.post("/mock/cold-start")
+    async def mock_cold_start(seconds: Optional[float] = None):
+        if seconds is not None:
+            config.cold_start_seconds = seconds
+        state.started_at = time.monotonic()
+        return {"cold_start_seconds": config.cold_start_seconds}
+
+    @app.post("/mock/reset")
+    async def mock_reset():
+        state.reset()
+        return {"status": "reset"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", default=MockConfig.FIELDS["latency"], help="ex.: fixed:300, lognormal:300:0.3")
+    parser.add_argument("--tokens-per-second", type=float, default=MockConfig.FIELDS["tokens_per_second"])
+    parser.add_argument("--report-words", type=int, default=MockConfig.FIELDS["report_words"])
+    parser.add_argument("--cold-start-seconds", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0)
+    parser.add_argument("--rate-limit-burst", type=int, default=MockConfig.FIELDS["rate_limit_burst"])
+    parser.add_argument("--error-429-probability", type=float, default=0.0)
+    parser.add_argument("--echo-probability", type=float, default=0.0)
+    parser.add_argument("--reject-formats", default="", help=f"lista separada por vírgulas de {PAYLOAD_FORMATS}")
+    parser.add_argument("--no-batches", action="store_true", help="recusa entradas em lista")
+    parser.add_argument("--seed", type=int, default=MockConfig.FIELDS["seed"])
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        report_words=args.report_words,
+        cold_start_seconds=args.cold_start_seconds,
+        rate_limit_rps=args.rate_limit_rps,
+        rate_limit_burst=args.rate_limit_burst,
+        error_429_probability=args.error_429_probability,
+        echo_probability=args.echo_probability,
+        reject_formats=[name for name in args.reject_formats.split(",") if name],
+        accept_batches=not args.no_batches,
+        seed=args.seed,
+    )
+    import uvicorn
+    print(f"🧪 Mock do endpoint HF em http://{args.host}:{args.port} | {config.as_dict()}")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
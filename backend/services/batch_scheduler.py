@@ -0,0 +1,135 @@
+"""
+Dynamic batching scheduler for local inference.
+
+Requests are queued and a single scheduler loop hands them to the model in
+batches: as soon as the worker is free it takes everything pending (up to
+``max_batch_size``), waiting at most ``max_wait_ms`` for the batch to fill.
+Requests that arrive while a batch is running form the next one.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class BatchScheduler:
+    """
+    Packs concurrent requests into batches for ``run_batch``.
+
+    ``run_batch(items)`` must return ``(results, generated_tokens)`` with one
+    result per item, in order. Per-batch occupancy and tokens/sec are kept
+    for the most recent ``window`` batches.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], Awaitable[Tuple[List[Any], int]]],
+        max_batch_size: int = 4,
+        max_wait_ms: float = 10,
+        window: int = 200,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._batches: Deque[Dict[str, float]] = deque(maxlen=window)
+        self._totals = {"batches": 0, "requests": 0, "generated_tokens": 0, "busy_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue ``item`` and wait for its result."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _next_batch(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Primeiro o que já está na fila; depois espera até o prazo do lote
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Chamadores cancelados não ocupam lugar no lote
+        return [(item, future) for item, future in batch if not future.done()]
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results, generated_tokens = await self.run_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise Exception(f"Lote com {len(batch)} entradas retornou {len(results)} resultados")
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self._record(len(batch), generated_tokens, time.perf_counter() - started)
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _record(self, size: int, generated_tokens: int, seconds: float) -> None:
+        with self._lock:
+            self._batches.append({
+                "size": size,
+                "occupancy": size / self.max_batch_size,
+                "generated_tokens": generated_tokens,
+                "seconds": seconds,
+            })
+            self._totals["batches"] += 1
+            self._totals["requests"] += size
+            self._totals["generated_tokens"] += generated_tokens
+            self._totals["busy_seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = list(self._batches)
+            totals = dict(self._totals)
+
+        def rate(tokens, seconds):
+            return round(tokens / seconds, 2) if seconds else None
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue_depth(),
+            **totals,
+            "busy_seconds": round(totals["busy_seconds"], 3),
+            "mean_occupancy": round(sum(batch["occupancy"] for batch in recent) / len(recent), 3)
+            if recent else None,
+            "tokens_per_second": rate(totals["generated_tokens"], totals["busy_seconds"]),
+            "recent_batches": [
+                {
+                    "size": batch["size"],
+                    "occupancy": round(batch["occupancy"], 3),
+                    "generated_tokens": batch["generated_tokens"],
+                    "seconds": round(batch["seconds"], 3),
+                    "tokens_per_second": rate(batch["generated_tokens"], batch["seconds"]),
+                }
+                for batch in recent[-10:]
+            ],
+        }
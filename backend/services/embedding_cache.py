@@ -0,0 +1,146 @@
+"""
+Image embedding cache for local inference.
+
+Vision-tower outputs are kept per preprocessed-image hash in a memory-bounded
+LRU. Entries evicted from memory can spill to ``.npy`` files that are read
+back memory-mapped, so re-prompts and follow-ups on the same image skip the
+vision encoder even after leaving the in-memory budget.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from services.structured_logging import get_logger
+
+logger = get_logger("embedding_cache")
+
+
+class EmbeddingCache:
+    """
+    LRU of named arrays (e.g. ``last_hidden_state``/``pooler_output``) per key.
+
+    ``max_bytes`` bounds the in-memory arrays; when ``spill_dir`` is set,
+    evicted entries are written there (bounded by ``max_spill_bytes``,
+    oldest removed first). Keys must be filename-safe (hex digests).
+    """
+
+    def __init__(self, max_bytes: int, spill_dir: Optional[str] = None, max_spill_bytes: int = 2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._memory: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._spilled_bytes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "spills": 0}
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._index_spill_dir()
+
+    @staticmethod
+    def _entry_bytes(arrays: Dict[str, np.ndarray]) -> int:
+        return sum(array.nbytes for array in arrays.values())
+
+    def _spill_path(self, key: str, name: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.{name}.npy")
+
+    def _index_spill_dir(self) -> None:
+        """Pick up entries spilled by a previous process (oldest first)."""
+        entries: Dict[str, Dict[str, Any]] = {}
+        for file_name in os.listdir(self.spill_dir):
+            parts = file_name.split(".")
+            if len(parts) != 3 or parts[2] != "npy":
+                continue
+            path = os.path.join(self.spill_dir, file_name)
+            entry = entries.setdefault(parts[0], {"names": [], "bytes": 0, "mtime": 0.0})
+            entry["names"].append(parts[1])
+            entry["bytes"] += os.path.getsize(path)
+            entry["mtime"] = max(entry["mtime"], os.path.getmtime(path))
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["mtime"]):
+            self._spilled[key] = {"names": entry["names"], "bytes": entry["bytes"]}
+            self._spilled_bytes += entry["bytes"]
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            arrays = self._memory.get(key)
+            if arrays is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return arrays
+            spilled = self._spilled.get(key)
+            if spilled is None:
+                self._stats["misses"] += 1
+                return None
+            try:
+                arrays = {name: np.load(self._spill_path(key, name), mmap_mode="r") for name in spilled["names"]}
+            except (OSError, ValueError):
+                self._drop_spilled(key)
+                self._stats["misses"] += 1
+                return None
+            self._spilled.move_to_end(key)
+            self._stats["disk_hits"] += 1
+            return arrays
+
+    def set(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        size = self._entry_bytes(arrays)
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._entry_bytes(self._memory.pop(key))
+            if size > self.max_bytes:
+                self._spill(key, arrays)
+                return
+            self._memory[key] = arrays
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_bytes and self._memory:
+                evicted_key, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= self._entry_bytes(evicted)
+                self._spill(evicted_key, evicted)
+
+    def _spill(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        if not self.spill_dir or key in self._spilled:
+            return
+        size = self._entry_bytes(arrays)
+        if size > self.max_spill_bytes:
+            return
+        try:
+            for name, array in arrays.items():
+                np.save(self._spill_path(key, name), np.ascontiguousarray(array))
+        except OSError as e:
+            logger.warning(f"⚠️ Falha ao gravar embedding em disco: {str(e)}")
+            return
+        self._spilled[key] = {"names": list(arrays), "bytes": size}
+        self._spilled_bytes += size
+        self._stats["spills"] += 1
+        while self._spilled_bytes > self.max_spill_bytes and self._spilled:
+            self._drop_spilled(next(iter(self._spilled)))
+
+    def _drop_spilled(self, key: str) -> None:
+        entry = self._spilled.pop(key, None)
+        if entry is None:
+            return
+        self._spilled_bytes -= entry["bytes"]
+        for name in entry["names"]:
+            try:
+                os.remove(self._spill_path(key, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            return {
+                **stats,
+                "hit_rate": round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_bytes": self.max_bytes,
+                "spilled_entries": len(self._spilled),
+                "spilled_bytes": self._spilled_bytes,
+                "spill_dir": self.spill_dir,
+            }
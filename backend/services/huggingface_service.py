@@ -3,11 +3,14 @@ Hugging Face integration service for medical AI analysis.
 """
 
 import base64
+import hashlib
 import io
 import json
+import re
+import time
 import httpx 
 import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 
 try:
@@ -17,9 +20,104 @@ try:
 except ImportError:
     DEPENDENCIES_AVAILABLE = False
 
+from config import (
+    IMAGE_QUALITY_GATE,
+    IMAGE_QUALITY_MIN_DIMENSION,
+    IMAGE_QUALITY_MIN_DYNAMIC_RANGE,
+    IMAGE_QUALITY_MAX_CLIPPED_FRACTION,
+    IMAGE_QUALITY_MIN_LAPLACIAN_VARIANCE,
+    NEAR_DUPLICATE_MODE,
+    NEAR_DUPLICATE_ALGORITHM,
+    NEAR_DUPLICATE_MAX_DISTANCE,
+    NEAR_DUPLICATE_INDEX_SIZE,
+    STREAMING_ENABLED,
+    STREAM_ECHO_CHECK_CHARS,
+    MAX_NEW_TOKENS,
+    TOKEN_BUDGET_PERCENTILE,
+    TOKEN_BUDGET_MARGIN,
+    TOKEN_BUDGET_MIN_SAMPLES,
+    TWO_STAGE_ENABLED,
+    FINDINGS_CACHE_SIZE,
+    FINDINGS_CACHE_TTL_SECONDS,
+    SESSION_TTL_SECONDS,
+    SESSION_MEMORY_BUDGET_MB,
+    SESSION_MAX_TURNS,
+    FOLLOWUP_MAX_TOKENS,
+    IMAGE_STORE_SIZE,
+    IMAGE_STORE_TTL_SECONDS,
+    UPSTREAM_BATCH_ENABLED,
+    UPSTREAM_BATCH_MAX_SIZE,
+    UPSTREAM_BATCH_MAX_WAIT_MS,
+    UPSTREAM_TRAFFIC_MODE,
+    UPSTREAM_TRAFFIC_ARCHIVE,
+    UPSTREAM_REPLAY_SPEED,
+    UPSTREAM_BODY_BUFFER_SIZE,
+    UPSTREAM_BODY_MAX_CHARS
+)
+from services.image_quality import ImageQualityError, assess_image_quality
+from services.cache import TTLCache
+from services.sessions import ReportSession, SessionStore
+from services.image_store import ImageNotFoundError, ImageStore, PreparedImage
+from services.micro_batcher import BatchUnsupportedError, MicroBatcher
+from services.traffic_archive import create_upstream_transport
+from services.structured_logging import UpstreamBodyBuffer, get_logger, sample_payload
+from services.metrics import (
+    CACHE_HIT_RATIO,
+    FORMAT_ATTEMPTS,
+    FORMAT_FAILURES,
+    FORMAT_SUCCESSES,
+    GENERATED_TOKENS,
+    PROMPT_TOKENS,
+    QUEUE_DEPTH,
+    TOKEN_BUDGET_TOKENS,
+    TOKEN_BUDGET_TRUNCATIONS,
+    TOKEN_BUDGET_USED_TOKENS,
+    UpstreamMetricsTransport,
+    current_payload_format,
+    record_cache_lookup,
+    upstream_label
+)
+from services.tracing import TracingTransport, current_span, stage, start_span, tracing_enabled
+from services.token_budget import TokenBudget, estimate_tokens
+from services.prompts import PrefillStats, PromptTemplate, get_prompt_template
+from services.perceptual_hash import (
+    PerceptualHashIndex,
+    clinical_inputs_key,
+    compute_perceptual_hash
+)
+
+logger = get_logger("huggingface")
+
+# Cabeçalhos das cinco seções pedidas em _create_medical_prompt (pt/en), na ordem.
+# Só contam no início de uma linha (com numeração e markdown ** / # opcionais) e em
+# maiúsculas, seguidos de ":" ou fim de linha: menções no texto ("ver recomendações
+# abaixo") não são cabeçalhos
+_SECTION_HEADER = r"^[ \t]*(?:#{{1,6}}[ \t]*)?(?:\*\*)?[ \t]*(?:\d+[.)][ \t]*)?(?:\*\*)?[ \t]*(?:{})[ \t]*(?:\*\*)?[ \t]*(?::|$)"
+REPORT_SECTION_PATTERNS = [
+    re.compile(_SECTION_HEADER.format(pattern), re.MULTILINE) for pattern in (
+        r"QUALIDADE\s+DA\s+IMAGEM|IMAGE\s+QUALITY",
+        r"ESTRUTURAS\s+ANAT[ÔO]MICAS|ANATOMICAL\s+STRUCTURES",
+        r"ACHADOS\s+ANORMAIS|ABNORMAL\s+FINDINGS",
+        r"IMPRESS[ÃA]O\s+DIAGN[ÓO]STICA|DIAGNOSTIC\s+IMPRESSION",
+        r"RECOMENDA[ÇC][ÕO]ES|RECOMMENDATIONS",
+    )
+]
+
+# Maior lado da imagem enviada ao modelo
+MAX_IMAGE_SIZE = 1024
+
+# Formatos cujo campo de entrada aceita uma lista (uma resposta por item)
+BATCH_INPUT_FIELDS = {
+    "Simple-Completions": "prompt",
+    "HF-Inference": "inputs",
+    "Direct-Image-Payload": "inputs",
+}
+
 class HuggingFaceService:
     """Service for interacting with Hugging Face Inference API."""
     
+    model_label = "MedGemma (Google)"
+    
     def __init__(self, api_token: str, model_url: Optional[str] = None):
         self.api_token = api_token
         
@@ -33,22 +131,110 @@ class HuggingFaceService:
             "Authorization": f"Bearer {api_token}",
             "Content-Type": "application/json"
         }
+        
+        # Índice de hashes perceptuais para detectar estudos reenviados
+        self.duplicate_index = PerceptualHashIndex(max_entries=NEAR_DUPLICATE_INDEX_SIZE)
+        self.near_duplicate_mode = NEAR_DUPLICATE_MODE
+        if self.near_duplicate_mode not in ("offer", "serve", "off"):
+            logger.warning(f"⚠️ NEAR_DUPLICATE_MODE desconhecido: {NEAR_DUPLICATE_MODE!r} - usando 'offer'")
+            self.near_duplicate_mode = "offer"
+        
+        # Orçamento de max_tokens aprendido a partir dos tamanhos reais dos relatórios
+        self.token_budget = TokenBudget(
+            max_budget=MAX_NEW_TOKENS,
+            percentile=TOKEN_BUDGET_PERCENTILE,
+            margin=TOKEN_BUDGET_MARGIN,
+            min_samples=TOKEN_BUDGET_MIN_SAMPLES
+        )
+        
+        # Tokens de prefill e latência por versão de prompt (ganho do cache de prefixo)
+        self.prefill_stats = PrefillStats()
+        
+        # Achados do estágio 1 (apenas imagem), indexados pelo hash da imagem
+        self.findings_cache = TTLCache(max_entries=FINDINGS_CACHE_SIZE, ttl_seconds=FINDINGS_CACHE_TTL_SECONDS)
+        
+        # Imagens enviadas antecipadamente via /images (pré-processadas em segundo plano)
+        self.image_store = ImageStore(max_entries=IMAGE_STORE_SIZE, ttl_seconds=IMAGE_STORE_TTL_SECONDS)
+        
+        # Sessões de perguntas de acompanhamento (imagem pré-processada + conversa)
+        self.sessions = SessionStore(
+            ttl_seconds=SESSION_TTL_SECONDS,
+            memory_budget_bytes=SESSION_MEMORY_BUDGET_MB * 1024 * 1024
+        )
+        
+        # Micro-batching: relatórios simultâneos vão em uma só chamada quando o
+        # formato negociado (última URL/formato que funcionou) aceita listas
+        self.negotiated_format: Optional[Tuple[str, str]] = None
+        self.unbatchable_formats = set()
+        # Relatórios em andamento: uma requisição sozinha não passa pelo lote
+        self.active_report_calls = 0
+        self.upstream_batcher = MicroBatcher(
+            self._send_upstream_batch,
+            max_batch_size=UPSTREAM_BATCH_MAX_SIZE,
+            max_wait_ms=UPSTREAM_BATCH_MAX_WAIT_MS
+        ) if UPSTREAM_BATCH_ENABLED else None
+        
+        # Modelo local (LocalModelService) usado quando o endpoint está inacessível
+        self.local_fallback = None
+        
+        # Gravação ou reprodução do tráfego com o endpoint (None = HTTP direto)
+        self.upstream_transport = create_upstream_transport(
+            UPSTREAM_TRAFFIC_MODE, UPSTREAM_TRAFFIC_ARCHIVE, UPSTREAM_REPLAY_SPEED
+        )
+        
+        # Últimos corpos de resposta do endpoint, consultáveis sob demanda (em vez de impressos)
+        self.upstream_bodies = UpstreamBodyBuffer(UPSTREAM_BODY_BUFFER_SIZE, UPSTREAM_BODY_MAX_CHARS)
+    
+    def register_metrics(self) -> None:
+        """
+        Expose this instance's caches and queues on /metrics. Call it once for
+        the instance serving the API: the gauges are keyed by name only, so a
+        second instance (e.g. the local fallback) would take them over.
+        """
+        CACHE_HIT_RATIO.set_function(lambda: self.findings_cache.stats()["hit_rate"], cache="findings")
+        QUEUE_DEPTH.set_function(self.image_store.pending, queue="preprocessing")
+        if self.upstream_batcher is not None:
+            QUEUE_DEPTH.set_function(self.upstream_batcher.pending, queue="upstream_batch")
+    
+    def _http_client(self, timeout: float = 180.0) -> httpx.AsyncClient:
+        """
+        HTTP client for upstream calls: instrumented for /metrics (and traced
+        when enabled), going through the record/replay transport when enabled.
+        """
+        transport = self.upstream_transport or httpx.AsyncHTTPTransport()
+        if tracing_enabled():
+            transport = TracingTransport(transport)
+        transport = UpstreamMetricsTransport(transport)
+        return httpx.AsyncClient(timeout=timeout, transport=transport)
     
     async def analyze_medical_image(
         self,
-        image_base64: str,
+        image_base64: Optional[str],
         patient_age: str,
         patient_weight: str,
-        clinical_history: str
+        clinical_history: str,
+        force_regenerate: bool = False,
+        modality: Optional[str] = None,
+        language: Optional[str] = None,
+        session_id: Optional[str] = None,
+        image_id: Optional[str] = None,
+        details: Optional[Dict[str, Any]] = None
     ) -> str:
         """
         Analyze medical image using MedGemma model.
         
         Args:
-            image_base64: Base64 encoded medical image
+            image_base64: Base64 encoded medical image (omitted when image_id is given)
             patient_age: Patient age in years
             patient_weight: Patient weight in kg
             clinical_history: Patient clinical history
+            force_regenerate: Skip near-duplicate reuse and always call the model
+            modality: Imaging modality (X-ray, CT, ...), selects the prompt and generation budget
+            language: Report language ("pt" or "en")
+            session_id: When given, keep the image and report for follow-up questions
+            image_id: Handle returned by submit_image for a pre-uploaded image
+            details: When given, filled with extra outcome data
+                (``reused_candidate`` when a near-duplicate is offered)
             
         Returns:
             Generated medical report text
@@ -64,111 +250,266 @@ class HuggingFaceService:
             )
         
         try:
-            # Validate and process image
-            image = self._process_image(image_base64)
+            # Imagem pré-processada: já enviada via /images ou processada agora fora do event loop
+            if image_id:
+                with start_span("image_store_wait", image_id=image_id):
+                    prepared = await self.image_store.get(image_id)
+                logger.debug(f"📎 Usando imagem pré-processada {image_id}")
+            else:
+                with stage("base64_decode", base64_chars=len(image_base64)):
+                    image_data = base64.b64decode(image_base64)
+                with start_span("preprocess", image_bytes=len(image_data)):
+                    prepared = await asyncio.to_thread(self._prepare_image, image_data)
+            image = prepared.image
+            quality_warnings = prepared.quality_warnings
             
             # Create comprehensive prompt
             prompt = self._create_medical_prompt(
-                patient_age, patient_weight, clinical_history
+                patient_age, patient_weight, clinical_history, language, modality
             )
+            template = get_prompt_template(language, modality)
+            
+            # Near-duplicate lookup (mesmo filme reenviado com os mesmos dados clínicos,
+            # idioma e modalidade)
+            image_hash = prepared.perceptual_hash
+            inputs_key = clinical_inputs_key(
+                patient_age, patient_weight, clinical_history, template.language, template.modality
+            )
+            duplicate = None
+            if image_hash is not None:
+                duplicate = None if force_regenerate else self.duplicate_index.find(
+                    image_hash, inputs_key, NEAR_DUPLICATE_MAX_DISTANCE
+                )
+                if not force_regenerate:
+                    record_cache_lookup("near_duplicate", duplicate is not None)
+                if duplicate and self.near_duplicate_mode == "serve":
+                    logger.info(f"♻️ Estudo praticamente idêntico encontrado (distância {duplicate['distance']}) - reaproveitando relatório")
+                    if session_id:
+                        self._open_session(session_id, prepared, prompt, duplicate["value"], language)
+                    return self._format_medical_report(
+                        duplicate["value"], patient_age, patient_weight, clinical_history,
+                        quality_warnings=quality_warnings,
+                        reused_from=duplicate
+                    )
             
             # Call Hugging Face API
-            response = await self._call_medgemma_api(prompt, image)
+            with start_span("generate", two_stage=TWO_STAGE_ENABLED, prompt_chars=len(prompt)) as span:
+                if TWO_STAGE_ENABLED:
+                    response = await self._two_stage_analysis(
+                        prepared, template, patient_age, patient_weight, clinical_history
+                    )
+                else:
+                    response = await self._call_medgemma_api(prompt, prepared.image_b64, template)
+                span.set_attribute("response_chars", len(response))
+            
+            if image_hash is not None:
+                self.duplicate_index.add(image_hash, inputs_key, response)
+            if session_id:
+                self._open_session(session_id, prepared, prompt, response, language)
+            
+            # Modo "offer": relatório novo, com o anterior indicado como candidato
+            if duplicate:
+                logger.info(f"♻️ Estudo praticamente idêntico encontrado (distância {duplicate['distance']}) - oferecido como candidato")
+                if details is not None:
+                    details["reused_candidate"] = {
+                        "report": duplicate["value"],
+                        "distance": duplicate["distance"],
+                        "created_at": duplicate["created_at"],
+                    }
             
             # Process and format response
             formatted_report = self._format_medical_report(
-                response, patient_age, patient_weight, clinical_history
+                response, patient_age, patient_weight, clinical_history,
+                quality_warnings=quality_warnings,
+                similar_to=duplicate
             )
             
             return formatted_report
             
+        except (ImageQualityError, ImageNotFoundError):
+            raise
         except Exception as e:
             raise Exception(f"Erro na análise de imagem médica: {str(e)}")
     
+    def submit_image(self, image_data: bytes, content_hash: Optional[str] = None) -> str:
+        """
+        Start preprocessing an uploaded image in the background.
+
+        Content already uploaded recently reuses its preprocessed result.
+        Returns the handle to pass as image_id to analyze_medical_image.
+        """
+        if not DEPENDENCIES_AVAILABLE:
+            raise Exception("Dependências necessárias não estão disponíveis. Instale: pip install pillow")
+        
+        content_hash = content_hash or hashlib.sha256(image_data).hexdigest()
+        existing_id = self.image_store.find(content_hash)
+        record_cache_lookup("uploaded_image", existing_id is not None)
+        if existing_id:
+            logger.info(f"♻️ Conteúdo já recebido - reaproveitando pré-processamento da imagem {existing_id}")
+            return existing_id
+        
+        image_id = self.image_store.submit(self._prepare_image, image_data, content_hash=content_hash)
+        logger.info(f"📤 Pré-processamento iniciado para a imagem {image_id} ({len(image_data)} bytes)")
+        return image_id
+    
+    def _prepare_image(self, image_data: bytes) -> PreparedImage:
+        """
+        Full (CPU-bound) preprocessing stage: decode, quality gate on the
+        original pixels, convert/resize, perceptual hash and JPEG/base64
+        encoding for the upstream request.
+        """
+        with stage("image_decode", image_bytes=len(image_data)) as span:
+            original = self._open_image(image_data)
+            span.set_attributes(width=original.width, height=original.height, mode=original.mode)
+        # Antes do convert/resize: bit depth e dimensões originais (16 bits, estudos alongados)
+        with stage("quality_gate"):
+            quality_warnings = self._check_image_quality(original)
+        with stage("image_process") as span:
+            image = self._normalize_image(original)
+            span.set_attributes(width=image.width, height=image.height)
+        perceptual_hash = None
+        if self.near_duplicate_mode != "off":
+            with stage("perceptual_hash"):
+                perceptual_hash = compute_perceptual_hash(image, NEAR_DUPLICATE_ALGORITHM)
+        with stage("encode") as span:
+            image_b64 = self._encode_image(image)
+            span.set_attribute("base64_chars", len(image_b64))
+        return PreparedImage(image, image_b64, quality_warnings, perceptual_hash)
+    
     def _process_image(self, image_base64: str) -> Image.Image:
         """Process and validate medical image."""
+        # 🔍 LOGS PARA VERIFICAR O ENVIO DA IMAGEM
+        logger.debug(f"📥 Imagem recebida: {len(image_base64)} caracteres base64")
+        logger.debug(f"🔍 Primeiros 50 chars: {image_base64[:50]}...")
         try:
-            # 🔍 LOGS PARA VERIFICAR O ENVIO DA IMAGEM
-            print(f"📥 Imagem recebida: {len(image_base64)} caracteres base64")
-            print(f"🔍 Primeiros 50 chars: {image_base64[:50]}...")
-            
             image_data = base64.b64decode(image_base64)
-            print(f"📊 Dados decodificados: {len(image_data)} bytes")
+        except Exception as e:
+            raise Exception(f"Erro ao processar imagem: {str(e)}")
+        return self._process_image_bytes(image_data)
+    
+    def _process_image_bytes(self, image_data: bytes) -> Image.Image:
+        """Decode, convert and resize the raw image bytes."""
+        return self._normalize_image(self._open_image(image_data))
+    
+    @staticmethod
+    def _open_image(image_data: bytes) -> Image.Image:
+        """Decode the raw image bytes, keeping the original mode and size."""
+        try:
+            logger.debug(f"📊 Dados decodificados: {len(image_data)} bytes")
             
             image = Image.open(io.BytesIO(image_data))
-            print(f"✅ Imagem carregada: {image.size} pixels, modo {image.mode}")
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-                print(f"🔄 Convertido para RGB")
-            
-            # Resize if too large (max 1024x1024 for API efficiency)
-            max_size = 1024
-            if image.width > max_size or image.height > max_size:
-                original_size = image.size
-                image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                print(f"📏 Redimensionado de {original_size} para {image.size}")
-            
+            image.load()
+            logger.debug(f"✅ Imagem carregada: {image.size} pixels, modo {image.mode}")
             return image
             
         except Exception as e:
             raise Exception(f"Erro ao processar imagem: {str(e)}")
     
-    def _create_medical_prompt(
-        self, age: str, weight: str, clinical_history: str
-    ) -> str:
-        """Create a comprehensive medical prompt following MedGemma format."""
+    def _normalize_image(self, image: Image.Image) -> Image.Image:
+        """Convert to 8-bit RGB and resize to the size sent to the model."""
+        try:
+            return self._resize_image(self._convert_image(image))
+        except Exception as e:
+            raise Exception(f"Erro ao processar imagem: {str(e)}")
+    
+    @staticmethod
+    def _convert_image(image: Image.Image) -> Image.Image:
+        """Convert any mode to 8-bit RGB."""
+        # Alta profundidade (ex.: PNG 16 bits): convert("RGB") satura tudo acima
+        # de 255, então a faixa real é reescalada para 8 bits antes
+        if image.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+            image = image.convert("F")
+            peak = image.getextrema()[1] or 1.0
+            image = image.point(lambda value: value * (255.0 / peak)).convert("L")
+            logger.debug(f"🔄 Reescalado de alta profundidade para 8 bits (pico {peak:g})")
         
-        prompt = f"""Analise a imagem médica e forneça um relatório estruturado.
-
-PACIENTE: {age} anos, {weight} kg
-HISTÓRIA: {clinical_history}
-
-RESPONDA COM ANÁLISE MÉDICA INCLUINDO:
-
-1. QUALIDADE DA IMAGEM:
-- Qualidade técnica e adequação diagnóstica
-
-2. ESTRUTURAS ANATÔMICAS:
-- Estruturas visíveis e normalidades
-
-3. ACHADOS ANORMAIS:
-- Patologias identificadas com localização e características
-
-4. IMPRESSÃO DIAGNÓSTICA:
-- Diagnóstico baseado nos achados
-
-5. RECOMENDAÇÕES:
-- Próximos passos ou exames complementares
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+            logger.debug(f"🔄 Convertido para RGB")
+        return image
+    
+    @staticmethod
+    def _resize_image(image: Image.Image, max_size: int = MAX_IMAGE_SIZE) -> Image.Image:
+        """Shrink in place to fit ``max_size`` (1024x1024 for API efficiency)."""
+        if image.width > max_size or image.height > max_size:
+            original_size = image.size
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            logger.debug(f"📏 Redimensionado de {original_size} para {image.size}")
+        return image
+    
+    def _check_image_quality(self, image: Image.Image) -> List[str]:
+        """
+        Run the pre-flight quality gate on the decoded image.
 
-RESPOSTA:"""
+        Raises ImageQualityError in "reject" mode; in "flag" mode returns the
+        issue messages so they can be added to the report.
+        """
+        if IMAGE_QUALITY_GATE == "off":
+            return []
+        
+        assessment = assess_image_quality(
+            image,
+            min_dimension=IMAGE_QUALITY_MIN_DIMENSION,
+            min_dynamic_range=IMAGE_QUALITY_MIN_DYNAMIC_RANGE,
+            max_clipped_fraction=IMAGE_QUALITY_MAX_CLIPPED_FRACTION,
+            min_laplacian_variance=IMAGE_QUALITY_MIN_LAPLACIAN_VARIANCE
+        )
+        logger.debug(f"🔬 Controle de qualidade em {assessment['elapsed_ms']} ms: {assessment['metrics']}")
         
-        return prompt.strip()
+        if assessment["acceptable"]:
+            return []
+        
+        if IMAGE_QUALITY_GATE == "reject":
+            logger.warning(f"🚫 Imagem rejeitada: {[issue['code'] for issue in assessment['issues']]}")
+            raise ImageQualityError(assessment)
+        
+        logger.warning(f"⚠️ Imagem sinalizada: {[issue['code'] for issue in assessment['issues']]}")
+        return [issue["message"] for issue in assessment["issues"]]
     
+    def _create_medical_prompt(
+        self, age: str, weight: str, clinical_history: str,
+        language: Optional[str] = None, modality: Optional[str] = None
+    ) -> str:
+        """
+        Create the medical prompt from the versioned registry.
 
+        The static instruction block comes first so the upstream prefix/KV
+        cache can share it; patient data is appended at the end.
+        """
+        template = get_prompt_template(language, modality)
+        return template.render(age, weight, clinical_history).strip()
 
-    async def _call_medgemma_api(self, prompt: str, image: Image.Image) -> str:
+    async def _call_medgemma_api(
+        self, prompt: str, image_b64: str, template: Optional[PromptTemplate] = None
+    ) -> str:
         """Call MedGemma model via Hugging Face API using multiple format attempts."""
         
-        # Converte a imagem para base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        image_b64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        
-        print(f"🚀 Enviando requisição para: {self.medgemma_url}")
-        print(f"📦 Tamanho do prompt: {len(prompt)} | Tamanho da imagem b64: {len(image_b64)}")
+        logger.debug(f"🚀 Enviando requisição para: {self.medgemma_url}")
+        logger.debug(f"📦 Tamanho do prompt: {len(prompt)} | Tamanho da imagem b64: {len(image_b64)}")
 
-        # Tenta múltiplos formatos de payload
-        result = await self._try_endpoint_formats(prompt, image_b64)
+        template = template or get_prompt_template()
+        result = None
+        self.active_report_calls += 1
+        try:
+            # Sem outras requisições em andamento, o lote só acrescentaria espera e tiraria o streaming
+            if self.active_report_calls > 1 and self._can_batch():
+                result = await self._call_batched(prompt, image_b64, template, prompt_variant="full")
+            
+            # Tenta múltiplos formatos de payload
+            if result is None:
+                result = await self._try_endpoint_formats(prompt, image_b64, template, prompt_variant="full")
+        finally:
+            self.active_report_calls -= 1
         
         if result and result.strip():
             return result
         elif result == "":
             # Se conseguimos conectar mas o resultado é vazio, pode ser um problema com o prompt
-            print("⚠️ Modelo conectou mas retornou resposta vazia. Tentando prompt simplificado...")
-            simple_prompt = "Analise esta imagem médica e descreva os principais achados."
-            simple_result = await self._try_endpoint_formats(simple_prompt, image_b64)
+            logger.warning("⚠️ Modelo conectou mas retornou resposta vazia. Tentando prompt simplificado...")
+            simple_result = await self._try_endpoint_formats(
+                template.simple_prompt, image_b64, template, prompt_variant="simple"
+            )
             if simple_result and simple_result.strip():
                 return simple_result
             else:
@@ -176,8 +517,248 @@ RESPOSTA:"""
         else:
             raise Exception("Todos os formatos de API falharam - verifique a configuração do endpoint")
 
-    async def _try_endpoint_formats(self, prompt: str, image_b64: str) -> Optional[str]:
-        """Try different payload formats for the current endpoint."""
+    def _can_batch(self) -> bool:
+        if self.upstream_batcher is None or self.negotiated_format is None:
+            return False
+        return (
+            self.negotiated_format[1] in BATCH_INPUT_FIELDS
+            and self.negotiated_format not in self.unbatchable_formats
+        )
+
+    async def _call_batched(
+        self, prompt: str, image_b64: str, template: PromptTemplate, prompt_variant: str = "full"
+    ) -> Optional[str]:
+        """
+        Send the request through the micro-batcher using the negotiated format.
+
+        Only used while other reports are in flight. Batched requests are not
+        streamed, so the early stop on prompt echo or on a complete report
+        does not apply: each item is checked for echo or empty content once
+        the batch returns. Returns None when the batch had a single item, when
+        the batched call fails or when the answer is unusable, so the caller
+        falls back to the regular per-request format attempts (streamed, with
+        early stop).
+        """
+        url, name = self.negotiated_format
+        current_payload_format.set(name)
+        labels = {"upstream": upstream_label(url), "format": name}
+        payloads, payload_names = self._build_payloads(prompt, image_b64, template, prompt_variant)
+        payload = payloads[payload_names.index(name)]
+        input_field = BATCH_INPUT_FIELDS[name]
+        # Só entram no mesmo lote requisições com parâmetros de geração idênticos
+        parameters = json.dumps({k: v for k, v in payload.items() if k != input_field}, sort_keys=True)
+        
+        try:
+            item = await self.upstream_batcher.submit((url, name, parameters), payload)
+        except BatchUnsupportedError as e:
+            logger.warning(f"⚠️ {name} não aceita lotes ({str(e)}) - usando requisições individuais")
+            self.unbatchable_formats.add((url, name))
+            FORMAT_FAILURES.inc(reason="batch_unsupported", **labels)
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Lote em {name} falhou ({str(e)}) - tentando individualmente")
+            FORMAT_FAILURES.inc(reason="error", **labels)
+            return None
+        if item is None:
+            # Lote de um só item: segue pelo caminho normal, com streaming
+            return None
+        
+        content = (item["content"] or "").strip()
+        if not content:
+            logger.warning(f"⚠️ Resposta vazia no lote ({name}) - tentando individualmente")
+            FORMAT_FAILURES.inc(reason="empty", **labels)
+            return None
+        if self._is_prompt_echo(content, prompt):
+            logger.warning(f"⚠️ Item do lote ({name}) retornou apenas o prompt - tentando individualmente")
+            FORMAT_FAILURES.inc(reason="echo", **labels)
+            return None
+        
+        async with self._http_client() as client:
+            return await self._complete_response(
+                client, url, payload, prompt, content, item["finish_reason"], item["usage"],
+                (f"{template.version}/{template.language}:{prompt_variant}:{name}", template.modality),
+                f"{template.key}:{prompt_variant}", continuation_prompt=template.continuation_prompt
+            )
+
+    async def _send_upstream_batch(
+        self, key: Tuple[str, str, str], payloads: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Post one batched payload and split the answer back per input. A batch
+        of one is not sent (None): the caller streams it individually.
+        """
+        url, name, _ = key
+        if len(payloads) == 1:
+            return [None]
+        current_payload_format.set(name)
+        FORMAT_ATTEMPTS.inc(len(payloads), upstream=upstream_label(url), format=name)
+        input_field = BATCH_INPUT_FIELDS[name]
+        body = dict(payloads[0], **{input_field: [payload[input_field] for payload in payloads]})
+        body.pop("stream", None)
+        logger.debug(f"📦 Enviando lote de {len(payloads)} requisições ({name}) para {url}")
+        
+        request_started = time.perf_counter()
+        async with self._http_client() as client:
+            response = await client.post(url, headers=self.headers, json=body)
+        self.upstream_bodies.add(url, name, response.status_code, response.content, batch_size=len(payloads))
+        
+        if response.status_code != 200:
+            error = f"{response.status_code} - {response.text[:200]}"
+            if response.status_code in (400, 413, 422):
+                raise BatchUnsupportedError(error)
+            raise Exception(error)
+        
+        result = response.json()
+        if isinstance(result, dict) and isinstance(result.get("choices"), list):
+            # OpenAI: uma choice por prompt, identificada por "index"
+            choices = sorted(result["choices"], key=lambda choice: choice.get("index", 0))
+            parts = [{"choices": [choice]} for choice in choices]
+        elif isinstance(result, list):
+            parts = result
+        else:
+            raise BatchUnsupportedError(f"Resposta inesperada para lote: {type(result)}")
+        if len(parts) != len(payloads):
+            raise BatchUnsupportedError(f"Lote com {len(payloads)} entradas retornou {len(parts)} resultados")
+        
+        elapsed = time.perf_counter() - request_started
+        items = []
+        for part in parts:
+            content, finish_reason = self._extract_completion(part)
+            usage = {
+                # Contagens agregadas do lote não se dividem por requisição
+                "completion_tokens": None,
+                "prompt_tokens": None,
+                "first_token_seconds": None,
+                "total_seconds": elapsed
+            }
+            items.append({"content": content, "finish_reason": finish_reason, "usage": usage})
+        return items
+
+    def _open_session(
+        self, session_id: str, prepared: PreparedImage, prompt: str, report: str, language: Optional[str]
+    ) -> None:
+        """Keep the preprocessed image and the report so follow-ups can reuse them."""
+        self.sessions.add(ReportSession(
+            session_id=session_id,
+            image_b64=prepared.image_b64,
+            prompt=prompt,
+            report=report,
+            language=language or "pt",
+            max_turns=SESSION_MAX_TURNS
+        ))
+        logger.info(f"💬 Sessão {session_id} aberta para perguntas de acompanhamento")
+
+    async def ask_followup(self, session_id: str, question: str) -> str:
+        """
+        Answer a follow-up question about a previously analyzed study.
+
+        The question is sent as a new chat turn after the original request,
+        the report and the most recent exchanges of the session.
+
+        Raises:
+            SessionNotFoundError: If the session is unknown or expired
+        """
+        session = self.sessions.get(session_id)
+        logger.debug(f"💬 Pergunta de acompanhamento na sessão {session_id}: {len(question)} caracteres")
+        
+        answer = None
+        async with self._http_client() as client:
+            # Primeiro com a imagem; se o endpoint recusar, apenas com o contexto em texto
+            for include_image in (True, False):
+                payload = {
+                    "messages": session.build_messages(question, include_image=include_image),
+                    "max_tokens": FOLLOWUP_MAX_TOKENS,
+                    "temperature": 0.3,
+                    "top_p": 0.9,
+                    "stream": False
+                }
+                try:
+                    if STREAMING_ENABLED:
+                        streamed = await self._stream_completion(client, self.medgemma_url, payload, question)
+                        if streamed["status_code"] == 200 and not streamed["echo"]:
+                            answer = streamed["content"]
+                        else:
+                            logger.warning(f"⚠️ Pergunta falhou: {streamed['status_code']} - {streamed['error_text']}")
+                    else:
+                        response = await client.post(self.medgemma_url, headers=self.headers, json=payload)
+                        if response.status_code == 200:
+                            answer, _ = self._extract_completion(response.json())
+                        else:
+                            logger.warning(f"⚠️ Pergunta falhou: {response.status_code} - {response.text[:200]}")
+                except httpx.TimeoutException:
+                    logger.warning("⏱️ Timeout na pergunta de acompanhamento")
+                except Exception as e:
+                    logger.error(f"❌ Erro na pergunta de acompanhamento: {str(e)}")
+                
+                if answer and answer.strip():
+                    break
+        
+        if not answer or not answer.strip():
+            raise Exception("Modelo não respondeu à pergunta de acompanhamento")
+        
+        answer = answer.strip()
+        session.add_exchange(question, answer)
+        self.sessions.touch()
+        return answer
+
+    @staticmethod
+    def _encode_image(image: Image.Image) -> str:
+        """JPEG + base64 encoding of the preprocessed image sent upstream."""
+        return HuggingFaceService._to_base64(HuggingFaceService._encode_jpeg(image))
+
+    @staticmethod
+    def _encode_jpeg(image: Image.Image) -> bytes:
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG")
+        return buffered.getvalue()
+
+    @staticmethod
+    def _to_base64(data: bytes) -> str:
+        return base64.b64encode(data).decode("utf-8")
+
+    async def _two_stage_analysis(
+        self,
+        prepared: PreparedImage,
+        template: PromptTemplate,
+        age: str,
+        weight: str,
+        clinical_history: str
+    ) -> str:
+        """
+        Two-stage report generation.
+
+        Stage 1 describes the image alone and is cached by image hash; stage 2
+        is a text-only call that merges those findings with the patient data,
+        so editing the clinical history only costs a short text generation.
+        """
+        findings_key = (prepared.digest, template.key)
+        findings = self.findings_cache.get(findings_key)
+        record_cache_lookup("findings", bool(findings))
+        
+        if findings:
+            logger.info("♻️ Achados da imagem em cache - executando apenas a síntese em texto")
+        else:
+            logger.info("🔬 Estágio 1: extraindo achados da imagem...")
+            findings = await self._try_endpoint_formats(
+                template.findings_prompt, prepared.image_b64, template, prompt_variant="findings"
+            )
+            if not findings or not findings.strip():
+                raise Exception("Estágio 1 falhou: modelo não retornou achados da imagem")
+            self.findings_cache.set(findings_key, findings)
+        
+        logger.info("📝 Estágio 2: síntese do relatório com os dados do paciente...")
+        synthesis_prompt = template.render_synthesis(findings, age, weight, clinical_history)
+        report = await self._try_endpoint_formats(
+            synthesis_prompt, "", template, prompt_variant="synthesis", formats=["ChatCompletions-Text"]
+        )
+        if not report or not report.strip():
+            raise Exception("Estágio 2 falhou: modelo não retornou o relatório")
+        return report
+
+    def _build_payloads(
+        self, prompt: str, image_b64: str, template: PromptTemplate, prompt_variant: str = "full"
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Every payload format to try, with max_tokens set from the learned budget."""
         
         # Format 1: Chat completions with image_url format (OpenAI compatible)
         payload1 = {
@@ -278,6 +859,34 @@ RESPOSTA:"""
         payloads = [payload1, payload2, payload3, payload4, payload5, payload6, payload7]
         payload_names = ["ChatCompletions-Image-URL", "Simple-Completions", "ChatCompletions-Text", "HF-Inference", "MedGemma-Format", "Direct-Image-Payload", "Simple-MedGemma"]
         
+        # Ajusta max_tokens de cada formato ao orçamento aprendido
+        modality_key = template.modality
+        variant_prefix = f"{template.version}/{template.language}:{prompt_variant}"
+        for name, payload in zip(payload_names, payloads):
+            self._apply_token_budget(payload, f"{variant_prefix}:{name}", modality_key)
+        return payloads, payload_names
+
+    async def _try_endpoint_formats(
+        self,
+        prompt: str,
+        image_b64: str,
+        template: Optional[PromptTemplate] = None,
+        prompt_variant: str = "full",
+        formats: Optional[List[str]] = None
+    ) -> Optional[str]:
+        """
+        Try different payload formats for the current endpoint.
+
+        ``formats`` restricts the attempts to the given payload names
+        (e.g. only "ChatCompletions-Text" for text-only calls).
+        """
+        
+        template = template or get_prompt_template()
+        payloads, payload_names = self._build_payloads(prompt, image_b64, template, prompt_variant)
+        modality_key = template.modality
+        variant_prefix = f"{template.version}/{template.language}:{prompt_variant}"
+        prompt_key = f"{template.key}:{prompt_variant}"
+        
         # URLs para testar (completions vs chat/completions)
         urls_to_try = [
             self.medgemma_url,  # /v1/chat/completions
@@ -285,46 +894,100 @@ RESPOSTA:"""
             self.medgemma_url.replace("/v1/chat/completions", "")  # base URL
         ]
         
-        print(f"📋 Tentando múltiplos formatos de API:")
-        print(f"   - prompt length: {len(prompt)} chars")
-        print(f"   - image length: {len(image_b64)} chars")
+        logger.debug(
+            "📋 Tentando múltiplos formatos de API",
+            extra={"prompt_chars": len(prompt), "image_chars": len(image_b64), "prompt_variant": prompt_variant}
+        )
         
-        async with httpx.AsyncClient(timeout=180.0) as client:
+        async with self._http_client() as client:
             # Tenta diferentes combinações de URL + payload
             for url in urls_to_try:
-                print(f"🌐 Testando URL: {url}")
+                logger.debug(f"🌐 Testando URL: {url}")
                 
                 for i, payload in enumerate(payloads):
+                    if formats and payload_names[i] not in formats:
+                        continue
                     # Pula combinações que não fazem sentido
                     if "/completions" in url and not "/chat/" in url and payload_names[i].startswith("Chat"):
                         continue
                     if "/chat/completions" in url and payload_names[i] == "Simple-Completions":
                         continue
                         
+                    # Formato completo que funcionou: base para o micro-batching
+                    negotiated = None if formats else (url, payload_names[i])
+                    labels = {"upstream": upstream_label(url), "format": payload_names[i]}
+                    current_payload_format.set(payload_names[i])
+                    FORMAT_ATTEMPTS.inc(**labels)
+                    attempt = start_span(
+                        "upstream_attempt", url=url, payload_format=payload_names[i], prompt_variant=prompt_variant
+                    ).activate()
+                    
                     try:
-                        print(f"🔄 Tentando {payload_names[i]} em {url}")
+                        logger.debug(f"🔄 Tentando {payload_names[i]} em {url}", extra=labels)
+                        
+                        # Streaming: permite cancelar cedo (echo do prompt ou relatório completo)
+                        if STREAMING_ENABLED and self._supports_streaming(payload):
+                            streamed = await self._stream_completion(client, url, payload, prompt)
+                            if streamed["status_code"] == 503:
+                                logger.warning("⏳ Modelo carregando... aguardando 20 segundos...")
+                                with start_span("model_loading_wait"):
+                                    await asyncio.sleep(20)
+                                streamed = await self._stream_completion(client, url, payload, prompt)
+                            
+                            if streamed["status_code"] == 200:
+                                if streamed["echo"]:
+                                    logger.warning("⚠️ Modelo retornou apenas o prompt (stream cancelado), tentando próximo formato...")
+                                    attempt.set_attribute("outcome", "echo")
+                                    FORMAT_FAILURES.inc(reason="echo", **labels)
+                                    continue
+                                if streamed["content"]:
+                                    logger.info(f"✅ Sucesso com {payload_names[i]} em {url} (stream)", extra=labels)
+                                    logger.debug(f"✅ Conteúdo extraído: {len(streamed['content'])} caracteres")
+                                    return await self._complete_response(
+                                        client, url, payload, prompt, streamed["content"], streamed["finish_reason"],
+                                        streamed["usage"], (f"{variant_prefix}:{payload_names[i]}", modality_key), prompt_key, negotiated,
+                                        template.continuation_prompt
+                                    )
+                                logger.warning("⚠️ Conteúdo vazio na resposta")
+                                attempt.set_attribute("outcome", "empty")
+                                FORMAT_FAILURES.inc(reason="empty", **labels)
+                                continue
+                            
+                            logger.warning(
+                                f"⚠️ {payload_names[i]} falhou: {streamed['status_code']} - {streamed['error_text']}",
+                                extra=dict(labels, status=streamed["status_code"])
+                            )
+                            attempt.set_attribute("outcome", str(streamed["status_code"]))
+                            FORMAT_FAILURES.inc(reason=str(streamed["status_code"]), **labels)
+                            continue
                         
+                        request_started = time.perf_counter()
                         response = await client.post(url, headers=self.headers, json=payload)
                         
                         # Handle model loading (503)
                         if response.status_code == 503:
-                            print("⏳ Modelo carregando... aguardando 20 segundos...")
-                            await asyncio.sleep(20)
+                            logger.warning("⏳ Modelo carregando... aguardando 20 segundos...")
+                            with start_span("model_loading_wait"):
+                                await asyncio.sleep(20)
+                            request_started = time.perf_counter()
                             response = await client.post(url, headers=self.headers, json=payload)
                         
+                        self.upstream_bodies.add(url, payload_names[i], response.status_code, response.content)
+                        
                         # Success
                         if response.status_code == 200:
                             result = response.json()
-                            print(f"✅ Sucesso com {payload_names[i]} em {url}")
+                            logger.info(f"✅ Sucesso com {payload_names[i]} em {url}", extra=labels)
                             
                             # Handle chat completions format
                             if isinstance(result, dict) and 'choices' in result:
-                                print(f"📋 Resposta em formato chat completions")
-                                print(f"🔍 Resultado completo: {json.dumps(result, indent=2)[:500]}...")
+                                logger.debug(f"📋 Resposta em formato chat completions")
+                                # Despejo completo só para uma amostra (serializado na thread de logs)
+                                if sample_payload(logger):
+                                    logger.debug("🔍 Resposta completa (amostra)", extra={"payload": result, **labels})
                                 
                                 if result['choices'] and len(result['choices']) > 0:
                                     choice = result['choices'][0]
-                                    print(f"🔍 Choice: {json.dumps(choice, indent=2)}")
                                     
                                     if 'message' in choice and 'content' in choice['message']:
                                         content = choice['message']['content']
@@ -333,64 +996,502 @@ RESPOSTA:"""
                                             
                                             # Verifica se o modelo retornou apenas o prompt (problema comum)
                                             if self._is_prompt_echo(content, prompt):
-                                                print("⚠️ Modelo retornou apenas o prompt, tentando próximo formato...")
+                                                logger.warning("⚠️ Modelo retornou apenas o prompt, tentando próximo formato...")
+                                                attempt.set_attribute("outcome", "echo")
+                                                FORMAT_FAILURES.inc(reason="echo", **labels)
                                                 continue
                                             
-                                            print(f"✅ Conteúdo extraído: {len(content)} caracteres")
-                                            return content
+                                            logger.debug(f"✅ Conteúdo extraído: {len(content)} caracteres")
+                                            return await self._complete_response(
+                                                client, url, payload, prompt, content, choice.get('finish_reason'),
+                                                self._response_usage(result, request_started),
+                                                (f"{variant_prefix}:{payload_names[i]}", modality_key), prompt_key, negotiated,
+                                                template.continuation_prompt
+                                            )
                                         else:
-                                            print("⚠️ Conteúdo vazio na resposta")
+                                            logger.warning("⚠️ Conteúdo vazio na resposta")
                                     elif 'text' in choice:
                                         content = choice['text']
                                         if content:
                                             content = content.strip()
-                                            print(f"✅ Texto extraído: {len(content)} caracteres")
-                                            return content
+                                            logger.debug(f"✅ Texto extraído: {len(content)} caracteres")
+                                            return await self._complete_response(
+                                                client, url, payload, prompt, content, choice.get('finish_reason'),
+                                                self._response_usage(result, request_started),
+                                                (f"{variant_prefix}:{payload_names[i]}", modality_key), prompt_key, negotiated,
+                                                template.continuation_prompt
+                                            )
                                         else:
-                                            print("⚠️ Texto vazio na resposta")
+                                            logger.warning("⚠️ Texto vazio na resposta")
                                     else:
-                                        print(f"⚠️ Estrutura inesperada no choice: {choice.keys()}")
+                                        logger.warning(f"⚠️ Estrutura inesperada no choice: {choice.keys()}")
                                 else:
-                                    print("⚠️ Lista de choices vazia")
+                                    logger.warning("⚠️ Lista de choices vazia")
                             
                             # Handle standard Hugging Face format
                             elif isinstance(result, list) and len(result) > 0:
-                                print(f"📋 Resposta em formato lista HF")
+                                logger.debug(f"📋 Resposta em formato lista HF")
                                 generated_text = result[0].get('generated_text', '').strip()
                                 
                                 # Verifica se é apenas echo do prompt
                                 if self._is_prompt_echo(generated_text, prompt):
-                                    print("⚠️ HF formato retornou apenas o prompt, tentando próximo formato...")
+                                    logger.warning("⚠️ HF formato retornou apenas o prompt, tentando próximo formato...")
+                                    attempt.set_attribute("outcome", "echo")
+                                    FORMAT_FAILURES.inc(reason="echo", **labels)
                                     continue
                                     
-                                return generated_text
+                                details = result[0].get('details') or {}
+                                return await self._complete_response(
+                                    client, url, payload, prompt, generated_text, details.get('finish_reason'),
+                                    self._response_usage(result, request_started),
+                                    (f"{variant_prefix}:{payload_names[i]}", modality_key), prompt_key, negotiated,
+                                    template.continuation_prompt
+                                )
                             elif isinstance(result, dict) and 'generated_text' in result:
-                                print(f"📋 Resposta em formato dict HF")
+                                logger.debug(f"📋 Resposta em formato dict HF")
                                 generated_text = result['generated_text'].strip()
                                 
                                 # Verifica se é apenas echo do prompt
                                 if self._is_prompt_echo(generated_text, prompt):
-                                    print("⚠️ HF dict formato retornou apenas o prompt, tentando próximo formato...")
+                                    logger.warning("⚠️ HF dict formato retornou apenas o prompt, tentando próximo formato...")
+                                    attempt.set_attribute("outcome", "echo")
+                                    FORMAT_FAILURES.inc(reason="echo", **labels)
                                     continue
                                     
-                                return generated_text
+                                details = result.get('details') or {}
+                                return await self._complete_response(
+                                    client, url, payload, prompt, generated_text, details.get('finish_reason'),
+                                    self._response_usage(result, request_started),
+                                    (f"{variant_prefix}:{payload_names[i]}", modality_key), prompt_key, negotiated,
+                                    template.continuation_prompt
+                                )
                             else:
-                                print(f"⚠️ Formato de resposta inesperado: {type(result)} - {str(result)[:200]}")
+                                logger.warning(f"⚠️ Formato de resposta inesperado: {type(result)} - {str(result)[:200]}")
+                                attempt.set_attribute("outcome", "unexpected_shape")
+                                FORMAT_FAILURES.inc(reason="unexpected_shape", **labels)
                                 continue
                         
                         # Log detailed error for debugging
                         error_text = response.text[:500] if response.text else "Sem conteúdo"
-                        print(f"⚠️ {payload_names[i]} falhou: {response.status_code} - {error_text}")
+                        logger.warning(
+                            f"⚠️ {payload_names[i]} falhou: {response.status_code} - {error_text}",
+                            extra=dict(labels, status=response.status_code)
+                        )
+                        # 200 sem conteúdo utilizável (choices vazias/estrutura inesperada) também chega aqui
+                        reason = "empty" if response.status_code == 200 else str(response.status_code)
+                        attempt.set_attribute("outcome", reason)
+                        FORMAT_FAILURES.inc(reason=reason, **labels)
                         
-                    except httpx.TimeoutException:
-                        print(f"⏱️ Timeout no formato {payload_names[i]}")
+                    except httpx.TimeoutException as e:
+                        logger.warning(f"⏱️ Timeout no formato {payload_names[i]}")
+                        attempt.set_attribute("outcome", "timeout")
+                        attempt.record_error(e)
+                        FORMAT_FAILURES.inc(reason="timeout", **labels)
                         continue
                     except Exception as e:
-                        print(f"❌ Erro no formato {payload_names[i]}: {str(e)}")
+                        logger.error(f"❌ Erro no formato {payload_names[i]}: {str(e)}")
+                        attempt.set_attribute("outcome", "error")
+                        attempt.record_error(e)
+                        FORMAT_FAILURES.inc(reason="error", **labels)
                         continue
+                    finally:
+                        attempt.end()
+        
+        # Nenhum formato funcionou: gera com o modelo local, se configurado
+        if self.local_fallback is not None and image_b64:
+            logger.info("🖥️ Endpoint indisponível - usando o modelo local")
+            try:
+                return await self.local_fallback._try_endpoint_formats(prompt, image_b64, template, prompt_variant)
+            except Exception as e:
+                logger.error(f"❌ Modelo local falhou: {str(e)}")
         
         return None
 
+    def _is_truncated(self, content: str, prompt: str, finish_reason: Optional[str]) -> bool:
+        """
+        Detect a cut-off report.
+
+        ``finish_reason == "length"`` is authoritative; when the endpoint does
+        not report a finish reason, a report missing some of the sections the
+        prompt asked for is treated as truncated.
+        """
+        if finish_reason == "length":
+            return True
+        if finish_reason is not None:
+            return False
+        expected_sections = len(self._section_positions(prompt))
+        return expected_sections > 0 and len(self._section_positions(content)) < expected_sections
+
+    @staticmethod
+    def _build_continuation_payload(payload: Dict[str, Any], partial: str, instruction: str) -> Dict[str, Any]:
+        """
+        Same request with the partial answer added as context to be continued
+        (chat formats also get ``instruction`` as a new user turn).
+        """
+        continuation = json.loads(json.dumps(payload))
+        
+        if "messages" in continuation:
+            continuation["messages"] = continuation["messages"] + [
+                {"role": "assistant", "content": partial},
+                {"role": "user", "content": instruction}
+            ]
+        elif "prompt" in continuation:
+            continuation["prompt"] = f"{continuation['prompt']}{partial}"
+        elif isinstance(continuation.get("inputs"), dict):
+            continuation["inputs"]["text"] = f"{continuation['inputs']['text']}{partial}"
+        elif isinstance(continuation.get("inputs"), str):
+            continuation["inputs"] = f"{continuation['inputs']}{partial}"
+        return continuation
+
+    @staticmethod
+    def _extract_completion(result: Any) -> Tuple[Optional[str], Optional[str]]:
+        """Return (text, finish_reason) from any of the supported response shapes."""
+        if isinstance(result, dict) and result.get('choices'):
+            choice = result['choices'][0]
+            message = choice.get('message') or {}
+            text = message.get('content') or choice.get('text')
+            return text, choice.get('finish_reason')
+        if isinstance(result, list) and result and isinstance(result[0], dict):
+            return result[0].get('generated_text'), (result[0].get('details') or {}).get('finish_reason')
+        if isinstance(result, dict) and 'generated_text' in result:
+            return result['generated_text'], (result.get('details') or {}).get('finish_reason')
+        return None, None
+
+    @staticmethod
+    def _stitch_continuation(partial: str, continuation: str, min_overlap: int = 20) -> str:
+        """Join both pieces, dropping text the model repeated at the start of the continuation."""
+        partial = partial.rstrip()
+        continuation = continuation.strip()
+        max_overlap = min(len(partial), len(continuation), 500)
+        for size in range(max_overlap, min_overlap - 1, -1):
+            if partial.endswith(continuation[:size]):
+                continuation = continuation[size:]
+                break
+        
+        if not continuation:
+            return partial
+        # Continua a palavra/frase interrompida quando o corte foi no meio dela
+        separator = "" if partial[-1:].isalnum() and continuation[:1].isalnum() else "\n" if continuation[:1] in "-•*0123456789" else " "
+        return f"{partial}{separator}{continuation}"
+
+    def _apply_token_budget(self, payload: Dict[str, Any], variant: str, modality: str) -> None:
+        """Replace the hard-coded generation limit of a payload with the learned budget."""
+        if "max_tokens" in payload:
+            payload["max_tokens"] = self.token_budget.budget_for(variant, modality, payload["max_tokens"])
+        elif "max_new_tokens" in payload.get("parameters", {}):
+            payload["parameters"]["max_new_tokens"] = self.token_budget.budget_for(
+                variant, modality, payload["parameters"]["max_new_tokens"]
+            )
+
+    @staticmethod
+    def _payload_budget(payload: Dict[str, Any]) -> Optional[int]:
+        return payload.get("max_tokens") or payload.get("parameters", {}).get("max_new_tokens")
+
+    @staticmethod
+    def _response_usage(result: Any, request_started: float) -> Dict[str, Any]:
+        """Token counts reported by a non-streamed response, plus its latency."""
+        if isinstance(result, list) and result and isinstance(result[0], dict):
+            result = result[0]
+        usage = (result.get('usage') or {}) if isinstance(result, dict) else {}
+        details = (result.get('details') or {}) if isinstance(result, dict) else {}
+        prefill = details.get('prefill')
+        return {
+            "completion_tokens": usage.get('completion_tokens') or details.get('generated_tokens'),
+            "prompt_tokens": usage.get('prompt_tokens') or (len(prefill) if isinstance(prefill, list) and prefill else None),
+            "first_token_seconds": None,
+            "total_seconds": time.perf_counter() - request_started
+        }
+
+    async def _complete_response(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        payload: Dict[str, Any],
+        prompt: str,
+        content: str,
+        finish_reason: Optional[str],
+        usage: Dict[str, Any],
+        budget_key: Tuple[str, str],
+        prompt_key: str,
+        negotiated: Optional[Tuple[str, str]] = None,
+        continuation_prompt: Optional[str] = None
+    ) -> str:
+        """
+        Recover a truncated answer if needed and record its token usage
+        (completion length for the token budget, prefill for the prompt stats).
+        ``negotiated`` is the (url, format) that produced it, remembered for batching;
+        ``continuation_prompt`` is the template's instruction to continue a cut-off report.
+        """
+        if negotiated is not None:
+            self.negotiated_format = negotiated
+        self.prefill_stats.record(
+            prompt_key, usage.get("prompt_tokens"), usage.get("first_token_seconds"), usage.get("total_seconds") or 0.0
+        )
+        
+        truncated = self._is_truncated(content, prompt, finish_reason)
+        final_content = await self._recover_truncation(
+            client, url, payload, prompt, content, finish_reason, continuation_prompt
+        )
+        
+        # Após uma continuação, o tamanho real é o do relatório completo
+        completion_tokens = usage.get("completion_tokens")
+        if truncated or not completion_tokens:
+            completion_tokens = estimate_tokens(final_content)
+        variant, modality = budget_key
+        budget = self._payload_budget(payload)
+        self.token_budget.record(variant, modality, completion_tokens, budget, truncated)
+        TOKEN_BUDGET_TOKENS.inc(budget or 0, variant=variant, modality=modality)
+        TOKEN_BUDGET_USED_TOKENS.inc(completion_tokens, variant=variant, modality=modality)
+        if truncated:
+            TOKEN_BUDGET_TRUNCATIONS.inc(variant=variant, modality=modality)
+        
+        current_span().set_attributes(outcome="success", completion_tokens=completion_tokens, truncated=truncated)
+        labels = {"upstream": upstream_label(url), "format": current_payload_format.get()}
+        FORMAT_SUCCESSES.inc(**labels)
+        GENERATED_TOKENS.inc(completion_tokens, **labels)
+        if usage.get("prompt_tokens"):
+            PROMPT_TOKENS.inc(usage["prompt_tokens"], **labels)
+        return final_content
+
+    async def _recover_truncation(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        payload: Dict[str, Any],
+        prompt: str,
+        content: str,
+        finish_reason: Optional[str],
+        continuation_prompt: Optional[str] = None
+    ) -> str:
+        """
+        Complete a truncated report with a single continuation request.
+
+        Only the missing tokens are generated: the partial answer is sent back
+        as context and the continuation is stitched onto it. Any failure keeps
+        the partial answer.
+        """
+        if not self._is_truncated(content, prompt, finish_reason):
+            return content
+        
+        logger.info(f"✂️ Resposta truncada (finish_reason={finish_reason}) - solicitando continuação...")
+        continuation_payload = self._build_continuation_payload(
+            payload, content, continuation_prompt or get_prompt_template().continuation_prompt
+        )
+        
+        try:
+            if STREAMING_ENABLED and self._supports_streaming(continuation_payload):
+                streamed = await self._stream_completion(client, url, continuation_payload, prompt)
+                if streamed["status_code"] != 200 or streamed["echo"]:
+                    logger.warning(f"⚠️ Continuação falhou: {streamed['status_code']} - {streamed['error_text']}")
+                    return content
+                continuation = streamed["content"]
+            else:
+                response = await client.post(url, headers=self.headers, json=continuation_payload)
+                if response.status_code != 200:
+                    logger.warning(f"⚠️ Continuação falhou: {response.status_code} - {response.text[:200]}")
+                    return content
+                continuation, _ = self._extract_completion(response.json())
+        except Exception as e:
+            logger.warning(f"⚠️ Erro na continuação, mantendo resposta parcial: {str(e)}")
+            return content
+        
+        if not continuation or not continuation.strip():
+            return content
+        
+        stitched = self._stitch_continuation(content, continuation)
+        logger.debug(f"🧵 Continuação recebida: {len(content)} + {len(continuation)} → {len(stitched)} caracteres")
+        return stitched
+
+    @staticmethod
+    def _supports_streaming(payload: Dict[str, Any]) -> bool:
+        """OpenAI-compatible payloads (chat/completions) can be streamed via SSE."""
+        return "messages" in payload or "prompt" in payload
+
+    async def _stream_completion(
+        self, client: httpx.AsyncClient, url: str, payload: Dict[str, Any], prompt: str
+    ) -> Dict[str, Any]:
+        """
+        Stream an OpenAI-compatible completion and stop it as early as possible.
+
+        The upstream request is cancelled (connection closed) as soon as the
+        first characters look like an echo of the prompt, or once all report
+        sections are complete.
+        """
+        stream_payload = dict(payload, stream=True)
+        pieces = []
+        received = 0
+        echo_checked = False
+        finish_reason = None
+        stop_reason = None
+        usage = {}
+        first_token_seconds = None
+        request_started = time.perf_counter()
+        
+        async with client.stream("POST", url, headers=self.headers, json=stream_payload) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                self.upstream_bodies.add(url, current_payload_format.get(), response.status_code, body, stream=True)
+                return {
+                    "status_code": response.status_code,
+                    "content": None,
+                    "echo": False,
+                    "finish_reason": None,
+                    "stop_reason": None,
+                    "usage": {},
+                    "error_text": body.decode("utf-8", errors="replace")[:500] if body else "Sem conteúdo"
+                }
+            
+            # Endpoint que ignora "stream": true responde com o JSON normal
+            if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                body = await response.aread()
+                self.upstream_bodies.add(url, current_payload_format.get(), 200, body, stream=False)
+                try:
+                    result = json.loads(body)
+                    content, finish_reason = self._extract_completion(result)
+                    usage = self._response_usage(result, request_started)
+                except ValueError:
+                    content, usage = None, {"total_seconds": time.perf_counter() - request_started}
+                content = (content or "").strip()
+                echo = self._is_prompt_echo(content, prompt)
+                return {
+                    "status_code": 200,
+                    "content": content,
+                    "echo": echo,
+                    "finish_reason": finish_reason,
+                    "stop_reason": "echo" if echo else None,
+                    "usage": usage,
+                    "error_text": None
+                }
+            
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                choice = choices[0]
+                delta = choice.get("delta") or {}
+                piece = delta.get("content") or choice.get("text") or ""
+                if piece:
+                    if first_token_seconds is None:
+                        first_token_seconds = time.perf_counter() - request_started
+                    pieces.append(piece)
+                    received += len(piece)
+                finish_reason = choice.get("finish_reason") or finish_reason
+                
+                # Echo: verificado uma única vez sobre os primeiros caracteres
+                if not echo_checked and received >= STREAM_ECHO_CHECK_CHARS:
+                    echo_checked = True
+                    if self._is_partial_prompt_echo("".join(pieces), prompt):
+                        stop_reason = "echo"
+                        break
+                
+                # Relatório completo: as cinco seções já foram escritas
+                if piece and "\n" in piece and self._completed_report_end("".join(pieces)) is not None:
+                    stop_reason = "complete"
+                    break
+        
+        content = "".join(pieces)
+        self.upstream_bodies.add(
+            url, current_payload_format.get(), 200, content, stream=True, stop_reason=stop_reason, usage=usage
+        )
+        if stop_reason == "complete":
+            content = content[:self._completed_report_end(content)]
+            logger.debug(f"✂️ Stream encerrado: todas as seções concluídas ({received} caracteres recebidos)")
+        elif stop_reason == "echo":
+            logger.warning(f"✂️ Stream cancelado após {received} caracteres: echo do prompt")
+        elif not echo_checked and self._is_partial_prompt_echo(content, prompt):
+            stop_reason = "echo"
+        
+        return {
+            "status_code": 200,
+            "content": content.strip(),
+            "echo": stop_reason == "echo",
+            "finish_reason": finish_reason,
+            "stop_reason": stop_reason,
+            "usage": {
+                "completion_tokens": usage.get("completion_tokens"),
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "first_token_seconds": first_token_seconds,
+                "total_seconds": time.perf_counter() - request_started
+            },
+            "error_text": None
+        }
+
+    @staticmethod
+    def _normalize_for_echo(text: str) -> str:
+        return " ".join(text.replace("<image>", " ").lower().split())
+
+    def _is_partial_prompt_echo(self, partial_response: str, original_prompt: str) -> bool:
+        """
+        Echo check that works on the first characters of a streamed response.
+
+        Unlike _is_prompt_echo (which needs the whole completion), this looks
+        at whether the beginning of the response reproduces the prompt.
+        """
+        partial = self._normalize_for_echo(partial_response)
+        prompt = self._normalize_for_echo(original_prompt)
+        if not partial or not prompt:
+            return False
+        
+        # O início da resposta é um trecho literal do prompt
+        probe = partial[:min(len(partial), 120)]
+        if len(probe) >= 40 and probe in prompt:
+            return True
+        
+        # Quase todas as palavras da resposta vêm do prompt
+        words_response = partial.split()
+        if len(words_response) < 30:
+            return False
+        words_prompt = set(prompt.split())
+        overlap = sum(1 for word in words_response if word in words_prompt) / len(words_response)
+        return overlap > 0.9
+
+    @staticmethod
+    def _section_positions(text: str) -> List[int]:
+        """Start offsets of each report section header found in order (stops at the first missing one)."""
+        positions = []
+        cursor = 0
+        for pattern in REPORT_SECTION_PATTERNS:
+            match = pattern.search(text, cursor)
+            if not match:
+                break
+            positions.append(match.start())
+            cursor = match.end()
+        return positions
+
+    def _completed_report_end(self, text: str) -> Optional[int]:
+        """
+        Offset where a complete report ends, or None if it is still being written.
+
+        The report is complete when all sections were written and the last one
+        (RECOMENDAÇÕES) already has content followed by a new paragraph that is
+        not a list item; that trailing paragraph is not part of the report.
+        """
+        positions = self._section_positions(text)
+        if len(positions) < len(REPORT_SECTION_PATTERNS):
+            return None
+        
+        header_end = text.find("\n", positions[-1])
+        if header_end == -1:
+            return None
+        content_match = re.compile(r"\S").search(text, header_end)
+        if not content_match:
+            return None
+        trailing = re.compile(r"\n\s*\n\s*[^\s\-•*\d]").search(text, content_match.start())
+        return trailing.start() if trailing else None
+
     def _is_prompt_echo(self, response: str, original_prompt: str) -> bool:
         """
         Verifica se a resposta é apenas um echo do prompt original.
@@ -413,7 +1514,7 @@ RESPOSTA:"""
                 overlap = len(words_prompt.intersection(words_response))
                 similarity = overlap / len(words_prompt)
                 
-                print(f"🔍 Similaridade prompt/resposta: {similarity:.2f}")
+                logger.debug(f"🔍 Similaridade prompt/resposta: {similarity:.2f}")
                 
                 # Se mais de 80% das palavras do prompt estão na resposta, é provavelmente echo
                 return similarity > 0.8
@@ -421,12 +1522,40 @@ RESPOSTA:"""
         return False
 
     def _format_medical_report(
-        self, ai_response: str, age: str, weight: str, clinical_history: str
+        self, ai_response: str, age: str, weight: str, clinical_history: str,
+        quality_warnings: Optional[List[str]] = None,
+        reused_from: Optional[Dict[str, Any]] = None,
+        similar_to: Optional[Dict[str, Any]] = None
     ) -> str:
         """Format the AI response into a professional medical report."""
         
         current_time = datetime.now().strftime('%d/%m/%Y às %H:%M')
         
+        reuse_section = ""
+        if similar_to:
+            original_time = datetime.fromtimestamp(similar_to["created_at"]).strftime('%d/%m/%Y às %H:%M')
+            reuse_section = f"""
+♻️  ESTUDO SEMELHANTE:
+• Imagem praticamente idêntica a um estudo analisado em {original_time}
+• Nova análise gerada; o relatório anterior acompanha a resposta para comparação
+"""
+        if reused_from:
+            original_time = datetime.fromtimestamp(reused_from["created_at"]).strftime('%d/%m/%Y às %H:%M')
+            reuse_section = f"""
+♻️  ANÁLISE REAPROVEITADA:
+• Imagem praticamente idêntica a um estudo analisado em {original_time}
+• Envie novamente com "force_regenerate" para gerar uma nova análise
+"""
+        
+        quality_section = ""
+        if quality_warnings:
+            quality_lines = "\n".join(f"• {warning}" for warning in quality_warnings)
+            quality_section = f"""
+⚠️  QUALIDADE DA IMAGEM:
+{quality_lines}
+• Interpretar os achados abaixo com cautela
+"""
+        
         formatted_report = f"""RELATÓRIO MÉDICO AUTOMATIZADO
 
 ═══════════════════════════════════════════════════════════════
@@ -440,7 +1569,7 @@ HISTÓRICO CLÍNICO:
 
 ═══════════════════════════════════════════════════════════════
 ANÁLISE POR INTELIGÊNCIA ARTIFICIAL:
-
+{reuse_section}{quality_section}
 {ai_response}
 
 ═══════════════════════════════════════════════════════════════
@@ -460,7 +1589,7 @@ OBSERVAÇÕES IMPORTANTES:
 
 ═══════════════════════════════════════════════════════════════
 Sistema: MedIA Reports v1.0
-Modelo: MedGemma (Google)
+Modelo: {self.model_label}
 Processado em: {current_time}
 """
         
@@ -478,7 +1607,7 @@ Processado em: {current_time}
         
         for endpoint in endpoints_to_check:
             try:
-                async with httpx.AsyncClient(timeout=10.0) as client:
+                async with self._http_client(timeout=10.0) as client:
                     # Test different payload formats based on endpoint
                     if "/chat/completions" in endpoint:
                         test_payload = {
@@ -517,7 +1646,18 @@ Processado em: {current_time}
         return {
             "endpoints": status_results,
             "primary_endpoint": self.medgemma_url,
-            "dependencies_available": DEPENDENCIES_AVAILABLE
+            "dependencies_available": DEPENDENCIES_AVAILABLE,
+            "token_budget": self.token_budget.stats(),
+            "prompt_stats": self.prefill_stats.stats(),
+            "findings_cache": self.findings_cache.stats(),
+            "sessions": self.sessions.stats(),
+            "image_store": self.image_store.stats(),
+            "upstream_batching": dict(
+                self.upstream_batcher.stats(),
+                negotiated_format=list(self.negotiated_format) if self.negotiated_format else None,
+                unbatchable_formats=[list(key) for key in self.unbatchable_formats]
+            ) if self.upstream_batcher else None,
+            "local_fallback": self.local_fallback.local_stats() if self.local_fallback else None
         }
 
 # Demo service for WebContainer environment
@@ -532,7 +1672,13 @@ class DemoHuggingFaceService:
         image_base64: str,
         patient_age: str,
         patient_weight: str,
-        clinical_history: str
+        clinical_history: str,
+        force_regenerate: bool = False,
+        modality: Optional[str] = None,
+        language: Optional[str] = None,
+        session_id: Optional[str] = None,
+        image_id: Optional[str] = None,
+        details: Optional[Dict[str, Any]] = None
     ) -> str:
         """Generate a demo medical report."""
         
@@ -0,0 +1,142 @@
+"""
+Pre-flight image quality gate.
+
+Cheap, vectorized checks that run on a downscaled grayscale copy of the
+uploaded image so unusable inputs (blank, saturated, blurred or tiny) are
+caught before any request is sent to the model endpoint.
+"""
+
+import time
+from typing import Any, Dict, List
+
+try:
+    import numpy as np
+    from PIL import Image
+    QUALITY_DEPENDENCIES_AVAILABLE = True
+except ImportError:
+    QUALITY_DEPENDENCIES_AVAILABLE = False
+
+# Limiares padrão (podem ser sobrescritos via config.py)
+DEFAULT_MIN_DIMENSION = 128
+DEFAULT_MIN_DYNAMIC_RANGE = 12.0
+DEFAULT_MAX_CLIPPED_FRACTION = 0.85
+DEFAULT_MIN_LAPLACIAN_VARIANCE = 2.0
+DEFAULT_SAMPLE_SIZE = 512
+
+
+class ImageQualityError(Exception):
+    """Raised when an image fails the pre-flight quality gate."""
+
+    def __init__(self, assessment: Dict[str, Any]):
+        self.assessment = assessment
+        codes = ", ".join(issue["code"] for issue in assessment.get("issues", []))
+        super().__init__(f"Imagem rejeitada pelo controle de qualidade: {codes}")
+
+
+def _to_gray_array(image: "Image.Image", sample_size: int) -> "np.ndarray":
+    """Downscale the image and return it as a float32 grayscale array in [0, 255]."""
+    sample = image.copy()
+    sample.thumbnail((sample_size, sample_size), Image.Resampling.BILINEAR)
+
+    if sample.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        # Imagens de alta profundidade (ex.: exportações DICOM em PNG 16 bits)
+        # são normalizadas pelo próprio máximo para não parecerem "escuras".
+        array = np.asarray(sample.convert("F"), dtype=np.float32)
+        peak = float(array.max())
+        if peak > 0:
+            array = array * (255.0 / peak)
+        return array
+
+    if sample.mode == "P":
+        sample = sample.convert("RGBA" if "transparency" in sample.info else "RGB")
+    if sample.mode in ("RGBA", "LA"):
+        # Pixels transparentes são tratados como preto, como no achatamento para RGB
+        sample = sample.convert("RGB")
+    return np.asarray(sample.convert("L"), dtype=np.float32)
+
+
+def _laplacian_variance(gray: "np.ndarray") -> float:
+    """Variance of the 4-neighbour Laplacian, a standard focus/blur measure."""
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    laplacian = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+        - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def assess_image_quality(
+    image: "Image.Image",
+    min_dimension: int = DEFAULT_MIN_DIMENSION,
+    min_dynamic_range: float = DEFAULT_MIN_DYNAMIC_RANGE,
+    max_clipped_fraction: float = DEFAULT_MAX_CLIPPED_FRACTION,
+    min_laplacian_variance: float = DEFAULT_MIN_LAPLACIAN_VARIANCE,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+) -> Dict[str, Any]:
+    """
+    Run the pre-flight quality checks on a decoded image.
+
+    Returns:
+        Dict with ``acceptable`` (bool), the list of ``issues`` found (each with
+        ``code``, ``message``, ``value`` and ``threshold``), the raw ``metrics``
+        and ``elapsed_ms``.
+    """
+    if not QUALITY_DEPENDENCIES_AVAILABLE:
+        raise Exception("Controle de qualidade requer numpy e pillow instalados")
+
+    start = time.perf_counter()
+    issues: List[Dict[str, Any]] = []
+    width, height = image.size
+
+    if min(width, height) < min_dimension:
+        issues.append({
+            "code": "too_small",
+            "message": f"Imagem muito pequena ({width}x{height} pixels)",
+            "value": min(width, height),
+            "threshold": min_dimension,
+        })
+
+    gray = _to_gray_array(image, sample_size)
+
+    low, high = np.percentile(gray, [1, 99])
+    dynamic_range = float(high - low)
+    clipped_fraction = float(np.count_nonzero((gray <= 2) | (gray >= 253)) / gray.size)
+    laplacian_variance = _laplacian_variance(gray)
+
+    if dynamic_range < min_dynamic_range:
+        issues.append({
+            "code": "blank",
+            "message": "Imagem praticamente uniforme (sem contraste útil)",
+            "value": round(dynamic_range, 2),
+            "threshold": min_dynamic_range,
+        })
+    elif clipped_fraction > max_clipped_fraction:
+        issues.append({
+            "code": "saturated",
+            "message": "Imagem saturada (excesso de pixels totalmente pretos/brancos)",
+            "value": round(clipped_fraction, 4),
+            "threshold": max_clipped_fraction,
+        })
+    elif laplacian_variance < min_laplacian_variance:
+        # Só faz sentido medir o foco quando há contraste suficiente
+        issues.append({
+            "code": "blurry",
+            "message": "Imagem excessivamente desfocada",
+            "value": round(laplacian_variance, 2),
+            "threshold": min_laplacian_variance,
+        })
+
+    return {
+        "acceptable": not issues,
+        "issues": issues,
+        "metrics": {
+            "width": width,
+            "height": height,
+            "mode": image.mode,
+            "dynamic_range": round(dynamic_range, 2),
+            "clipped_fraction": round(clipped_fraction, 4),
+            "laplacian_variance": round(laplacian_variance, 2),
+        },
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
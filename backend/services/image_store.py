@@ -0,0 +1,119 @@
+"""
+Pre-uploaded images preprocessed in the background.
+
+The client uploads the image as soon as it is selected; decoding, quality
+checks, resizing and the JPEG/base64 encoding run while the clinician fills
+in the form, and /generate_report only references the returned handle.
+"""
+
+import asyncio
+import hashlib
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from services.cache import TTLCache
+
+
+class ImageNotFoundError(Exception):
+    """Raised when an image handle is unknown or has expired."""
+
+
+class PreparedImage:
+    """Result of the preprocessing stage, ready to be sent upstream."""
+
+    def __init__(
+        self,
+        image: Any,
+        image_b64: str,
+        quality_warnings: List[str],
+        perceptual_hash: Optional[int] = None,
+    ):
+        self.image = image
+        self.image_b64 = image_b64
+        self.quality_warnings = quality_warnings
+        self.perceptual_hash = perceptual_hash
+        self._digest: Optional[str] = None
+
+    @property
+    def digest(self) -> str:
+        """Content hash of the preprocessed pixels (independent of the upload encoding)."""
+        if self._digest is None:
+            digest = hashlib.sha256(f"{self.image.mode}:{self.image.size}".encode("utf-8"))
+            digest.update(self.image.tobytes())
+            self._digest = digest.hexdigest()
+        return self._digest
+
+
+class ImageStore:
+    """Handles to background preprocessing tasks, evicted by TTL and count."""
+
+    def __init__(self, max_entries: int = 64, ttl_seconds: float = 900):
+        self._tasks = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        # Hash do conteúdo enviado -> handle, para reaproveitar o pré-processamento
+        self._by_content = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._pending = 0
+
+    def find(self, content_hash: str) -> Optional[str]:
+        """Handle of a still-available image with the same uploaded content."""
+        image_id = self._by_content.get(content_hash)
+        if image_id is None:
+            return None
+        task = self._tasks.get(image_id)
+        if task is None or task.cancelled():
+            return None
+        return image_id
+
+    def submit(
+        self, prepare: Callable[..., PreparedImage], *args: Any, content_hash: Optional[str] = None
+    ) -> str:
+        """Start ``prepare(*args)`` in a worker thread and return its handle."""
+        image_id = uuid.uuid4().hex
+        if content_hash:
+            self._by_content.set(content_hash, image_id)
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(prepare, *args))
+        self._pending += 1
+        task.add_done_callback(self._task_done)
+        self._tasks.set(image_id, task)
+        return image_id
+
+    def _task_done(self, task: "asyncio.Task") -> None:
+        self._pending -= 1
+        # Evita o aviso "exception was never retrieved" quando a imagem é rejeitada
+        if not task.cancelled():
+            task.exception()
+
+    def pending(self) -> int:
+        """Images whose preprocessing has not finished yet."""
+        return self._pending
+
+    async def get(self, image_id: str) -> PreparedImage:
+        """Wait for the preprocessing of ``image_id`` (re-raising its error, if any)."""
+        task = self._tasks.get(image_id)
+        if task is None:
+            raise ImageNotFoundError(f"Imagem não encontrada ou expirada: {image_id}")
+        return await asyncio.shield(task)
+
+    def status(self, image_id: str) -> Dict[str, Any]:
+        task = self._tasks.get(image_id)
+        if task is None:
+            raise ImageNotFoundError(f"Imagem não encontrada ou expirada: {image_id}")
+        if not task.done():
+            return {"image_id": image_id, "status": "processing"}
+        error = task.exception()
+        if error is not None:
+            return {
+                "image_id": image_id,
+                "status": "rejected" if hasattr(error, "assessment") else "error",
+                "message": str(error),
+                "quality": getattr(error, "assessment", None),
+            }
+        prepared = task.result()
+        return {
+            "image_id": image_id,
+            "status": "ready",
+            "size": list(prepared.image.size),
+            "quality_warnings": prepared.quality_warnings,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._tasks.stats(), pending=self._pending)
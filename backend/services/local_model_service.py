@@ -0,0 +1,550 @@
+"""
+Local CPU inference with transformers.
+
+``LocalModelService`` keeps the interface of ``HuggingFaceService`` (image
+preprocessing, pre-upload, sessions, duplicate reuse) but generates the text
+with a small image-to-text model running in-process. It can be the main
+service (no network access, benchmarks) or the fallback of the remote
+service when the endpoint is unreachable.
+"""
+
+import asyncio
+import base64
+import copy
+import hashlib
+import inspect
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import torch
+    from transformers import AutoModelForVision2Seq, AutoProcessor
+    from transformers.modeling_outputs import BaseModelOutputWithPooling
+    LOCAL_MODEL_AVAILABLE = True
+except ImportError:
+    LOCAL_MODEL_AVAILABLE = False
+
+import numpy as np
+from PIL import Image
+
+from config import (
+    LOCAL_MODEL_NAME,
+    LOCAL_MODEL_THREADS,
+    LOCAL_MODEL_CPUS,
+    LOCAL_MODEL_MAX_NEW_TOKENS,
+    LOCAL_MODEL_TEXT_PREFIX,
+    LOCAL_MODEL_PRECISION,
+    LOCAL_EMBEDDING_CACHE_MB,
+    LOCAL_EMBEDDING_SPILL_DIR,
+    LOCAL_EMBEDDING_SPILL_MAX_MB,
+    LOCAL_MODEL_PROMPT_MODE,
+    LOCAL_PREFIX_CACHE_ENABLED,
+    LOCAL_BATCH_MAX_SIZE,
+    LOCAL_BATCH_MAX_WAIT_MS
+)
+from services.batch_scheduler import BatchScheduler
+from services.embedding_cache import EmbeddingCache
+from services.huggingface_service import HuggingFaceService
+from services.metrics import CACHE_HIT_RATIO, GENERATED_TOKENS, QUEUE_DEPTH, STAGE_SECONDS
+from services.structured_logging import get_logger
+from services.prefix_cache import PrefixStateCache
+from services.prompts import PromptTemplate, get_prompt_template
+
+logger = get_logger("local_model")
+
+def parse_cpu_list(spec: str) -> Set[int]:
+    """Parse a CPU list such as "0-3,6" into a set of CPU ids."""
+    cpus: Set[int] = set()
+    for part in filter(None, (piece.strip() for piece in spec.split(","))):
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def bf16_supported() -> bool:
+    """True when this CPU runs bf16 matmuls natively (AVX512-BF16/AMX via oneDNN)."""
+    if not LOCAL_MODEL_AVAILABLE:
+        return False
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def load_local_model(model_name: str, precision: str = "fp32") -> Tuple[Any, Any, str]:
+    """
+    Load processor and model in the requested precision.
+
+    "int8" applies dynamic int8 quantization to the Linear layers (weights
+    stored in int8, activations quantized on the fly); "bf16" loads the
+    weights in bfloat16 and falls back to fp32 on CPUs without bf16 support.
+    Returns ``(processor, model, effective_precision)``.
+    """
+    if precision not in PRECISIONS:
+        raise Exception(f"Precisão inválida: {precision} (use {', '.join(PRECISIONS)})")
+    if precision == "bf16" and not bf16_supported():
+        logger.warning("⚠️ CPU sem suporte nativo a bf16 - usando fp32")
+        precision = "fp32"
+
+    processor = AutoProcessor.from_pretrained(model_name)
+    dtype = torch.bfloat16 if precision == "bf16" else torch.float32
+    model = AutoModelForVision2Seq.from_pretrained(model_name, torch_dtype=dtype)
+    model.eval()
+    if precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return processor, model, precision
+
+
+# Submódulos que recebem pixel_values e produzem os embeddings da imagem
+VISION_TOWER_ATTRIBUTES = ("vision_model", "encoder")
+
+
+def _owned_row(row: Any) -> np.ndarray:
+    """float32 array owning its memory (not a view into the batch tensor)."""
+    return row.detach().float().cpu().numpy().copy()
+
+
+def install_embedding_cache(model: Any, cache: EmbeddingCache, key_prefix: str) -> Optional[str]:
+    """
+    Wrap the vision tower of ``model`` so its outputs are served from ``cache``.
+
+    Each image of a batch is keyed by the hash of its preprocessed pixels;
+    only the images not cached go through the encoder. Calls asking for
+    hidden states/attentions bypass the cache. Returns the wrapped attribute
+    name, or None when the model has no recognizable vision tower.
+    """
+    for attribute in VISION_TOWER_ATTRIBUTES:
+        vision = getattr(model, attribute, None)
+        if vision is not None and "pixel_values" in inspect.signature(vision.forward).parameters:
+            break
+    else:
+        return None
+
+    original_forward = vision.forward
+    bypass_arguments = ("output_hidden_states", "output_attentions")
+
+    def cached_forward(pixel_values=None, *args, **kwargs):
+        if (
+            pixel_values is None or args
+            or any(kwargs.get(name) for name in bypass_arguments)
+            or kwargs.get("return_dict") is False
+        ):
+            return original_forward(pixel_values, *args, **kwargs)
+
+        keys = [
+            hashlib.sha256(key_prefix.encode("utf-8") + row.float().numpy().tobytes()).hexdigest()
+            for row in pixel_values.detach().cpu()
+        ]
+        entries = [cache.get(key) for key in keys]
+        missing = [index for index, entry in enumerate(entries) if entry is None]
+        if missing:
+            outputs = original_forward(pixel_values[missing], **kwargs)
+            for row, index in enumerate(missing):
+                # Cópia própria: uma view da linha manteria viva a saída do lote inteiro,
+                # que o limite de bytes do cache (row.nbytes) não contabiliza
+                entries[index] = {"last_hidden_state": _owned_row(outputs.last_hidden_state[row])}
+                if getattr(outputs, "pooler_output", None) is not None:
+                    entries[index]["pooler_output"] = _owned_row(outputs.pooler_output[row])
+                cache.set(keys[index], entries[index])
+
+        dtype = pixel_values.dtype
+
+        def stack(name):
+            if any(name not in entry for entry in entries):
+                return None
+            return torch.stack([torch.from_numpy(np.array(entry[name])) for entry in entries]).to(dtype)
+
+        return BaseModelOutputWithPooling(
+            last_hidden_state=stack("last_hidden_state"), pooler_output=stack("pooler_output")
+        )
+
+    vision.forward = cached_forward
+    return attribute
+
+
+class LocalModelService(HuggingFaceService):
+    """Same service interface, with generation running on a local CPU model."""
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_MODEL_NAME,
+        num_threads: int = LOCAL_MODEL_THREADS,
+        cpus: str = LOCAL_MODEL_CPUS,
+        max_new_tokens: int = LOCAL_MODEL_MAX_NEW_TOKENS,
+        text_prefix: str = LOCAL_MODEL_TEXT_PREFIX,
+        precision: str = LOCAL_MODEL_PRECISION,
+        prompt_mode: str = LOCAL_MODEL_PROMPT_MODE,
+        max_batch_size: int = LOCAL_BATCH_MAX_SIZE,
+        max_wait_ms: float = LOCAL_BATCH_MAX_WAIT_MS,
+        embedding_cache_mb: int = LOCAL_EMBEDDING_CACHE_MB
+    ):
+        super().__init__(api_token="")
+        self.model_name = model_name
+        self.model_label = f"{model_name} (local, CPU)"
+        self.medgemma_url = f"local://{model_name}"
+        self.upstream_batcher = None
+        self.num_threads = max(1, num_threads)
+        self.cpus = parse_cpu_list(cpus) if cpus else set()
+        self.max_new_tokens = max_new_tokens
+        self.text_prefix = text_prefix or None
+        self.precision = precision
+        self.effective_precision: Optional[str] = None
+        
+        # Embeddings da imagem por hash dos pixels pré-processados (LRU + spill opcional em disco)
+        self.embedding_cache = EmbeddingCache(
+            max_bytes=embedding_cache_mb * 1024 * 1024,
+            spill_dir=LOCAL_EMBEDDING_SPILL_DIR or None,
+            max_spill_bytes=LOCAL_EMBEDDING_SPILL_MAX_MB * 1024 * 1024
+        ) if embedding_cache_mb > 0 else None
+        self.vision_tower: Optional[str] = None
+        
+        # Estado (KV) do bloco estático de cada versão de prompt, no modo "template"
+        self.prompt_mode = prompt_mode
+        self.prefix_cache = PrefixStateCache() if LOCAL_PREFIX_CACHE_ENABLED else None
+        self.prefix_reuse_error: Optional[str] = None
+
+        self.model = None
+        self.processor = None
+        self.load_seconds: Optional[float] = None
+        self.load_error: Optional[str] = None
+        self._load_lock = threading.Lock()
+        self._stats = {"requests": 0, "generated_tokens": 0, "generate_seconds": 0.0}
+
+        # Um único worker dedicado: o modelo é carregado e executado sempre na mesma thread
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="local-model", initializer=self._init_worker
+        )
+        # Requisições simultâneas são agrupadas em lotes enquanto o worker está ocupado
+        self.scheduler = BatchScheduler(self._run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+        QUEUE_DEPTH.set_function(lambda: self.scheduler.queue_depth(), queue="local_scheduler")
+        if self.embedding_cache is not None:
+            CACHE_HIT_RATIO.set_function(lambda: self.embedding_cache.stats()["hit_rate"], cache="local_embedding")
+        if self.prefix_cache is not None:
+            CACHE_HIT_RATIO.set_function(self._prefix_hit_ratio, cache="local_prefix")
+
+    def _prefix_hit_ratio(self) -> Optional[float]:
+        stats = self.prefix_cache.stats()
+        lookups = stats["reuses"] + stats["builds"] + stats["mismatches"]
+        return stats["reuses"] / lookups if lookups else None
+
+    def _init_worker(self) -> None:
+        """Pin the worker (and the torch threads it spawns) to the configured CPUs."""
+        if self.cpus and hasattr(os, "sched_setaffinity"):
+            try:
+                # No Linux, pid 0 é a thread atual; as threads do torch herdam a afinidade
+                os.sched_setaffinity(0, self.cpus)
+            except OSError as e:
+                logger.warning(f"⚠️ Não foi possível fixar as CPUs {sorted(self.cpus)}: {str(e)}")
+        if LOCAL_MODEL_AVAILABLE:
+            torch.set_num_threads(self.num_threads)
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                pass  # só pode ser definido antes do primeiro uso do torch
+
+    def _ensure_loaded(self) -> None:
+        """Load the model on first use (inside the worker thread)."""
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
+            if not LOCAL_MODEL_AVAILABLE:
+                self.load_error = "transformers/torch não instalados"
+                raise Exception(
+                    "Dependências do modelo local não estão disponíveis. Instale: pip install transformers torch"
+                )
+            logger.info(f"📥 Carregando modelo local {self.model_name}...")
+            started = time.perf_counter()
+            try:
+                self.processor, model, self.effective_precision = load_local_model(self.model_name, self.precision)
+            except Exception as e:
+                self.load_error = str(e)
+                raise Exception(f"Erro ao carregar o modelo local: {str(e)}")
+            if self.embedding_cache is not None:
+                self.vision_tower = install_embedding_cache(
+                    model, self.embedding_cache, f"{self.model_name}:{self.effective_precision}:"
+                )
+                if self.vision_tower is None:
+                    logger.warning("⚠️ Torre de visão não reconhecida - cache de embeddings desativado")
+            self.model = model
+            self.load_error = None
+            self.load_seconds = time.perf_counter() - started
+            logger.info(
+                f"✅ Modelo local carregado em {self.load_seconds:.1f}s "
+                f"({self.effective_precision}, {self.num_threads} threads)"
+            )
+
+    def _compose_text(self, text: Optional[str], prefix: Optional[str]) -> Optional[str]:
+        """
+        Add the processor's image placeholder (models that take the image as
+        tokens) right after the static prefix, so the prefix state does not
+        depend on the image.
+        """
+        image_token = getattr(self.processor, "image_token", None)
+        if not text or not image_token or image_token in text:
+            return text
+        if prefix and text.startswith(prefix):
+            return f"{prefix}{image_token}\n{text[len(prefix):].lstrip()}"
+        return f"{image_token}\n{text}"
+
+    def _prepare_inputs(self, images: List[Image.Image], texts: Optional[List[str]]) -> Any:
+        inputs = self.processor(images=images, text=texts, padding=True, return_tensors="pt")
+        if self.effective_precision == "bf16":
+            inputs["pixel_values"] = inputs["pixel_values"].to(torch.bfloat16)
+        return inputs
+
+    @staticmethod
+    def _decode_image(image_b64: str) -> Image.Image:
+        return Image.open(io.BytesIO(base64.b64decode(image_b64))).convert("RGB")
+
+    @staticmethod
+    def _strip_prompt(output_ids: Any, input_ids: Any) -> Any:
+        """Decoder-only models return the prompt before the generated tokens."""
+        length = input_ids.shape[-1]
+        if output_ids.shape[-1] >= length and torch.equal(output_ids[:, :length], input_ids):
+            return output_ids[:, length:]
+        return output_ids
+
+    def prefix_reuse_supported(self) -> bool:
+        """
+        Prefix state is only image-independent in decoder-only models that
+        take the image as tokens of the sequence; in cross-attention
+        captioners (e.g. BLIP) every text position attends to the image.
+        """
+        return (
+            self.prefix_cache is not None
+            and self.prefix_reuse_error is None
+            and hasattr(self.model, "language_model")
+            and not getattr(self.model.config, "is_encoder_decoder", False)
+        )
+
+    def _prefix_state(self, prefix_key: str, prefix: str, input_ids: Any) -> Optional[Tuple[Any, int]]:
+        """Copy of the cached prefix state matching ``input_ids`` (None: full prefill)."""
+        entry = self.prefix_cache.get(prefix_key)
+        if entry is None:
+            prefix_ids = self.processor.tokenizer(prefix, return_tensors="pt").input_ids
+            # Tokens em comum (o último token do prefixo pode se unir ao texto seguinte)
+            common = 0
+            limit = min(prefix_ids.shape[-1], input_ids.shape[-1] - 1)
+            while common < limit and int(prefix_ids[0, common]) == int(input_ids[0, common]):
+                common += 1
+            if common == 0:
+                self.prefix_cache.record_mismatch()
+                return None
+            shared_ids = input_ids[:, :common]
+
+            def build():
+                with torch.inference_mode():
+                    state = self.model(input_ids=shared_ids, use_cache=True).past_key_values
+                return shared_ids, state, common
+
+            entry = self.prefix_cache.build(prefix_key, build)
+
+        shared_ids, state, prefix_tokens = entry
+        if input_ids.shape[-1] <= prefix_tokens or not torch.equal(input_ids[:, :prefix_tokens], shared_ids):
+            self.prefix_cache.record_mismatch()
+            return None
+        self.prefix_cache.record_reuse(prefix_tokens)
+        # O decode estende o estado no lugar: cada requisição parte de uma cópia
+        return copy.deepcopy(state), prefix_tokens
+
+    def _generate_prefixed_sync(
+        self,
+        image_b64: str,
+        text: str,
+        max_new_tokens: int,
+        prefix: Optional[str],
+        prefix_key: Optional[str],
+        reuse_prefix: bool = True
+    ) -> Tuple[str, int]:
+        """Generate one request, starting from the shared prefix state when possible."""
+        self._ensure_loaded()
+        inputs = self._prepare_inputs([self._decode_image(image_b64)], [self._compose_text(text, prefix)])
+
+        cached = None
+        if reuse_prefix and prefix and prefix_key and self.prefix_reuse_supported():
+            cached = self._prefix_state(prefix_key, prefix, inputs["input_ids"])
+
+        with torch.inference_mode():
+            if cached is not None:
+                try:
+                    output_ids = self.model.generate(**inputs, past_key_values=cached[0], max_new_tokens=max_new_tokens)
+                except Exception as e:
+                    # Modelo sem suporte a past_key_values inicial: desativa o reuso
+                    logger.warning(f"⚠️ Reuso do prefixo falhou, usando prefill completo: {str(e)}")
+                    self.prefix_reuse_error = str(e)
+                    cached = None
+            if cached is None:
+                output_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+
+        generated = self._strip_prompt(output_ids, inputs["input_ids"])
+        text_out = self.processor.batch_decode(generated, skip_special_tokens=True)[0].strip()
+        return text_out, int(generated.shape[-1])
+
+    def _generate_batch_sync(self, items: List[Tuple[Any, ...]]) -> Tuple[List[str], int]:
+        """
+        Run one scheduler batch. Items with the same text and token limit
+        share a single padded ``generate`` call; prompts with a cached static
+        prefix are decoded one by one from a copy of the prefix state.
+        """
+        self._ensure_loaded()
+        groups: Dict[Tuple[Optional[str], int], List[int]] = {}
+        prefixed: List[int] = []
+        for index, (_, text, max_new_tokens, prefix, prefix_key) in enumerate(items):
+            if prefix_key and self.prefix_reuse_supported():
+                prefixed.append(index)
+            else:
+                groups.setdefault((text, max_new_tokens), []).append(index)
+
+        results: List[str] = [""] * len(items)
+        generated_tokens = 0
+        started = time.perf_counter()
+        for index in prefixed:
+            image_b64, text, max_new_tokens, prefix, prefix_key = items[index]
+            results[index], generated = self._generate_prefixed_sync(
+                image_b64, text, max_new_tokens, prefix, prefix_key
+            )
+            generated_tokens += generated
+
+        for (text, max_new_tokens), indexes in groups.items():
+            text = self._compose_text(text, items[indexes[0]][3])
+            inputs = self._prepare_inputs(
+                [self._decode_image(items[index][0]) for index in indexes],
+                [text] * len(indexes) if text else None
+            )
+            with torch.inference_mode():
+                output_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+
+            input_length = inputs["input_ids"].shape[-1] if "input_ids" in inputs else 0
+            generated = self._strip_prompt(output_ids, inputs["input_ids"]) if input_length else output_ids
+            # Captioners com prefixo de texto devolvem o prefixo (não removido acima) junto com os tokens gerados
+            prefix_tokens = input_length if generated is output_ids else 0
+            output_ids = generated
+            pad_token_id = self.processor.tokenizer.pad_token_id
+            if pad_token_id is not None:
+                lengths = (output_ids != pad_token_id).sum(dim=-1).tolist()
+            else:
+                lengths = [output_ids.shape[-1]] * len(indexes)
+            generated_tokens += sum(max(int(length) - prefix_tokens, 0) for length in lengths)
+            for index, decoded in zip(indexes, self.processor.batch_decode(output_ids, skip_special_tokens=True)):
+                results[index] = decoded.strip()
+
+        self._stats["requests"] += len(items)
+        self._stats["generated_tokens"] += generated_tokens
+        self._stats["generate_seconds"] += time.perf_counter() - started
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="local_generate")
+        GENERATED_TOKENS.inc(generated_tokens, upstream=f"local/{self.model_name}", format="local")
+        return results, generated_tokens
+
+    async def _run_batch(self, items: List[Tuple[Any, ...]]) -> Tuple[List[str], int]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._generate_batch_sync, items)
+
+    async def generate(
+        self,
+        image_b64: str,
+        text: Optional[str] = None,
+        max_new_tokens: Optional[int] = None,
+        prefix: Optional[str] = None,
+        prefix_key: Optional[str] = None
+    ) -> str:
+        """
+        Generate text for an image through the batching scheduler.
+
+        ``text`` conditions the generation (a short prefix, a question or the
+        full prompt); by default the configured prefix is used. ``prefix`` is
+        the static start of ``text`` whose state is cached under ``prefix_key``.
+        """
+        if not image_b64:
+            raise Exception("O modelo local requer uma imagem (image-to-text)")
+        return await self.scheduler.submit((
+            image_b64,
+            text if text is not None else self.text_prefix,
+            max_new_tokens or self.max_new_tokens,
+            prefix,
+            prefix_key
+        ))
+
+    async def _try_endpoint_formats(
+        self,
+        prompt: str,
+        image_b64: str,
+        template: Optional[PromptTemplate] = None,
+        prompt_variant: str = "full",
+        formats: Optional[List[str]] = None
+    ) -> Optional[str]:
+        """Local replacement of the upstream format attempts."""
+        if not image_b64:
+            # Modelos image-to-text não fazem chamadas apenas em texto (ex.: síntese em dois estágios)
+            logger.warning("⚠️ Chamada apenas em texto não suportada pelo modelo local")
+            return None
+        logger.debug(f"🖥️ Gerando localmente com {self.model_name} ({prompt_variant})")
+        if self.prompt_mode != "template":
+            return await self.generate(image_b64)
+        
+        # Modelos que seguem instruções recebem o prompt completo; o bloco estático é reaproveitado
+        template = template or get_prompt_template()
+        if prompt.startswith(template.static_prefix):
+            return await self.generate(
+                image_b64, text=prompt, prefix=template.static_prefix,
+                prefix_key=f"{template.key}:{template.prefix_hash}"
+            )
+        return await self.generate(image_b64, text=prompt)
+
+    async def ask_followup(self, session_id: str, question: str) -> str:
+        """Answer a follow-up question conditioning the local model on it."""
+        session = self.sessions.get(session_id)
+        answer = await self.generate(session.image_b64, text=question)
+        if not answer:
+            raise Exception("Modelo local não respondeu à pergunta de acompanhamento")
+        session.add_exchange(question, answer)
+        self.sessions.touch()
+        return answer
+
+    def local_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["tokens_per_second"] = round(
+            stats["generated_tokens"] / stats["generate_seconds"], 2
+        ) if stats["generate_seconds"] else None
+        return {
+            "model": self.model_name,
+            "loaded": self.model is not None,
+            "load_seconds": round(self.load_seconds, 2) if self.load_seconds is not None else None,
+            "load_error": self.load_error,
+            "precision": self.effective_precision or self.precision,
+            "embedding_cache": dict(self.embedding_cache.stats(), vision_tower=self.vision_tower)
+            if self.embedding_cache is not None else None,
+            "prompt_mode": self.prompt_mode,
+            "prefix_cache": dict(
+                self.prefix_cache.stats(),
+                supported=self.prefix_reuse_supported() if self.model is not None else None,
+                error=self.prefix_reuse_error
+            ) if self.prefix_cache is not None else None,
+            "threads": self.num_threads,
+            "cpus": sorted(self.cpus) or None,
+            **stats,
+            "batching": self.scheduler.stats()
+        }
+
+    async def check_api_status(self) -> Dict[str, Any]:
+        """Local model status (the model itself is only loaded on first use)."""
+        return {
+            "status": "local_mode",
+            "primary_endpoint": self.medgemma_url,
+            "dependencies_available": LOCAL_MODEL_AVAILABLE,
+            "local_model": self.local_stats(),
+            "prompt_stats": self.prefill_stats.stats(),
+            "sessions": self.sessions.stats(),
+            "image_store": self.image_store.stats()
+        }
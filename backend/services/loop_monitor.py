@@ -0,0 +1,108 @@
+"""
+Event-loop lag monitor.
+
+A probe task sleeps for ``interval`` and measures how late it wakes up:
+that delay is time the loop spent running other callbacks without
+yielding, observed in ``medai_event_loop_lag_seconds``. A watchdog thread
+notices when the probe is overdue by more than ``threshold`` and captures
+the loop thread's stack at that moment, so the warning names the call that
+is blocking the loop (sync I/O, CPU-bound PIL work) and not whatever
+happened to run next.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG_SECONDS
+from services.structured_logging import get_logger
+
+logger = get_logger("loop_monitor")
+
+
+class LoopLagMonitor:
+    """
+    Samples scheduling delay every ``interval`` seconds and logs the stack of
+    any callback blocking the loop for at least ``threshold`` seconds. The
+    last ``history`` blocks are kept for ``recent_blocks()``.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1, max_frames: int = 30, history: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_frames = max_frames
+        self.blocks: deque = deque(maxlen=history)
+        self._beat = 0.0
+        self._captured: Optional[Tuple[float, List[str]]] = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._loop_thread: Optional[int] = None
+
+    def start(self) -> None:
+        """Start the probe on the running loop and the watchdog thread."""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._probe(), name="loop-lag-probe")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._watchdog.join)
+
+    async def _probe(self) -> None:
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - started - self.interval, 0.0)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self.threshold:
+                self._report(started, lag)
+
+    def _watch(self) -> None:
+        # Confere o atraso com folga suficiente para pegar a chamada ainda em execução
+        while not self._stopping.wait(max(self.threshold / 4, 0.005)):
+            beat = self._beat
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            with self._lock:
+                if self._captured is not None and self._captured[0] == beat:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                stack = traceback.format_stack(frame)[-self.max_frames:]
+                with self._lock:
+                    self._captured = (beat, stack)
+
+    def _report(self, beat: float, lag: float) -> None:
+        with self._lock:
+            stack = self._captured[1] if self._captured is not None and self._captured[0] == beat else None
+        EVENT_LOOP_BLOCKS.inc()
+        self.blocks.append({"at": time.time(), "blocked_ms": round(lag * 1000, 1), "stack": stack})
+        logger.warning(
+            f"🐢 Event loop bloqueado por {lag * 1000:.0f} ms"
+            + (":\n" + "".join(stack).rstrip() if stack else " (pilha não capturada)"),
+            extra={"blocked_ms": round(lag * 1000, 1)}
+        )
+
+    def recent_blocks(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most recent blocks, newest first."""
+        return list(self.blocks)[::-1][:limit]
@@ -0,0 +1,363 @@
+"""
+Prometheus-style metrics for the report pipeline.
+
+A small in-process registry (counters, gauges, histograms with labels)
+rendered in the Prometheus text exposition format by ``/metrics``.
+Upstream HTTP timings are collected by ``UpstreamMetricsTransport``, which
+wraps the httpx transport and labels each exchange with the upstream URL
+and the payload format being attempted (``current_payload_format``).
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+# Formato de payload em tentativa na tarefa atual (rótulo "format" das métricas do endpoint)
+current_payload_format: contextvars.ContextVar[str] = contextvars.ContextVar("current_payload_format", default="none")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: rótulos esperados {self.labelnames}, recebidos {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Gauge set directly, incremented/decremented, or read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], Optional[float]]] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Optional[float]], **labels: Any) -> None:
+        """Read the value from ``function`` on every scrape (None = omit the sample)."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    @contextmanager
+    def track(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def value(self, **labels: Any) -> Optional[float]:
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                values[key] = None
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items()) if value is not None
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # [contagem por bucket..., +Inf, soma]
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(self._key(labels))
+        return int(sum(series[:-1])) if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "medai_stage_seconds", "Time spent per pipeline stage (base64 decode, image decode, quality gate, image processing, hash, encode).",
+    ["stage"]
+))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "medai_http_request_seconds", "Backend request latency by route and status.", ["route", "status"]
+))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "medai_http_in_flight_requests", "Backend requests currently being served.", ["route"]
+))
+UPSTREAM_CONNECT_SECONDS = REGISTRY.register(Histogram(
+    "medai_upstream_connect_seconds", "TCP/TLS connection setup to the upstream (new connections only).",
+    ["upstream", "format"]
+))
+UPSTREAM_TTFB_SECONDS = REGISTRY.register(Histogram(
+    "medai_upstream_ttfb_seconds", "Time until the upstream response headers arrive.", ["upstream", "format"]
+))
+UPSTREAM_TOTAL_SECONDS = REGISTRY.register(Histogram(
+    "medai_upstream_total_seconds", "Time until the upstream response body is consumed or closed.",
+    ["upstream", "format"]
+))
+UPSTREAM_RESPONSES = REGISTRY.register(Counter(
+    "medai_upstream_responses_total", "Upstream responses by status code (or transport error).",
+    ["upstream", "format", "status"]
+))
+UPSTREAM_BYTES_SENT = REGISTRY.register(Counter(
+    "medai_upstream_request_bytes_total", "Request body bytes sent upstream.", ["upstream", "format"]
+))
+UPSTREAM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "medai_upstream_in_flight_requests", "Upstream requests currently open.", ["upstream", "format"]
+))
+FORMAT_ATTEMPTS = REGISTRY.register(Counter(
+    "medai_format_attempts_total", "Payload format attempts.", ["upstream", "format"]
+))
+FORMAT_FAILURES = REGISTRY.register(Counter(
+    "medai_format_failures_total", "Failed payload format attempts by reason (status code, echo, empty, timeout, error, batch_unsupported).",
+    ["upstream", "format", "reason"]
+))
+FORMAT_SUCCESSES = REGISTRY.register(Counter(
+    "medai_format_successes_total", "Payload format attempts that produced the report.", ["upstream", "format"]
+))
+GENERATED_TOKENS = REGISTRY.register(Counter(
+    "medai_generated_tokens_total", "Completion tokens generated (reported by the upstream or estimated).",
+    ["upstream", "format"]
+))
+PROMPT_TOKENS = REGISTRY.register(Counter(
+    "medai_prompt_tokens_total", "Prompt tokens reported by the upstream.", ["upstream", "format"]
+))
+TOKEN_BUDGET_TOKENS = REGISTRY.register(Counter(
+    "medai_token_budget_tokens_total", "max_tokens given to completions by the adaptive token budget.",
+    ["variant", "modality"]
+))
+TOKEN_BUDGET_USED_TOKENS = REGISTRY.register(Counter(
+    "medai_token_budget_used_tokens_total", "Completion tokens actually used against the token budget.",
+    ["variant", "modality"]
+))
+TOKEN_BUDGET_TRUNCATIONS = REGISTRY.register(Counter(
+    "medai_token_budget_truncations_total", "Completions cut off by the token budget and continued.",
+    ["variant", "modality"]
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "medai_cache_lookups_total", "Cache lookups by result (hit/miss).", ["cache", "result"]
+))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    "medai_cache_hit_ratio", "Hit ratio of caches that keep their own statistics.", ["cache"]
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "medai_queue_depth", "Items waiting in internal queues (micro-batcher, local scheduler, preprocessing).", ["queue"]
+))
+EVENT_LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "medai_event_loop_lag_seconds", "How late the event loop ran a scheduled probe (time blocked by other callbacks).",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+))
+EVENT_LOOP_BLOCKS = REGISTRY.register(Counter(
+    "medai_event_loop_blocks_total", "Times the event loop was blocked for longer than the configured threshold."
+))
+
+
+def upstream_label(url: Any) -> str:
+    """Host and path of an upstream URL (no scheme or query), e.g. ``host/v1/chat/completions``."""
+    parts = urlsplit(str(url))
+    return f"{parts.netloc}{parts.path.rstrip('/') or '/'}"
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class _TimedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close()
+
+
+class UpstreamMetricsTransport(httpx.AsyncBaseTransport):
+    """
+    Records connect time, TTFB, total time, status and in-flight count of
+    each upstream exchange, labeled by upstream URL and payload format.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        labels = {"upstream": upstream_label(request.url), "format": current_payload_format.get()}
+        connect_started: Dict[str, float] = {}
+        inner_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            # Eventos do httpcore: só existem quando uma conexão nova é aberta
+            if event_name == "connection.connect_tcp.started":
+                connect_started["at"] = time.perf_counter()
+            elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                connect_started["done"] = time.perf_counter()
+            if inner_trace is not None:
+                await inner_trace(event_name, info)
+
+        request.extensions = dict(request.extensions, trace=trace)
+        UPSTREAM_BYTES_SENT.inc(len(request.content), **labels)
+        UPSTREAM_IN_FLIGHT.inc(**labels)
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as error:
+            UPSTREAM_IN_FLIGHT.dec(**labels)
+            UPSTREAM_RESPONSES.inc(status=type(error).__name__, **labels)
+            raise
+        UPSTREAM_TTFB_SECONDS.observe(time.perf_counter() - started, **labels)
+        if "at" in connect_started and "done" in connect_started:
+            UPSTREAM_CONNECT_SECONDS.observe(connect_started["done"] - connect_started["at"], **labels)
+        UPSTREAM_RESPONSES.inc(status=str(response.status_code), **labels)
+
+        def on_close() -> None:
+            UPSTREAM_IN_FLIGHT.dec(**labels)
+            UPSTREAM_TOTAL_SECONDS.observe(time.perf_counter() - started, **labels)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TimedStream(response.stream, on_close),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
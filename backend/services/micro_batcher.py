@@ -0,0 +1,108 @@
+"""
+Upstream micro-batching.
+
+Concurrent requests that would be sent with the same URL, payload format
+and generation parameters are held for at most ``max_wait_ms`` (or until
+``max_batch_size`` are pending) and sent as a single batched call; the
+results are split back to each caller in submission order.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+
+class BatchUnsupportedError(Exception):
+    """The upstream rejected the batched input or answered with an unexpected shape."""
+
+
+class MicroBatcher:
+    """
+    Groups pending items by key and flushes them through ``send_batch``.
+
+    ``send_batch(key, items)`` must return one result per item, in order.
+    If it raises, every caller of that batch receives the exception and
+    decides how to fall back.
+    """
+
+    def __init__(
+        self,
+        send_batch: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20,
+    ):
+        self.send_batch = send_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._in_flight: Set[asyncio.Task] = set()
+        self._stats = {"batches": 0, "items": 0, "failed_batches": 0, "max_batch_size_seen": 0}
+        self._lock = threading.Lock()
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        """Queue ``item`` and wait for its share of the batched result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+
+        if len(pending) >= self.max_batch_size:
+            self._flush(key)
+        elif len(pending) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def pending(self) -> int:
+        return sum(len(items) for items in self._pending.values())
+
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._send(key, batch))
+        # Mantém referência às tarefas em andamento (evita coleta pelo GC)
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, key: Hashable, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        # Chamadores que desistiram (cancelados) não entram no lote
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            results = await self.send_batch(key, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise BatchUnsupportedError(
+                    f"Lote com {len(batch)} entradas retornou {len(results)} resultados"
+                )
+        except Exception as error:
+            self._record(len(batch), failed=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        self._record(len(batch), failed=False)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _record(self, size: int, failed: bool) -> None:
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["items"] += size
+            self._stats["failed_batches"] += int(failed)
+            self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], size)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_batch_size"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else None
+        stats["pending"] = self.pending()
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000
+        return stats
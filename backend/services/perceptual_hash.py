@@ -0,0 +1,137 @@
+"""
+Perceptual hashing for near-duplicate detection of re-uploaded studies.
+
+The same film re-photographed or re-exported at another size produces
+different bytes but an almost identical perceptual hash, so previously
+generated reports can be found by Hamming distance.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    from PIL import Image
+    PHASH_DEPENDENCIES_AVAILABLE = True
+except ImportError:
+    PHASH_DEPENDENCIES_AVAILABLE = False
+
+HASH_SIZE = 8
+_PHASH_SAMPLE = 32
+_dct_matrix_cache: Dict[int, "np.ndarray"] = {}
+
+
+def _gray_array(image: "Image.Image", width: int, height: int) -> "np.ndarray":
+    gray = image.convert("L").resize((width, height), Image.Resampling.LANCZOS)
+    return np.asarray(gray, dtype=np.float32)
+
+
+def _bits_to_int(bits: "np.ndarray") -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(size: int) -> "np.ndarray":
+    """Orthonormal DCT-II matrix (computed once per size)."""
+    if size not in _dct_matrix_cache:
+        n = np.arange(size)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+        matrix[0, :] *= 1 / np.sqrt(2)
+        _dct_matrix_cache[size] = (matrix * np.sqrt(2 / size)).astype(np.float32)
+    return _dct_matrix_cache[size]
+
+
+def dhash(image: "Image.Image", hash_size: int = HASH_SIZE) -> int:
+    """Difference hash: sign of the horizontal gradient on a tiny grayscale copy."""
+    pixels = _gray_array(image, hash_size + 1, hash_size)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: "Image.Image", hash_size: int = HASH_SIZE) -> int:
+    """DCT hash: low-frequency coefficients compared against their median."""
+    pixels = _gray_array(image, _PHASH_SAMPLE, _PHASH_SAMPLE)
+    dct = _dct_matrix(_PHASH_SAMPLE)
+    coefficients = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    # O coeficiente DC (brilho médio) não entra no cálculo da mediana
+    median = np.median(coefficients.flatten()[1:])
+    return _bits_to_int(coefficients > median)
+
+
+def compute_perceptual_hash(image: "Image.Image", algorithm: str = "phash") -> int:
+    """Compute the configured perceptual hash of a preprocessed image."""
+    if not PHASH_DEPENDENCIES_AVAILABLE:
+        raise Exception("Hash perceptual requer numpy e pillow instalados")
+    if algorithm == "dhash":
+        return dhash(image)
+    return phash(image)
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+def clinical_inputs_key(
+    age: str, weight: str, clinical_history: str, language: str = "", modality: str = ""
+) -> str:
+    """
+    Stable key for the clinical inputs and the requested report (language and
+    modality), insensitive to case and spacing.
+    """
+    normalized = "|".join(
+        " ".join(str(value or "").lower().split()) for value in (age, weight, clinical_history, language, modality)
+    )
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class PerceptualHashIndex:
+    """
+    Bounded in-memory index of perceptual hashes.
+
+    Entries are grouped by clinical inputs key so a lookup only compares the
+    hashes of studies submitted with the same patient data; the oldest
+    entries are evicted once ``max_entries`` is reached.
+    """
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+        self._by_inputs: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, image_hash: int, inputs_key: str, value: Any) -> None:
+        entry = {"hash": image_hash, "inputs_key": inputs_key, "value": value, "created_at": time.time()}
+        with self._lock:
+            key = (image_hash, inputs_key)
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            self._by_inputs.setdefault(inputs_key, {})[image_hash] = entry
+
+            while len(self._entries) > self.max_entries:
+                (old_hash, old_inputs), _ = self._entries.popitem(last=False)
+                bucket = self._by_inputs.get(old_inputs, {})
+                bucket.pop(old_hash, None)
+                if not bucket:
+                    self._by_inputs.pop(old_inputs, None)
+
+    def find(self, image_hash: int, inputs_key: str, max_distance: int) -> Optional[Dict[str, Any]]:
+        """Return the closest entry with the same inputs within ``max_distance`` bits."""
+        with self._lock:
+            candidates = list(self._by_inputs.get(inputs_key, {}).values())
+        return self._closest(image_hash, candidates, max_distance)
+
+    @staticmethod
+    def _closest(image_hash: int, candidates: List[Dict[str, Any]], max_distance: int) -> Optional[Dict[str, Any]]:
+        best = None
+        for entry in candidates:
+            distance = hamming_distance(image_hash, entry["hash"])
+            if distance <= max_distance and (best is None or distance < best["distance"]):
+                best = dict(entry, distance=distance)
+        return best
@@ -0,0 +1,63 @@
+"""
+Shared-prefix state cache for local inference.
+
+The static instruction block of each prompt version (see services.prompts)
+is identical across requests, so its KV state is computed once and every
+request decodes from a copy of it: per-request prefill only covers the
+patient-specific suffix and the image tokens.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class PrefixStateCache:
+    """
+    Prefix token ids and model state per prompt key (version/language/modality
+    plus the prefix hash), bounded to ``max_entries`` prefixes (LRU).
+
+    The cache is model-agnostic: ``build`` computes ``(prefix_ids, state)``
+    and callers are responsible for copying the state before decoding.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, Any, int]]" = OrderedDict()
+        self._stats = {"builds": 0, "reuses": 0, "mismatches": 0, "prefill_tokens_saved": 0}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[Any, Any, int]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def build(self, key: str, build: Callable[[], Tuple[Any, Any, int]]) -> Tuple[Any, Any, int]:
+        """Compute and store ``(prefix_ids, state, prefix_tokens)`` for ``key``."""
+        entry = build()
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._stats["builds"] += 1
+        return entry
+
+    def record_reuse(self, prefix_tokens: int) -> None:
+        with self._lock:
+            self._stats["reuses"] += 1
+            self._stats["prefill_tokens_saved"] += prefix_tokens
+
+    def record_mismatch(self) -> None:
+        """A request whose tokens did not start with the cached prefix (full prefill)."""
+        with self._lock:
+            self._stats["mismatches"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "prefixes": {key: entry[2] for key, entry in self._entries.items()},
+            }
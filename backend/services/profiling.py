@@ -0,0 +1,191 @@
+"""
+On-demand profiling: sampling CPU profiles, tracemalloc snapshots and
+asyncio task stacks.
+
+Nothing here runs until it is asked for: the CPU sampler is a thread that
+only exists for the requested duration and ``tracemalloc`` is only started
+explicitly, so there is no overhead while profiling is off. Stacks are
+rendered in the collapsed format (``frame;frame;frame count`` per line)
+read by flamegraph.pl, speedscope and similar tools.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from types import FrameType
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Folhas em que a thread só está esperando (event loop ocioso, pools e filas)
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("handlers.py", "dequeue"),
+}
+
+
+class ProfilerBusyError(Exception):
+    """A CPU profile is already being collected."""
+
+
+def _frame_label(filename: str, name: str, lineno: int) -> str:
+    return f"{name} ({os.path.basename(filename)}:{lineno})".replace(";", ":")
+
+
+def _frame_stack(frame: Optional[FrameType]) -> List[Tuple[str, str, int]]:
+    """(filename, function, line) from the outermost call to ``frame``."""
+    stack = []
+    while frame is not None:
+        stack.append((frame.f_code.co_filename, frame.f_code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def collapse(stacks: Counter) -> str:
+    """Collapsed-stack text, heaviest stacks first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+_cpu_lock = threading.Lock()
+
+
+def sample_cpu(seconds: float, interval: float = 0.005, include_idle: bool = False) -> Dict[str, Any]:
+    """
+    Sample the stacks of every thread each ``interval`` for ``seconds``
+    (blocking; run it off the event loop). Samples whose innermost frame
+    is only waiting are dropped unless ``include_idle``.
+    """
+    if not _cpu_lock.acquire(blocking=False):
+        raise ProfilerBusyError("Já existe um perfil de CPU em andamento")
+    try:
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = idle = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = _frame_stack(frame)
+                samples += 1
+                if not stack or (not include_idle and (os.path.basename(stack[-1][0]), stack[-1][1]) in IDLE_LEAVES):
+                    idle += 1
+                    continue
+                labels = [names.get(thread_id, f"thread-{thread_id}")] + [_frame_label(*entry) for entry in stack]
+                stacks[";".join(labels)] += 1
+            time.sleep(interval)
+        return {
+            "collapsed": collapse(stacks),
+            "samples": samples,
+            "idle_samples": idle,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    finally:
+        _cpu_lock.release()
+
+
+def start_memory_tracing(frames: int = 25) -> bool:
+    """Start tracemalloc; False when it was already running."""
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    return True
+
+
+def stop_memory_tracing() -> None:
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+
+
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def memory_snapshot(limit: int = 25, compare: bool = False) -> Dict[str, Any]:
+    """
+    Top allocators by line plus the allocation tracebacks as collapsed
+    stacks (weighted by bytes). With ``compare``, both are the growth
+    since the previous snapshot.
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc não está ativo")
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    previous, _last_snapshot = _last_snapshot, snapshot
+    if compare and previous is not None:
+        by_line = snapshot.compare_to(previous, "lineno")
+        by_traceback = snapshot.compare_to(previous, "traceback")
+        top = [
+            {"location": str(stat.traceback[0]), "size_bytes": stat.size, "size_diff_bytes": stat.size_diff,
+             "count": stat.count, "count_diff": stat.count_diff}
+            for stat in by_line[:limit]
+        ]
+        weighted = ((stat.traceback, stat.size_diff) for stat in by_traceback if stat.size_diff > 0)
+    else:
+        top = [
+            {"location": str(stat.traceback[0]), "size_bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]
+        ]
+        weighted = ((stat.traceback, stat.size) for stat in snapshot.statistics("traceback"))
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "compared": bool(compare and previous is not None),
+        "top": top,
+        "collapsed": _collapse_tracebacks(weighted),
+    }
+
+
+def _collapse_tracebacks(weighted: Iterable[Tuple[tracemalloc.Traceback, int]]) -> str:
+    stacks: Counter = Counter()
+    for traceback, size in weighted:
+        # tracemalloc guarda do frame mais recente para o mais antigo
+        frames = reversed(list(traceback))
+        stacks[";".join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in frames)] += size
+    return collapse(stacks)
+
+
+def _await_chain(coroutine: Any) -> List[Tuple[str, str, int]]:
+    """
+    Frames of a suspended coroutine and of everything it is awaiting
+    (``Task.get_stack`` only returns the outermost one).
+    """
+    stack = []
+    while coroutine is not None:
+        frame = getattr(coroutine, "cr_frame", None) or getattr(coroutine, "gi_frame", None) \
+            or getattr(coroutine, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append((frame.f_code.co_filename, frame.f_code.co_name, frame.f_lineno))
+        coroutine = getattr(coroutine, "cr_await", None) or getattr(coroutine, "gi_yieldfrom", None) \
+            or getattr(coroutine, "ag_await", None)
+    return stack
+
+
+def task_stacks(loop: Optional[asyncio.AbstractEventLoop] = None) -> Dict[str, Any]:
+    """Where each pending asyncio task is suspended (call from the loop's thread)."""
+    current = asyncio.current_task(loop)
+    stacks: Counter = Counter()
+    details = []
+    for task in asyncio.all_tasks(loop):
+        if task is current:
+            continue
+        coroutine = task.get_coro()
+        name = getattr(coroutine, "__qualname__", repr(coroutine))
+        labels = [_frame_label(*entry) for entry in _await_chain(coroutine)] or [name]
+        stacks[";".join(labels)] += 1
+        details.append({"name": task.get_name(), "coroutine": name, "stack": labels})
+    return {"count": len(details), "tasks": details, "collapsed": collapse(stacks)}
@@ -0,0 +1,246 @@
+"""
+Versioned prompt registry.
+
+Prompts are laid out for upstream prefix/KV caching: the long static
+instruction block comes first and is identical for every request of the
+same version, language and modality; per-patient variables come last.
+All templates are compiled once at import time.
+"""
+
+import hashlib
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+PROMPT_VERSION = "v2"
+DEFAULT_LANGUAGE = "pt"
+DEFAULT_MODALITY = "geral"
+
+_INSTRUCTIONS = {
+    "pt": """Você é um assistente de radiologia. Analise a imagem médica e forneça um relatório estruturado.
+{modality_hint}
+RESPONDA COM ANÁLISE MÉDICA INCLUINDO:
+
+1. QUALIDADE DA IMAGEM:
+- Qualidade técnica e adequação diagnóstica
+
+2. ESTRUTURAS ANATÔMICAS:
+- Estruturas visíveis e normalidades
+
+3. ACHADOS ANORMAIS:
+- Patologias identificadas com localização e características
+
+4. IMPRESSÃO DIAGNÓSTICA:
+- Diagnóstico baseado nos achados
+
+5. RECOMENDAÇÕES:
+- Próximos passos ou exames complementares
+""",
+    "en": """You are a radiology assistant. Analyze the medical image and provide a structured report.
+{modality_hint}
+ANSWER WITH A MEDICAL ANALYSIS INCLUDING:
+
+1. IMAGE QUALITY:
+- Technical quality and diagnostic adequacy
+
+2. ANATOMICAL STRUCTURES:
+- Visible structures and normal findings
+
+3. ABNORMAL FINDINGS:
+- Identified pathologies with location and characteristics
+
+4. DIAGNOSTIC IMPRESSION:
+- Diagnosis based on the findings
+
+5. RECOMMENDATIONS:
+- Next steps or complementary exams
+""",
+}
+
+_PATIENT_SECTION = {
+    "pt": """
+PACIENTE: {age} anos, {weight} kg
+HISTÓRIA: {clinical_history}
+
+RESPOSTA:""",
+    "en": """
+PATIENT: {age} years, {weight} kg
+HISTORY: {clinical_history}
+
+ANSWER:""",
+}
+
+# Pipeline em dois estágios: achados só da imagem, depois síntese apenas em texto
+_FINDINGS_PROMPT = {
+    "pt": """Você é um assistente de radiologia. Descreva objetivamente esta imagem médica, sem considerar dados clínicos.
+{modality_hint}
+LISTE:
+- Qualidade técnica e adequação diagnóstica
+- Estruturas anatômicas visíveis
+- Todos os achados, normais e anormais, com localização e características
+
+ACHADOS:""",
+    "en": """You are a radiology assistant. Objectively describe this medical image, without considering clinical data.
+{modality_hint}
+LIST:
+- Technical quality and diagnostic adequacy
+- Visible anatomical structures
+- All findings, normal and abnormal, with location and characteristics
+
+FINDINGS:""",
+}
+
+_SYNTHESIS_SECTION = {
+    "pt": """
+ACHADOS DESCRITOS NA IMAGEM (use-os como base, não invente achados):
+{findings}
+""",
+    "en": """
+FINDINGS DESCRIBED IN THE IMAGE (use them as the basis, do not invent findings):
+{findings}
+""",
+}
+
+_SIMPLE_PROMPT = {
+    "pt": "Analise esta imagem médica e descreva os principais achados.",
+    "en": "Analyze this medical image and describe the main findings.",
+}
+
+# Pedido de continuação de um relatório truncado (formatos de chat)
+_CONTINUATION_PROMPT = {
+    "pt": "Continue o relatório exatamente de onde parou, sem repetir o que já foi escrito.",
+    "en": "Continue the report exactly where it stopped, without repeating what has already been written.",
+}
+
+_MODALITY_HINTS = {
+    "pt": {
+        "geral": "",
+        "raio-x": "Modalidade: radiografia. Avalie penetração, rotação e inspiração quando aplicável.\n",
+        "tc": "Modalidade: tomografia computadorizada. Considere janelas e densidades (UH).\n",
+        "rm": "Modalidade: ressonância magnética. Descreva a intensidade de sinal dos achados.\n",
+        "us": "Modalidade: ultrassonografia. Descreva a ecogenicidade dos achados.\n",
+    },
+    "en": {
+        "geral": "",
+        "raio-x": "Modality: radiograph. Assess penetration, rotation and inspiration when applicable.\n",
+        "tc": "Modality: computed tomography. Consider windows and densities (HU).\n",
+        "rm": "Modality: magnetic resonance. Describe the signal intensity of the findings.\n",
+        "us": "Modality: ultrasound. Describe the echogenicity of the findings.\n",
+    },
+}
+
+# Sinônimos aceitos para a modalidade informada pelo cliente
+_MODALITY_ALIASES = {
+    "rx": "raio-x", "x-ray": "raio-x", "xray": "raio-x", "raio x": "raio-x", "radiografia": "raio-x",
+    "ct": "tc", "tomografia": "tc",
+    "mri": "rm", "mr": "rm", "ressonancia": "rm", "ressonância": "rm",
+    "ultrasound": "us", "ultrassom": "us", "usg": "us",
+}
+
+
+def normalize_modality(modality: Optional[str]) -> str:
+    key = (modality or DEFAULT_MODALITY).strip().lower()
+    key = _MODALITY_ALIASES.get(key, key)
+    return key if key in _MODALITY_HINTS[DEFAULT_LANGUAGE] else DEFAULT_MODALITY
+
+
+def normalize_language(language: Optional[str]) -> str:
+    key = (language or DEFAULT_LANGUAGE).strip().lower()[:2]
+    return key if key in _INSTRUCTIONS else DEFAULT_LANGUAGE
+
+
+class PromptTemplate:
+    """A compiled prompt: fixed static prefix plus a small per-patient suffix."""
+
+    def __init__(self, version: str, language: str, modality: str):
+        self.version = version
+        self.language = language
+        self.modality = modality
+        self.static_prefix = _INSTRUCTIONS[language].format(
+            modality_hint=_MODALITY_HINTS[language][modality]
+        )
+        self.patient_template = _PATIENT_SECTION[language]
+        self.simple_prompt = _SIMPLE_PROMPT[language]
+        self.continuation_prompt = _CONTINUATION_PROMPT[language]
+        self.findings_prompt = _FINDINGS_PROMPT[language].format(
+            modality_hint=_MODALITY_HINTS[language][modality]
+        )
+        self.synthesis_template = _SYNTHESIS_SECTION[language]
+        self.prefix_hash = hashlib.sha256(self.static_prefix.encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def key(self) -> str:
+        return f"{self.version}/{self.language}/{self.modality}"
+
+    def render(self, age: str, weight: str, clinical_history: str) -> str:
+        return self.static_prefix + self.patient_template.format(
+            age=age, weight=weight, clinical_history=clinical_history
+        )
+
+    def render_synthesis(self, findings: str, age: str, weight: str, clinical_history: str) -> str:
+        """Text-only prompt merging cached image findings with the patient data."""
+        return (
+            self.static_prefix
+            + self.synthesis_template.format(findings=findings.strip())
+            + self.patient_template.format(age=age, weight=weight, clinical_history=clinical_history)
+        )
+
+
+PROMPT_REGISTRY: Dict[Tuple[str, str, str], PromptTemplate] = {
+    (PROMPT_VERSION, language, modality): PromptTemplate(PROMPT_VERSION, language, modality)
+    for language in _INSTRUCTIONS
+    for modality in _MODALITY_HINTS[language]
+}
+
+
+def get_prompt_template(
+    language: Optional[str] = None,
+    modality: Optional[str] = None,
+    version: str = PROMPT_VERSION,
+) -> PromptTemplate:
+    """Look up the precompiled template for a language/modality."""
+    key = (version, normalize_language(language), normalize_modality(modality))
+    if key not in PROMPT_REGISTRY:
+        raise Exception(f"Prompt não registrado: {'/'.join(key)}")
+    return PROMPT_REGISTRY[key]
+
+
+class PrefillStats:
+    """Per-prompt prefill token counts and latency, to measure prefix-cache gains."""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples: Dict[str, Deque[Dict[str, Optional[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        prompt_key: str,
+        prompt_tokens: Optional[int],
+        first_token_seconds: Optional[float],
+        total_seconds: float,
+    ) -> None:
+        with self._lock:
+            self._samples.setdefault(prompt_key, deque(maxlen=self.window)).append({
+                "prompt_tokens": prompt_tokens,
+                "first_token_seconds": first_token_seconds,
+                "total_seconds": total_seconds,
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {key: list(samples) for key, samples in self._samples.items()}
+
+        def mean(values):
+            values = [value for value in values if value is not None]
+            return round(sum(values) / len(values), 4) if values else None
+
+        return {
+            key: {
+                "requests": len(samples),
+                "mean_prompt_tokens": mean(sample["prompt_tokens"] for sample in samples),
+                "mean_first_token_seconds": mean(sample["first_token_seconds"] for sample in samples),
+                "mean_total_seconds": mean(sample["total_seconds"] for sample in samples),
+            }
+            for key, samples in snapshot.items()
+        }
@@ -0,0 +1,139 @@
+"""
+Follow-up question sessions.
+
+A session keeps the preprocessed image and the conversation of one study so
+follow-up questions are sent as chat turns, without decoding and uploading
+the image again or regenerating the whole report.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class SessionNotFoundError(Exception):
+    """Raised when a session id is unknown or has expired."""
+
+
+class ReportSession:
+    """Preprocessed image plus the bounded conversation of one study."""
+
+    def __init__(
+        self,
+        session_id: str,
+        image_b64: str,
+        prompt: str,
+        report: str,
+        language: str,
+        max_turns: int,
+    ):
+        self.session_id = session_id
+        self.image_b64 = image_b64
+        self.prompt = prompt
+        self.report = report
+        self.language = language
+        self.max_turns = max_turns
+        self.turns: List[Dict[str, str]] = []
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+
+    @property
+    def size_bytes(self) -> int:
+        text = len(self.prompt) + len(self.report) + sum(len(turn["content"]) for turn in self.turns)
+        return len(self.image_b64) + text
+
+    def add_exchange(self, question: str, answer: str) -> None:
+        self.turns.append({"role": "user", "content": question})
+        self.turns.append({"role": "assistant", "content": answer})
+        # Mantém apenas as últimas perguntas/respostas (o turno inicial é fixo)
+        excess = len(self.turns) - 2 * self.max_turns
+        if excess > 0:
+            del self.turns[:excess]
+
+    def build_messages(self, question: str, include_image: bool = True) -> List[Dict[str, Any]]:
+        """Chat messages for a follow-up: original request, report, recent turns, new question."""
+        if include_image:
+            first_content: Any = [
+                {"type": "text", "text": self.prompt},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{self.image_b64}"}},
+            ]
+        else:
+            first_content = self.prompt
+        return (
+            [
+                {"role": "user", "content": first_content},
+                {"role": "assistant", "content": self.report},
+            ]
+            + list(self.turns)
+            + [{"role": "user", "content": question}]
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "turns": len(self.turns) // 2,
+            "size_bytes": self.size_bytes,
+        }
+
+
+class SessionStore:
+    """
+    In-memory sessions evicted by idle TTL and by a total memory budget
+    (least recently used first).
+    """
+
+    def __init__(self, ttl_seconds: float = 1800, memory_budget_bytes: int = 256 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.memory_budget_bytes = memory_budget_bytes
+        self._sessions: "OrderedDict[str, ReportSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add(self, session: ReportSession) -> None:
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._evict_locked()
+
+    def get(self, session_id: str) -> ReportSession:
+        with self._lock:
+            self._evict_locked()
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise SessionNotFoundError(f"Sessão não encontrada ou expirada: {session_id}")
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def remove(self, session_id: str) -> Optional[ReportSession]:
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def touch(self) -> None:
+        """Re-check the budget after a session grew."""
+        with self._lock:
+            self._evict_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": sum(session.size_bytes for session in self._sessions.values()),
+                "memory_budget_bytes": self.memory_budget_bytes,
+            }
+
+    def _evict_locked(self) -> None:
+        now = time.monotonic()
+        for session_id in [
+            session_id for session_id, session in self._sessions.items()
+            if now - session.last_used > self.ttl_seconds
+        ]:
+            del self._sessions[session_id]
+
+        total = sum(session.size_bytes for session in self._sessions.values())
+        while total > self.memory_budget_bytes and self._sessions:
+            _, evicted = self._sessions.popitem(last=False)
+            total -= evicted.size_bytes
@@ -0,0 +1,144 @@
+"""
+Structured, leveled logging that keeps I/O off the event loop.
+
+Records are handed to a ``QueueHandler`` without being formatted; a
+``QueueListener`` thread formats (text or JSON lines) and writes them, so
+the request path only pays for an enqueue. Verbose payload dumps are
+sampled, and full upstream response bodies go to a bounded in-memory ring
+buffer that can be fetched on demand instead of being printed.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+ROOT_LOGGER = "medai"
+
+# Atributos padrão do LogRecord; o resto veio de extra={...} e vira campo estruturado
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_payload_sample_rate = 0.0
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable line: time, level, logger, message and key=value fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = _fields(record)
+        if fields:
+            line += " | " + " ".join(
+                f"{key}={json.dumps(value, ensure_ascii=False, default=str)}" for key, value in fields.items()
+            )
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the ``extra`` fields at the top level."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record as is: message interpolation and
+    serialization of ``extra`` payloads happen in the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure_logging(level: str = "INFO", format: str = "text", payload_sample_rate: float = 0.0) -> None:
+    """Install the queue handler on the ``medai`` logger and start the writer thread (idempotent)."""
+    global _listener, _payload_sample_rate
+    _payload_sample_rate = payload_sample_rate
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level.upper())
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if format == "json" else TextFormatter())
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    logger.addHandler(_DeferredQueueHandler(records))
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush pending records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def sample_payload(logger: logging.Logger) -> bool:
+    """Whether to emit a verbose payload dump now (DEBUG enabled and within the sample rate)."""
+    return logger.isEnabledFor(logging.DEBUG) and _payload_sample_rate > 0 and random.random() < _payload_sample_rate
+
+
+class UpstreamBodyBuffer:
+    """
+    Last ``max_entries`` upstream response bodies, kept as received (bytes
+    or text) and only decoded/truncated to ``max_chars`` when fetched.
+    """
+
+    def __init__(self, max_entries: int = 50, max_chars: int = 20000):
+        self.max_chars = max_chars
+        self._entries: deque = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def add(self, url: str, payload_format: str, status: Any, body: Any, **fields: Any) -> None:
+        if not self._entries.maxlen:
+            return
+        with self._lock:
+            self._entries.append({
+                "at": time.time(), "url": str(url), "format": payload_format, "status": status, "body": body, **fields
+            })
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries)[-limit:] if limit > 0 else []
+        result = []
+        for entry in reversed(entries):
+            body = entry["body"]
+            if isinstance(body, bytes):
+                body = body.decode("utf-8", errors="replace")
+            body = body or ""
+            result.append(dict(
+                entry, body=body[:self.max_chars], body_chars=len(body), truncated=len(body) > self.max_chars
+            ))
+        return result
@@ -0,0 +1,108 @@
+"""
+Adaptive max_tokens budget learned from observed report lengths.
+
+Oversized generation budgets reduce how many requests a TGI-style endpoint
+can batch, so the budget for each prompt variant and modality follows a
+high percentile of the completion lengths actually observed.
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Estimativa usada quando o endpoint não informa a contagem de tokens
+CHARS_PER_TOKEN = 3.5
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+def _percentile(values, percentile: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * percentile / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class TokenBudget:
+    """
+    Tracks completion lengths per (variant, modality) and derives max_tokens.
+
+    Until ``min_samples`` completions were observed for a key the caller's
+    default budget is used; afterwards the budget is the configured
+    percentile plus a relative margin, clamped to [min_budget, max_budget].
+    """
+
+    def __init__(
+        self,
+        max_budget: int,
+        percentile: float = 95.0,
+        margin: float = 0.25,
+        min_samples: int = 20,
+        window: int = 200,
+        min_budget: int = 256,
+    ):
+        self.max_budget = max_budget
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self.min_budget = min(min_budget, max_budget)
+        self._samples: Dict[Tuple[str, str], Deque[int]] = {}
+        self._totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def budget_for(self, variant: str, modality: str, default: int) -> int:
+        """max_tokens to request for this variant/modality."""
+        with self._lock:
+            samples = list(self._samples.get((variant, modality), ()))
+        if len(samples) < self.min_samples:
+            return min(default, self.max_budget)
+        learned = math.ceil(_percentile(samples, self.percentile) * (1 + self.margin))
+        return max(self.min_budget, min(learned, self.max_budget))
+
+    def record(
+        self,
+        variant: str,
+        modality: str,
+        completion_tokens: int,
+        budget: Optional[int],
+        truncated: bool = False,
+    ) -> None:
+        """Record the length of a finished completion and the budget it was given."""
+        key = (variant, modality)
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(completion_tokens)
+            totals = self._totals.setdefault(
+                key, {"requests": 0, "budget_tokens": 0, "used_tokens": 0, "truncations": 0}
+            )
+            totals["requests"] += 1
+            totals["budget_tokens"] += budget or 0
+            totals["used_tokens"] += completion_tokens
+            totals["truncations"] += int(truncated)
+
+    def stats(self) -> Dict[str, Any]:
+        """Budget versus actual usage for every variant/modality seen so far."""
+        with self._lock:
+            snapshot = {key: (list(samples), dict(self._totals[key])) for key, samples in self._samples.items()}
+
+        result = {}
+        for (variant, modality), (samples, totals) in snapshot.items():
+            result[f"{variant}/{modality}"] = {
+                "samples": len(samples),
+                "p50_tokens": round(_percentile(samples, 50), 1),
+                "p95_tokens": round(_percentile(samples, 95), 1),
+                "max_tokens_current": self.budget_for(variant, modality, self.max_budget)
+                if len(samples) >= self.min_samples else None,
+                "requests": totals["requests"],
+                "budget_tokens_total": totals["budget_tokens"],
+                "used_tokens_total": totals["used_tokens"],
+                "budget_utilization": round(totals["used_tokens"] / totals["budget_tokens"], 4)
+                if totals["budget_tokens"] else None,
+                "truncations": totals["truncations"],
+            }
+        return result
@@ -0,0 +1,376 @@
+"""
+Request tracing.
+
+Each backend request gets a root span; preprocessing stages, upstream
+URL/format attempts, 503 waits and the individual HTTP exchanges become
+child spans carrying byte sizes and status codes. Finished spans are
+batched by a background thread and exported as OTLP/JSON, either appended
+to a local JSON Lines file or POSTed to an OTLP/HTTP collector
+(``/v1/traces``). The per-stage durations of a request also feed its
+``Server-Timing`` response header.
+
+When tracing and Server-Timing are both off, ``start_span`` returns a
+shared no-op span and nothing is recorded.
+"""
+
+import atexit
+import json
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import httpx
+
+from services.metrics import STAGE_SECONDS, current_payload_format
+from services.structured_logging import get_logger
+
+logger = get_logger("tracing")
+
+# Códigos do OTLP: SpanKind (INTERNAL, SERVER, CLIENT) e StatusCode
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_enabled = False
+_exporter: Optional["BatchSpanExporter"] = None
+
+
+class Span:
+    """
+    A timed operation in a trace.
+
+    Usable as a context manager (activated on enter, ended on exit) or
+    manually via ``activate()``/``end()``. Durations of all descendants
+    are summed per name on the root span for ``Server-Timing``.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"], kind: str = "internal", **attributes: Any):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.root = parent.root if parent else self
+        self.attributes: Dict[str, Any] = {key: value for key, value in attributes.items() if value is not None}
+        self.start_ns = time.time_ns()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.timings: Dict[str, List[float]] = {}
+        self._started = time.perf_counter()
+        self._token = None
+        self._lock = threading.Lock()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error: Any) -> None:
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def activate(self) -> "Span":
+        """Make this the parent of spans started in the current context."""
+        self._token = _current_span.set(self)
+        return self
+
+    def end(self) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Encerrado em outro contexto (ex.: fechamento de stream): nada a restaurar
+                pass
+            self._token = None
+        if self.root is not self:
+            self.root._add_timing(self.name, self.duration)
+        if _exporter is not None:
+            _exporter.submit(self)
+
+    def _add_timing(self, name: str, duration: float) -> None:
+        with self._lock:
+            total = self.timings.setdefault(name, [0.0, 0])
+            total[0] += duration
+            total[1] += 1
+
+    def __enter__(self) -> "Span":
+        return self.activate()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None:
+            self.record_error(exc)
+        self.end()
+
+
+class _NoopSpan:
+    """Stand-in returned while tracing is disabled."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, **attributes: Any) -> None:
+        pass
+
+    def record_error(self, error: Any) -> None:
+        pass
+
+    def activate(self) -> "_NoopSpan":
+        return self
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+def start_span(name: str, kind: str = "internal", **attributes: Any):
+    """Span child of the current one (or a new trace); not active until entered/activated."""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, _current_span.get(), kind, **attributes)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextmanager
+def stage(name: str, **attributes: Any) -> Iterator[Any]:
+    """Pipeline stage: observed in ``medai_stage_seconds`` and traced as a span."""
+    with STAGE_SECONDS.time(stage=name), start_span(name, **attributes) as span:
+        yield span
+
+
+_TOKEN_UNSAFE = re.compile(r"[^A-Za-z0-9_\-.]")
+
+
+def server_timing(span) -> str:
+    """``Server-Timing`` value: total time per span name under ``span`` (ms), plus the total."""
+    if not isinstance(span, Span):
+        return ""
+    with span._lock:
+        timings = sorted(span.timings.items(), key=lambda item: -item[1][0])
+    entries = []
+    for name, (total, count) in timings:
+        entry = f"{_TOKEN_UNSAFE.sub('_', name)};dur={total * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="{count}x"'
+        entries.append(entry)
+    elapsed = span.duration if span.duration is not None else time.perf_counter() - span._started
+    entries.append(f"total;dur={elapsed * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def _otlp_span(span: Span) -> Dict[str, Any]:
+    entry = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": SPAN_KINDS.get(span.kind, 1),
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.start_ns + int(span.duration * 1e9)),
+        "attributes": _otlp_attributes(span.attributes),
+        "status": {"code": STATUS_ERROR, "message": span.error} if span.error else {"code": STATUS_OK},
+    }
+    if span.parent_id:
+        entry["parentSpanId"] = span.parent_id
+    return entry
+
+
+def otlp_payload(spans: List[Span], service_name: str) -> Dict[str, Any]:
+    """OTLP/JSON ``ExportTraceServiceRequest`` for a batch of finished spans."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+        "scopeSpans": [{"scope": {"name": "medai"}, "spans": [_otlp_span(span) for span in spans]}],
+    }]}
+
+
+def file_sink(path: str) -> Callable[[Dict[str, Any]], None]:
+    """Append each exported batch as one JSON line."""
+    def write(payload: Dict[str, Any]) -> None:
+        with open(path, "a", encoding="utf-8") as output:
+            output.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    return write
+
+
+def otlp_http_sink(endpoint: str, timeout: float = 5.0) -> Callable[[Dict[str, Any]], None]:
+    """POST each batch to an OTLP/HTTP collector (JSON encoding)."""
+    url = endpoint if endpoint.rstrip("/").endswith("/v1/traces") else endpoint.rstrip("/") + "/v1/traces"
+    client = httpx.Client(timeout=timeout)
+
+    def send(payload: Dict[str, Any]) -> None:
+        response = client.post(url, json=payload)
+        response.raise_for_status()
+    return send
+
+
+class BatchSpanExporter:
+    """
+    Collects finished spans and hands them to ``sink`` from a background
+    thread, at most ``max_batch`` spans per call and at least every
+    ``interval`` seconds, so exporting never blocks a request.
+    """
+
+    def __init__(self, sink: Callable[[Dict[str, Any]], None], service_name: str,
+                 max_batch: int = 512, interval: float = 2.0):
+        self.sink = sink
+        self.service_name = service_name
+        self.max_batch = max_batch
+        self.interval = interval
+        self.exported = 0
+        self.failed = 0
+        self._spans: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, span: Span) -> None:
+        self._spans.put(span)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: List[Span] = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                try:
+                    span = self._spans.get(timeout=max(deadline - time.monotonic(), 0.001))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stopping = True
+                    break
+                batch.append(span)
+            if batch:
+                self._export(batch)
+
+    def _export(self, batch: List[Span]) -> None:
+        try:
+            self.sink(otlp_payload(batch, self.service_name))
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"⚠️ Falha ao exportar {len(batch)} spans: {str(e)}")
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Export what is queued and stop the thread."""
+        self._spans.put(None)
+        self._thread.join(timeout)
+
+
+def configure_tracing(exporter: str = "off", path: str = "traces.jsonl", endpoint: str = "",
+                      service_name: str = "medai-backend", server_timing: bool = False) -> None:
+    """Enable span creation and start the exporter ("off", "file" or "otlp")."""
+    global _enabled, _exporter
+    shutdown_tracing()
+    _enabled = exporter != "off" or server_timing
+    if exporter == "file":
+        _exporter = BatchSpanExporter(file_sink(path), service_name)
+        logger.info(f"🧭 Exportando spans para {path}")
+    elif exporter == "otlp":
+        _exporter = BatchSpanExporter(otlp_http_sink(endpoint), service_name)
+        logger.info(f"🧭 Exportando spans para o coletor OTLP em {endpoint}")
+    if _exporter is not None:
+        atexit.register(shutdown_tracing)
+
+
+def shutdown_tracing() -> None:
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        _exporter = None
+
+
+class _TracedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, span: Span):
+        self._stream = stream
+        self._span = span
+        self._received = 0
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._received += len(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._span.set_attribute("http.response_content_length", self._received)
+            self._span.end()
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """
+    One client span per upstream HTTP exchange (method, URL, payload format,
+    bytes sent/received, status and TTFB), ended when the body is closed.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        span = start_span(
+            "upstream_http", kind="client",
+            **{
+                "http.method": request.method,
+                "http.url": str(request.url.copy_with(query=None)),
+                "payload_format": current_payload_format.get(),
+                "http.request_content_length": len(request.content),
+            }
+        )
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as error:
+            span.record_error(error)
+            span.end()
+            raise
+        span.set_attributes(**{
+            "http.status_code": response.status_code,
+            "ttfb_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TracedStream(response.stream, span),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,248 @@
+"""
+Record and replay of upstream HTTP traffic.
+
+``RecordingTransport`` wraps the real httpx transport and appends every
+exchange (request metadata, status, headers, TTFB and the response body as
+timed chunks) to a gzip-compressed JSON Lines archive. ``ReplayTransport``
+serves those recordings back, at the original pace or accelerated, so the
+format negotiation and response parsing can be exercised without the live
+endpoint.
+"""
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from services.structured_logging import get_logger
+
+logger = get_logger("traffic_archive")
+
+# Strings maiores que isso (imagens em base64) não vão para o arquivo
+MAX_RECORDED_STRING = 256
+_DROPPED_HEADERS = {"connection", "transfer-encoding", "date", "set-cookie", "keep-alive"}
+
+
+class ReplayMissError(httpx.TransportError):
+    """No recording matches the request being replayed."""
+
+
+def _redact(value: Any) -> Any:
+    """Request body with long strings (image data) replaced by their length."""
+    if isinstance(value, dict):
+        return {key: _redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact(item) for item in value]
+    if isinstance(value, str) and len(value) > MAX_RECORDED_STRING:
+        return f"<{len(value)} chars>"
+    return value
+
+
+def _shape(value: Any) -> Any:
+    """Structure of a request body (keys and value types) without the values."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        return [_shape(value[0])] if value else []
+    return type(value).__name__
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def request_keys(request: httpx.Request) -> Dict[str, Any]:
+    """Exact (redacted body) and structural match keys plus the recorded request metadata."""
+    content = request.content
+    try:
+        body = json.loads(content) if content else None
+    except ValueError:
+        body = None
+    route = f"{request.method} {request.url.copy_with(query=None)}"
+    redacted = _redact(body) if body is not None else content.hex()[:64]
+    return {
+        "exact": f"{route} {_digest(redacted)}",
+        "shape": f"{route} {_digest(_shape(body))}",
+        "body": redacted,
+        "bytes": len(content),
+    }
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes the upstream body through while noting each chunk and its delay."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self.chunks: List[bytes] = []
+        self.delays: List[float] = []
+        self.complete = False
+        self._last = time.perf_counter()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            now = time.perf_counter()
+            self.chunks.append(chunk)
+            self.delays.append(now - self._last)
+            self._last = now
+            yield chunk
+        self.complete = True
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+        await self._on_close(self)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Forwards requests to ``transport`` and appends each exchange to ``path``.
+
+    Each exchange is one gzip member holding one JSON line, so the archive
+    stays readable if the process stops mid-run. Response chunks are stored
+    as ``[delay_ms, text]`` (base64 when the body is not UTF-8).
+    """
+
+    def __init__(self, path: str, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.path = path
+        self._transport = transport or httpx.AsyncHTTPTransport()
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        keys = request_keys(request)
+        started = time.perf_counter()
+        response = await self._transport.handle_async_request(request)
+        ttfb = time.perf_counter() - started
+
+        async def on_close(stream: _RecordingStream) -> None:
+            entry = {
+                "recorded_at": time.time(),
+                "method": request.method,
+                "url": str(request.url),
+                "match": {"exact": keys["exact"], "shape": keys["shape"]},
+                "request": {"bytes": keys["bytes"], "body": keys["body"]},
+                "status": response.status_code,
+                "headers": {
+                    name: value for name, value in response.headers.items() if name.lower() not in _DROPPED_HEADERS
+                },
+                "ttfb_ms": round(ttfb * 1000, 2),
+                "complete": stream.complete,
+                **self._encode_chunks(stream.chunks, stream.delays),
+            }
+            await asyncio.to_thread(self._append, entry)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, on_close),
+            extensions=response.extensions,
+        )
+
+    @staticmethod
+    def _encode_chunks(chunks: List[bytes], delays: List[float]) -> Dict[str, Any]:
+        delays_ms = [round(delay * 1000, 2) for delay in delays]
+        try:
+            return {"encoding": "utf-8", "chunks": [[d, c.decode("utf-8")] for d, c in zip(delays_ms, chunks)]}
+        except UnicodeDecodeError:
+            return {
+                "encoding": "base64",
+                "chunks": [[d, base64.b64encode(c).decode("ascii")] for d, c in zip(delays_ms, chunks)],
+            }
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            with gzip.open(self.path, "ab") as archive:
+                archive.write(line)
+            self.recorded += 1
+
+    async def aclose(self) -> None:
+        # Compartilhado por todos os clientes do serviço: cada `async with
+        # httpx.AsyncClient(...)` fecharia o pool de conexões ao sair
+        pass
+
+
+def load_archive(path: str) -> List[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        return [json.loads(line) for line in archive if line.strip()]
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[bytes], delays: List[float], speed: float):
+        self._chunks = chunks
+        self._delays = delays
+        self._speed = speed
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for delay, chunk in zip(self._delays, self._chunks):
+            if self._speed > 0 and delay > 0:
+                await asyncio.sleep(delay / self._speed)
+            yield chunk
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Serves recorded exchanges instead of calling the endpoint.
+
+    Requests are matched on the redacted body first, then on the body
+    structure (same URL and keys, different values); recordings for a key
+    are served in order and wrap around. ``speed`` scales the recorded TTFB
+    and chunk delays (2.0 = twice as fast, 0 = no waiting).
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self.entries = load_archive(path)
+        self._by_key: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for entry in self.entries:
+            self._by_key[entry["match"]["exact"]].append(entry)
+            self._by_key[entry["match"]["shape"]].append(entry)
+        self._served: Dict[str, int] = defaultdict(int)
+        self.stats = {"exact": 0, "shape": 0, "misses": 0}
+
+    def _find(self, request: httpx.Request) -> Dict[str, Any]:
+        keys = request_keys(request)
+        for kind in ("exact", "shape"):
+            candidates = self._by_key.get(keys[kind])
+            if candidates:
+                entry = candidates[self._served[keys[kind]] % len(candidates)]
+                self._served[keys[kind]] += 1
+                self.stats[kind] += 1
+                return entry
+        self.stats["misses"] += 1
+        raise ReplayMissError(f"Nenhuma gravação para {request.method} {request.url}", request=request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        entry = self._find(request)
+        if entry["encoding"] == "base64":
+            chunks = [base64.b64decode(chunk) for _, chunk in entry["chunks"]]
+        else:
+            chunks = [chunk.encode("utf-8") for _, chunk in entry["chunks"]]
+        delays = [delay / 1000 for delay, _ in entry["chunks"]]
+        if self.speed > 0:
+            await asyncio.sleep(entry["ttfb_ms"] / 1000 / self.speed)
+        return httpx.Response(
+            status_code=entry["status"],
+            headers=entry["headers"],
+            stream=_ReplayStream(chunks, delays, self.speed),
+        )
+
+
+def create_upstream_transport(mode: str, path: str, speed: float = 1.0) -> Optional[httpx.AsyncBaseTransport]:
+    """Transport for the configured traffic mode ("off", "record" or "replay")."""
+    if mode == "record":
+        logger.info(f"⏺️ Gravando tráfego do endpoint em {path}")
+        return RecordingTransport(path)
+    if mode == "replay":
+        transport = ReplayTransport(path, speed=speed)
+        logger.info(f"⏯️ Reproduzindo {len(transport.entries)} respostas gravadas de {path} (velocidade {speed}x)")
+        return transport
+    return None
@@ -0,0 +1,194 @@
+"""
+Resumable chunked uploads spooled to disk.
+
+Protocol: ``init`` declares the total size, ``append`` writes a chunk at the
+expected offset (verified by its SHA-256) and ``commit`` checks the whole
+content hash. A dropped connection only costs the chunk in flight: the
+client asks for the current offset and resumes from there.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+
+class UploadError(Exception):
+    """Invalid upload request (bad checksum, size or state)."""
+
+
+class UploadNotFoundError(UploadError):
+    """Raised when an upload id is unknown or has expired."""
+
+
+class UploadOffsetError(UploadError):
+    """Raised when a chunk does not start at the current offset."""
+
+    def __init__(self, expected_offset: int, received_offset: int):
+        self.expected_offset = expected_offset
+        super().__init__(
+            f"Offset inválido: esperado {expected_offset}, recebido {received_offset}"
+        )
+
+
+class _UploadState:
+    def __init__(self, upload_id: str, total_size: int, filename: Optional[str], created_at: float):
+        self.upload_id = upload_id
+        self.total_size = total_size
+        self.filename = filename
+        self.created_at = created_at
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        self.lock = threading.Lock()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "upload_id": self.upload_id,
+            "offset": self.offset,
+            "total_size": self.total_size,
+            "complete": self.offset == self.total_size,
+        }
+
+
+class UploadSpool:
+    """
+    On-disk spool of in-progress uploads.
+
+    The content hash is updated incrementally as chunks arrive; after a
+    restart it is rebuilt from the spooled bytes, so uploads survive it.
+    """
+
+    def __init__(self, spool_dir: str, max_upload_bytes: int, ttl_seconds: float = 86400):
+        self.spool_dir = spool_dir
+        self.max_upload_bytes = max_upload_bytes
+        self.ttl_seconds = ttl_seconds
+        self._states: Dict[str, _UploadState] = {}
+        self._lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _data_path(self, upload_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{upload_id}.part")
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{upload_id}.json")
+
+    def init(self, total_size: int, filename: Optional[str] = None) -> Dict[str, Any]:
+        """Start a new upload of ``total_size`` bytes."""
+        if total_size <= 0:
+            raise UploadError("Tamanho total inválido")
+        if total_size > self.max_upload_bytes:
+            raise UploadError(f"Arquivo muito grande (máximo {self.max_upload_bytes} bytes)")
+
+        self.cleanup_expired()
+        state = _UploadState(uuid.uuid4().hex, total_size, filename, time.time())
+        with open(self._meta_path(state.upload_id), "w", encoding="utf-8") as meta:
+            json.dump({"total_size": total_size, "filename": filename, "created_at": state.created_at}, meta)
+        open(self._data_path(state.upload_id), "wb").close()
+
+        with self._lock:
+            self._states[state.upload_id] = state
+        return state.describe()
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        return self._get_state(upload_id).describe()
+
+    def append(self, upload_id: str, offset: int, data: bytes, chunk_sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Write ``data`` at ``offset`` after verifying the chunk checksum."""
+        state = self._get_state(upload_id)
+        if chunk_sha256 and hashlib.sha256(data).hexdigest() != chunk_sha256.lower():
+            raise UploadError("Checksum do bloco não confere")
+
+        with state.lock:
+            if offset != state.offset:
+                raise UploadOffsetError(state.offset, offset)
+            if state.offset + len(data) > state.total_size:
+                raise UploadError("Bloco ultrapassa o tamanho total declarado")
+
+            with open(self._data_path(upload_id), "r+b") as spool:
+                spool.seek(offset)
+                spool.write(data)
+                # Descarta bytes de uma tentativa anterior interrompida
+                spool.truncate()
+            state.hasher.update(data)
+            state.offset += len(data)
+            return state.describe()
+
+    def commit(self, upload_id: str, content_sha256: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Finish the upload and return its ``sha256`` and ``data``.
+
+        The spooled files are removed; callers can use the hash to reuse
+        work already done for the same content.
+        """
+        state = self._get_state(upload_id)
+        with state.lock:
+            if state.offset != state.total_size:
+                raise UploadError(f"Upload incompleto: {state.offset} de {state.total_size} bytes")
+            digest = state.hasher.hexdigest()
+            if content_sha256 and content_sha256.lower() != digest:
+                raise UploadError("Checksum do arquivo não confere")
+
+            with open(self._data_path(upload_id), "rb") as spool:
+                data = spool.read()
+            self._discard(upload_id)
+        return {"upload_id": upload_id, "sha256": digest, "data": data, "filename": state.filename}
+
+    def abort(self, upload_id: str) -> None:
+        self._get_state(upload_id)
+        self._discard(upload_id)
+
+    def cleanup_expired(self) -> int:
+        """Remove spooled uploads older than the TTL; returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith(".json"):
+                continue
+            upload_id = name[:-len(".json")]
+            try:
+                with open(self._meta_path(upload_id), encoding="utf-8") as meta:
+                    created_at = json.load(meta).get("created_at", 0)
+            except (OSError, ValueError):
+                created_at = 0
+            if created_at < cutoff:
+                self._discard(upload_id)
+                removed += 1
+        return removed
+
+    def _get_state(self, upload_id: str) -> _UploadState:
+        with self._lock:
+            state = self._states.get(upload_id)
+            if state is None:
+                state = self._restore_state(upload_id)
+            if state is None or time.time() - state.created_at > self.ttl_seconds:
+                raise UploadNotFoundError(f"Upload não encontrado ou expirado: {upload_id}")
+            return state
+
+    def _restore_state(self, upload_id: str) -> Optional[_UploadState]:
+        """Rebuild the state of an upload spooled before a restart."""
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._meta_path(upload_id), encoding="utf-8") as meta:
+                info = json.load(meta)
+            state = _UploadState(upload_id, info["total_size"], info.get("filename"), info["created_at"])
+            with open(self._data_path(upload_id), "rb") as spool:
+                for block in iter(lambda: spool.read(1024 * 1024), b""):
+                    state.hasher.update(block)
+                    state.offset += len(block)
+        except (OSError, ValueError, KeyError):
+            return None
+        self._states[upload_id] = state
+        return state
+
+    def _discard(self, upload_id: str) -> None:
+        with self._lock:
+            self._states.pop(upload_id, None)
+        for path in (self._data_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Teste do agendador de lotes dinâmicos do modelo local (não requer modelo).
+"""
+
+import asyncio
+
+from services.batch_scheduler import BatchScheduler
+
+def test_requests_arriving_during_a_batch_form_the_next_one():
+    sizes = []
+
+    async def run_batch(items):
+        sizes.append(len(items))
+        await asyncio.sleep(0.02)  # simula um forward pass
+        return [item * 10 for item in items], 5 * len(items)
+
+    async def run():
+        scheduler = BatchScheduler(run_batch, max_batch_size=4, max_wait_ms=5)
+        results = await asyncio.gather(*(scheduler.submit(i) for i in range(10)))
+        return results, scheduler.stats()
+
+    results, stats = asyncio.run(run())
+    print(f"📦 Tamanhos dos lotes: {sizes} | ocupação média: {stats['mean_occupancy']}")
+    assert results == [i * 10 for i in range(10)]
+    assert sizes == [4, 4, 2]
+    assert stats["generated_tokens"] == 50 and stats["tokens_per_second"] > 0
+
+def test_single_request_waits_at_most_max_wait():
+    async def run_batch(items):
+        return items, 1
+
+    async def run():
+        scheduler = BatchScheduler(run_batch, max_batch_size=8, max_wait_ms=20)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await scheduler.submit("a")
+        return loop.time() - started, scheduler.stats()
+
+    elapsed, stats = asyncio.run(run())
+    assert elapsed < 0.5
+    assert stats["batches"] == 1 and stats["mean_occupancy"] == 1 / 8
+
+def test_batch_error_reaches_callers():
+    async def run_batch(items):
+        raise RuntimeError("falha no modelo")
+
+    async def run():
+        scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=1)
+        return await asyncio.gather(scheduler.submit(1), scheduler.submit(2), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+if __name__ == "__main__":
+    print("🧪 Testando agendador de lotes")
+    print("=" * 50)
+    test_requests_arriving_during_a_batch_form_the_next_one()
+    test_single_request_waits_at_most_max_wait()
+    test_batch_error_reaches_callers()
+    print("🎉 Todos os testes do agendador passaram!")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Teste do cache de embeddings da imagem (não requer modelo).
+"""
+
+import tempfile
+
+import numpy as np
+
+from services.embedding_cache import EmbeddingCache
+
+def embedding(seed, tokens=16, dim=32):
+    return {"last_hidden_state": np.random.default_rng(seed).standard_normal((tokens, dim)).astype(np.float32)}
+
+def test_lru_bounded_by_bytes():
+    entry_bytes = embedding(0)["last_hidden_state"].nbytes
+    cache = EmbeddingCache(max_bytes=2 * entry_bytes)
+    for seed in range(3):
+        cache.set(f"{seed:064x}", embedding(seed))
+    assert cache.get(f"{0:064x}") is None  # o mais antigo foi descartado
+    assert np.array_equal(cache.get(f"{2:064x}")["last_hidden_state"], embedding(2)["last_hidden_state"])
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2 and stats["memory_bytes"] <= 2 * entry_bytes
+
+def test_evicted_entries_spill_to_memory_mapped_files():
+    entry_bytes = embedding(0)["last_hidden_state"].nbytes
+    with tempfile.TemporaryDirectory() as spill_dir:
+        cache = EmbeddingCache(max_bytes=entry_bytes, spill_dir=spill_dir)
+        cache.set(f"{1:064x}", embedding(1))
+        cache.set(f"{2:064x}", embedding(2))
+        restored = cache.get(f"{1:064x}")
+        assert isinstance(restored["last_hidden_state"], np.memmap)
+        assert np.array_equal(restored["last_hidden_state"], embedding(1)["last_hidden_state"])
+        print(f"💾 Estatísticas: {cache.stats()}")
+        assert cache.stats()["disk_hits"] == 1
+
+        # Um novo processo reaproveita o que foi gravado em disco
+        reopened = EmbeddingCache(max_bytes=entry_bytes, spill_dir=spill_dir)
+        assert reopened.get(f"{1:064x}") is not None
+
+def test_spill_budget_removes_oldest_files():
+    entry_bytes = embedding(0)["last_hidden_state"].nbytes
+    with tempfile.TemporaryDirectory() as spill_dir:
+        cache = EmbeddingCache(max_bytes=0, spill_dir=spill_dir, max_spill_bytes=2 * entry_bytes)
+        for seed in range(4):
+            cache.set(f"{seed:064x}", embedding(seed))
+        assert cache.get(f"{0:064x}") is None
+        assert cache.get(f"{3:064x}") is not None
+        assert cache.stats()["spilled_entries"] == 2
+
+if __name__ == "__main__":
+    print("🧪 Testando cache de embeddings")
+    print("=" * 50)
+    test_lru_bounded_by_bytes()
+    test_evicted_entries_spill_to_memory_mapped_files()
+    test_spill_budget_removes_oldest_files()
+    print("🎉 Todos os testes do cache de embeddings passaram!")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Teste do cache de achados da análise em dois estágios (não requer API).
+"""
+
+import asyncio
+import base64
+import time
+
+from benchmarks.common import image_to_b64, synthetic_study
+from services.cache import TTLCache
+from services.huggingface_service import HuggingFaceService
+from services.prompts import get_prompt_template
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(max_entries=4, ttl_seconds=0.05)
+    cache.set("achados", "ok")
+    assert cache.get("achados") == "ok"
+    time.sleep(0.08)
+    assert cache.get("achados") is None and len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+def test_findings_keyed_by_pixels_and_template():
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    calls = []
+
+    async def fake_endpoint(prompt, image_b64, template=None, prompt_variant="full", formats=None):
+        calls.append(prompt_variant)
+        return f"{prompt_variant} ({template.key})"
+
+    service._try_endpoint_formats = fake_endpoint
+    study = image_to_b64(synthetic_study(256, seed=5))
+    first = service._prepare_image(base64.b64decode(study))
+    resent = service._prepare_image(base64.b64decode(study))
+    other = service._prepare_image(base64.b64decode(image_to_b64(synthetic_study(256, seed=6))))
+    chest, head = get_prompt_template("pt", "raio-x"), get_prompt_template("pt", "tc")
+
+    async def run():
+        await service._two_stage_analysis(first, chest, "45", "70", "Tosse.")
+        # Só a história clínica mudou: apenas a síntese em texto é refeita
+        await service._two_stage_analysis(resent, chest, "45", "70", "Tosse e febre.")
+        await service._two_stage_analysis(first, head, "45", "70", "Tosse.")
+        await service._two_stage_analysis(other, chest, "45", "70", "Tosse.")
+
+    asyncio.run(run())
+    stats = service.findings_cache.stats()
+    print(f"🔬 Cache de achados: {stats} | chamadas: {calls}")
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 3)
+    assert calls.count("findings") == 3 and calls.count("synthesis") == 4
+
+if __name__ == "__main__":
+    print("🧪 Testando cache de achados")
+    print("=" * 50)
+    test_entries_expire_after_ttl()
+    test_least_recently_used_is_evicted()
+    test_findings_keyed_by_pixels_and_template()
+    print("🎉 Todos os testes do cache de achados passaram!")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Teste do pré-envio de imagens (/images) e do relatório por image_id (não requer API).
+"""
+
+import asyncio
+import base64
+
+import httpx
+from PIL import Image
+
+import main
+from benchmarks.common import image_to_b64, synthetic_study
+from mock_hf_server import MockConfig, create_app
+from services.huggingface_service import HuggingFaceService
+
+def png_bytes(image):
+    return base64.b64decode(image_to_b64(image, "PNG"))
+
+def run_with_service(scenario):
+    """Executa ``scenario(client, service)`` contra a API com o serviço apontando para o mock."""
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.ASGITransport(app=create_app(MockConfig(latency="fixed:0", tokens_per_second=0)))
+    previous, main.ai_service = main.ai_service, service
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as client:
+            return await scenario(client, service)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        main.ai_service = previous
+
+async def wait_ready(client, image_id):
+    for _ in range(100):
+        status = (await client.get(f"/images/{image_id}")).json()
+        if status["status"] != "processing":
+            return status
+        await asyncio.sleep(0.01)
+    raise AssertionError("pré-processamento não terminou")
+
+def test_preuploaded_image_is_used_for_report():
+    async def scenario(client, service):
+        files = {"file": ("estudo.png", png_bytes(synthetic_study(512, seed=8)), "image/png")}
+        image_id = (await client.post("/images", files=files)).json()["image_id"]
+        again = (await client.post("/images", files=files)).json()["image_id"]
+        status = await wait_ready(client, image_id)
+        report = await client.post("/generate_report", json={
+            "image_id": image_id, "age": "45", "weight": "70", "clinical_history": "Tosse persistente."
+        })
+        return image_id, again, status, report
+
+    image_id, again, status, report = run_with_service(scenario)
+    print(f"📤 {image_id}: {status['status']} {status['size']} -> HTTP {report.status_code}")
+    assert again == image_id  # mesmo conteúdo reaproveita o pré-processamento
+    assert status["status"] == "ready" and max(status["size"]) <= 1024
+    assert report.status_code == 200 and report.json()["success"]
+
+def test_rejected_and_unknown_images():
+    async def scenario(client, service):
+        tiny = Image.new("L", (32, 32), color=128)
+        image_id = (await client.post("/images", files={"file": ("x.png", png_bytes(tiny), "image/png")})).json()["image_id"]
+        status = await wait_ready(client, image_id)
+        report = await client.post("/generate_report", json={
+            "image_id": image_id, "age": "45", "weight": "70", "clinical_history": "Tosse."
+        })
+        missing = await client.get("/images/inexistente")
+        expired = await client.post("/generate_report", json={
+            "image_id": "inexistente", "age": "45", "weight": "70", "clinical_history": "Tosse."
+        })
+        empty = await client.post("/images", files={"file": ("vazio.png", b"", "image/png")})
+        return status, report, missing, expired, empty
+
+    status, report, missing, expired, empty = run_with_service(scenario)
+    print(f"🚫 Imagem rejeitada: {status['message']}")
+    assert status["status"] == "rejected" and status["quality"]
+    assert report.status_code == 422
+    assert missing.status_code == 404 and expired.status_code == 404
+    assert empty.status_code == 400
+
+if __name__ == "__main__":
+    print("🧪 Testando pré-envio de imagens")
+    print("=" * 50)
+    test_preuploaded_image_is_used_for_report()
+    test_rejected_and_unknown_images()
+    print("🎉 Todos os testes de pré-envio passaram!")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Teste do controle de qualidade de imagem (não requer API nem servidor).
+"""
+
+import io
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from services.huggingface_service import HuggingFaceService
+from services.image_quality import assess_image_quality
+
+def make_test_image(size=512):
+    """Cria uma imagem com estrutura (gradiente + ruído) parecida com um exame."""
+    rng = np.random.default_rng(42)
+    gradient = np.linspace(30, 220, size, dtype=np.float32)[None, :].repeat(size, axis=0)
+    noise = rng.normal(0, 15, (size, size))
+    array = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(array).convert("RGB")
+
+def issue_codes(image):
+    return [issue["code"] for issue in assess_image_quality(image)["issues"]]
+
+def test_good_image_is_accepted():
+    """Imagem com contraste e detalhes deve passar."""
+    result = assess_image_quality(make_test_image())
+    print(f"✅ Imagem boa: {result['metrics']} em {result['elapsed_ms']} ms")
+    assert result["acceptable"]
+
+def test_blank_image_is_rejected():
+    """Imagem uniforme deve ser rejeitada como 'blank'."""
+    assert issue_codes(Image.new("RGB", (512, 512), color=(128, 128, 128))) == ["blank"]
+
+def test_saturated_image_is_rejected():
+    """Imagem quase toda preta/branca deve ser rejeitada como 'saturated'."""
+    array = np.zeros((512, 512), dtype=np.uint8)
+    array[:, 256:] = 255
+    array[:10, :10] = 120
+    assert issue_codes(Image.fromarray(array)) == ["saturated"]
+
+def test_blurry_image_is_rejected():
+    """Imagem muito desfocada deve ser rejeitada como 'blurry'."""
+    blurred = make_test_image().filter(ImageFilter.GaussianBlur(radius=12))
+    assert issue_codes(blurred) == ["blurry"]
+
+def test_tiny_image_is_rejected():
+    """Imagem menor que a dimensão mínima deve ser rejeitada como 'too_small'."""
+    assert "too_small" in issue_codes(make_test_image(size=64))
+
+def prepare(image):
+    """Passa a imagem pelo pré-processamento completo do serviço (decode, qualidade, resize)."""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return HuggingFaceService("teste")._prepare_image(buffer.getvalue())
+
+def test_16bit_image_is_normalized():
+    """PNG 16 bits com valores baixos (12 bits) não deve parecer uniforme nem chegar branco ao modelo."""
+    array = (np.asarray(make_test_image().convert("L"), dtype=np.uint16) * 16)
+    image = Image.fromarray(array)
+    assert image.mode.startswith("I;16")
+    prepared = prepare(image)
+    assert prepared.quality_warnings == []
+    low, high = prepared.image.convert("L").getextrema()
+    print(f"✅ PNG 16 bits enviado ao modelo com faixa {low}-{high}")
+    assert high - low > 100  # sem reescala, convert("RGB") deixaria tudo branco (255)
+
+def test_elongated_study_is_judged_at_original_size():
+    """Estudo 4000x400 não pode ser rejeitado por ter ficado pequeno após o resize."""
+    wide = make_test_image(size=400).resize((4000, 400))
+    prepared = prepare(wide)
+    assert prepared.image.size == (1024, 102)
+    assert prepared.quality_warnings == []
+
+if __name__ == "__main__":
+    print("🧪 Testando controle de qualidade de imagem")
+    print("=" * 50)
+    test_good_image_is_accepted()
+    test_blank_image_is_rejected()
+    test_saturated_image_is_rejected()
+    test_blurry_image_is_rejected()
+    test_tiny_image_is_rejected()
+    test_16bit_image_is_normalized()
+    test_elongated_study_is_judged_at_original_size()
+    print("🎉 Todos os testes de qualidade passaram!")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Teste da interface do serviço local e do fallback local (não requer modelo nem API).
+"""
+
+import asyncio
+
+import httpx
+
+from benchmarks.common import image_to_b64, synthetic_study
+from services.huggingface_service import HuggingFaceService
+from services.local_model_service import LocalModelService
+from services.prompts import get_prompt_template
+
+def stub_model(service):
+    """Substitui a geração do modelo por uma resposta fixa, guardando os itens recebidos."""
+    received = []
+
+    def generate_batch(items):
+        received.extend(items)
+        return [f"Relatório local {len(received) - len(items) + i}" for i in range(len(items))], 10 * len(items)
+
+    service._generate_batch_sync = generate_batch
+    return received
+
+def test_local_service_keeps_analysis_interface():
+    service = LocalModelService(prompt_mode="template")
+    received = stub_model(service)
+    report = asyncio.run(service.analyze_medical_image(
+        image_to_b64(synthetic_study(256)), "45", "70", "Tosse persistente.", language="en"
+    ))
+    image_b64, text, max_new_tokens, prefix, prefix_key = received[0]
+    template = get_prompt_template("en")
+    print(f"🖥️ Texto enviado ao modelo: {len(text)} caracteres, prefixo {prefix_key}")
+    assert "Relatório local 0" in report
+    assert text.startswith(template.static_prefix) and "Tosse persistente." in text
+    assert prefix == template.static_prefix and prefix_key.startswith(template.key)
+    assert max_new_tokens == service.max_new_tokens
+
+def test_prefix_mode_uses_configured_text():
+    service = LocalModelService(prompt_mode="prefix", text_prefix="a chest x-ray of")
+    received = stub_model(service)
+    prompt = get_prompt_template().render("45", "70", "Tosse.")
+    result = asyncio.run(service._try_endpoint_formats(prompt, image_to_b64(synthetic_study(64))))
+    assert result == "Relatório local 0"
+    assert received[0][1] == "a chest x-ray of" and received[0][4] is None
+    assert asyncio.run(service._try_endpoint_formats(prompt, "")) is None
+
+def test_fallback_receives_prompt_and_template():
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.MockTransport(lambda request: httpx.Response(500, text="indisponível"))
+    service.local_fallback = LocalModelService(prompt_mode="template")
+    received = stub_model(service.local_fallback)
+    template = get_prompt_template("pt", "ct")
+    prompt = template.render("45", "70", "Cefaleia súbita.")
+
+    result = asyncio.run(service._try_endpoint_formats(prompt, image_to_b64(synthetic_study(64)), template))
+    print(f"🔁 Endpoint com erro: fallback local respondeu {result!r}")
+    assert result == "Relatório local 0"
+    assert received[0][1] == prompt and received[0][4].startswith(template.key)
+
+if __name__ == "__main__":
+    print("🧪 Testando serviço local")
+    print("=" * 50)
+    test_local_service_keeps_analysis_interface()
+    test_prefix_mode_uses_configured_text()
+    test_fallback_receives_prompt_and_template()
+    print("🎉 Todos os testes do serviço local passaram!")
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Teste do monitor de bloqueios do event loop (não requer API).
+"""
+
+import asyncio
+import time
+
+from services.loop_monitor import LoopLagMonitor
+from services.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG_SECONDS
+
+def blocking_call():
+    time.sleep(0.2)  # chamada síncrona dentro de um handler async
+
+def test_block_is_reported_with_culprit_stack():
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+    blocks_before = EVENT_LOOP_BLOCKS.value()
+    samples_before = EVENT_LOOP_LAG_SECONDS.count()
+
+    async def main():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(main())
+    blocks = monitor.recent_blocks()
+    print(f"🐢 {len(blocks)} bloqueio(s): {[block['blocked_ms'] for block in blocks]}")
+    assert len(blocks) == 1 and blocks[0]["blocked_ms"] >= 150
+    assert "blocking_call" in "".join(blocks[0]["stack"])
+    assert EVENT_LOOP_BLOCKS.value() == blocks_before + 1
+    assert EVENT_LOOP_LAG_SECONDS.count() > samples_before + 3
+
+if __name__ == "__main__":
+    print("🧪 Testando monitor do event loop")
+    print("=" * 50)
+    test_block_is_reported_with_culprit_stack()
+    print("🎉 Todos os testes do monitor do event loop passaram!")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Teste das métricas no formato Prometheus (não requer API).
+"""
+
+import asyncio
+
+import httpx
+
+from benchmarks.common import image_to_b64, synthetic_study
+from mock_hf_server import MockConfig, create_app
+from services.huggingface_service import HuggingFaceService
+from services.local_model_service import LocalModelService
+from services.metrics import (
+    Counter,
+    Histogram,
+    QUEUE_DEPTH,
+    REGISTRY,
+    Registry,
+    TOKEN_BUDGET_TOKENS,
+    TOKEN_BUDGET_USED_TOKENS,
+    UPSTREAM_RESPONSES,
+    UPSTREAM_TTFB_SECONDS,
+    UpstreamMetricsTransport,
+    current_payload_format
+)
+from services.prompts import get_prompt_template
+
+def test_exposition_format():
+    registry = Registry()
+    latency = registry.register(Histogram("demo_seconds", "Demo latency.", ["stage"], buckets=(0.1, 1)))
+    errors = registry.register(Counter("demo_errors_total", "Demo errors.", ["reason"]))
+    latency.observe(0.05, stage="decode")
+    latency.observe(0.5, stage="decode")
+    latency.observe(5, stage="decode")
+    errors.inc(reason='quote"d')
+
+    text = registry.render()
+    print(text)
+    assert '# TYPE demo_seconds histogram' in text
+    assert 'demo_seconds_bucket{stage="decode",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="decode",le="1"} 2' in text
+    assert 'demo_seconds_bucket{stage="decode",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="decode"} 3' in text
+    assert 'demo_errors_total{reason="quote\\"d"} 1' in text
+
+def test_upstream_transport_labels_by_format():
+    mock = create_app(MockConfig(latency="fixed:0", tokens_per_second=0, reject_formats=["HF-Inference"]))
+    labels = {"upstream": "mock-endpoint/", "format": "HF-Inference"}
+    before = UPSTREAM_RESPONSES.value(status="422", **labels)
+
+    async def call():
+        current_payload_format.set("HF-Inference")
+        transport = UpstreamMetricsTransport(httpx.ASGITransport(app=mock))
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.post("http://mock-endpoint/", json={"inputs": "teste"})
+
+    response = asyncio.run(call())
+    assert response.status_code == 422
+    assert UPSTREAM_RESPONSES.value(status="422", **labels) == before + 1
+    assert UPSTREAM_TTFB_SECONDS.count(**labels) >= 1
+
+def test_gauges_follow_serving_instance():
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.register_metrics()
+    service.image_store._pending = 3
+    fallback = LocalModelService()  # como o fallback local criado em main.py
+    fallback.image_store._pending = 7
+    print(f"📥 Fila de pré-processamento: {QUEUE_DEPTH.value(queue='preprocessing')}")
+    assert QUEUE_DEPTH.value(queue="preprocessing") == 3
+    service.image_store._pending = 0
+
+def test_token_budget_usage_is_exported():
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.ASGITransport(app=create_app(MockConfig(latency="fixed:0", tokens_per_second=0)))
+    prompt = get_prompt_template().render("45", "70", "Tosse.")
+    report = asyncio.run(service._try_endpoint_formats(prompt, image_to_b64(synthetic_study(128)), get_prompt_template()))
+    assert report
+
+    for key, stats in service.token_budget.stats().items():
+        variant, modality = key.rsplit("/", 1)
+        used = TOKEN_BUDGET_USED_TOKENS.value(variant=variant, modality=modality)
+        given = TOKEN_BUDGET_TOKENS.value(variant=variant, modality=modality)
+        print(f"🎯 {key}: {given} tokens de orçamento, {used} usados")
+        assert used >= stats["used_tokens_total"] > 0 and given >= stats["budget_tokens_total"] > 0
+    text = REGISTRY.render()
+    assert "medai_token_budget_used_tokens_total{" in text
+
+if __name__ == "__main__":
+    print("🧪 Testando métricas")
+    print("=" * 50)
+    test_exposition_format()
+    test_upstream_transport_labels_by_format()
+    test_gauges_follow_serving_instance()
+    test_token_budget_usage_is_exported()
+    print("🎉 Todos os testes de métricas passaram!")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Teste do micro-batching de requisições ao endpoint (não requer API).
+"""
+
+import asyncio
+
+import httpx
+
+from mock_hf_server import MockConfig, create_app
+from services.huggingface_service import HuggingFaceService
+from services.metrics import FORMAT_FAILURES
+from services.micro_batcher import BatchUnsupportedError, MicroBatcher
+from services.prompts import get_prompt_template
+
+def test_concurrent_requests_share_one_call():
+    calls = []
+
+    async def send_batch(key, items):
+        calls.append(list(items))
+        return [f"{key}:{item}" for item in items]
+
+    async def run():
+        batcher = MicroBatcher(send_batch, max_batch_size=8, max_wait_ms=20)
+        results = await asyncio.gather(*(batcher.submit("chat", i) for i in range(5)))
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(run())
+    print(f"📦 Chamadas: {calls} | estatísticas: {stats}")
+    assert results == [f"chat:{i}" for i in range(5)]
+    assert calls == [[0, 1, 2, 3, 4]]
+    assert stats["batches"] == 1 and stats["mean_batch_size"] == 5
+
+def test_batches_split_by_size_and_key():
+    calls = []
+
+    async def send_batch(key, items):
+        calls.append((key, list(items)))
+        return items
+
+    async def run():
+        batcher = MicroBatcher(send_batch, max_batch_size=2, max_wait_ms=10)
+        return await asyncio.gather(
+            batcher.submit("a", 1), batcher.submit("a", 2), batcher.submit("a", 3), batcher.submit("b", 4)
+        )
+
+    assert asyncio.run(run()) == [1, 2, 3, 4]
+    assert sorted(calls) == [("a", [1, 2]), ("a", [3]), ("b", [4])]
+
+def test_failure_reaches_every_caller():
+    async def send_batch(key, items):
+        return items[:1]  # resultado incompleto
+
+    async def run():
+        batcher = MicroBatcher(send_batch, max_batch_size=4, max_wait_ms=5)
+        return await asyncio.gather(batcher.submit("k", 1), batcher.submit("k", 2), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, BatchUnsupportedError) for result in results)
+
+def batched_calls(echo_probability):
+    """Duas análises simultâneas pelo lote em Simple-Completions contra o servidor mock."""
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.ASGITransport(app=create_app(MockConfig(
+        latency="fixed:0", tokens_per_second=0, echo_probability=echo_probability
+    )))
+    service.negotiated_format = ("http://mock-endpoint/v1/completions", "Simple-Completions")
+    template = get_prompt_template()
+    prompts = [template.render("45", "70", history) for history in ("Tosse.", "Febre há 2 dias.")]
+
+    async def run():
+        return await asyncio.gather(*(service._call_batched(prompt, "", template) for prompt in prompts))
+
+    return service, asyncio.run(run())
+
+def test_batched_reports_are_used():
+    service, results = batched_calls(echo_probability=0.0)
+    assert all(result and "IMPRESSÃO DIAGNÓSTICA" in result for result in results)
+    assert service.upstream_batcher.stats()["batches"] == 1
+
+def test_echoed_batch_items_fall_back_and_are_counted():
+    labels = {"upstream": "mock-endpoint/v1/completions", "format": "Simple-Completions", "reason": "echo"}
+    before = FORMAT_FAILURES.value(**labels)
+    service, results = batched_calls(echo_probability=1.0)
+    print(f"🔁 Itens ecoados: {results} | falhas por echo: {FORMAT_FAILURES.value(**labels) - before}")
+    assert results == [None, None]  # o chamador refaz cada um individualmente
+    assert FORMAT_FAILURES.value(**labels) == before + 2
+
+def test_lone_request_is_streamed_without_batching():
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.ASGITransport(app=create_app(MockConfig(latency="fixed:0", tokens_per_second=0)))
+    service.negotiated_format = ("http://mock-endpoint/v1/completions", "Simple-Completions")
+    template = get_prompt_template()
+    prompt = template.render("45", "70", "Tosse.")
+
+    async def run():
+        report = await service._call_medgemma_api(prompt, "aW1hZ2Vt", template)
+        # Sozinho no lote (ex.: parâmetros diferentes dos demais): não é enviado em lote
+        service.negotiated_format = ("http://mock-endpoint/v1/completions", "Simple-Completions")
+        lone_batch = await service._call_batched(prompt, "aW1hZ2Vt", template)
+        return report, lone_batch
+
+    report, lone_batch = asyncio.run(run())
+    upstream = service.upstream_bodies.recent()
+    print(f"🚶 Requisição sozinha: {[(entry['format'], entry.get('stream')) for entry in upstream]}")
+    assert "IMPRESSÃO DIAGNÓSTICA" in report and lone_batch is None
+    assert len(upstream) == 1 and upstream[0]["stream"] is True
+    assert service.upstream_batcher.stats()["max_batch_size_seen"] == 1
+
+if __name__ == "__main__":
+    print("🧪 Testando micro-batching")
+    print("=" * 50)
+    test_concurrent_requests_share_one_call()
+    test_batches_split_by_size_and_key()
+    test_failure_reaches_every_caller()
+    test_batched_reports_are_used()
+    test_echoed_batch_items_fall_back_and_are_counted()
+    test_lone_request_is_streamed_without_batching()
+    print("🎉 Todos os testes de micro-batching passaram!")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Teste do servidor mock do endpoint Hugging Face (não requer API).
+"""
+
+import json
+
+from fastapi.testclient import TestClient
+
+from mock_hf_server import MockConfig, classify_payload, create_app
+
+def make_client(**overrides):
+    return TestClient(create_app(MockConfig(latency="fixed:0", tokens_per_second=0, **overrides)))
+
+def chat_payload(**extra):
+    return {"model": "tgi", "messages": [{"role": "user", "content": "Analise a imagem."}], **extra}
+
+def test_chat_report_is_deterministic():
+    first = make_client().post("/v1/chat/completions", json=chat_payload()).json()
+    second = make_client().post("/v1/chat/completions", json=chat_payload()).json()
+    content = first["choices"][0]["message"]["content"]
+    print(f"📝 Relatório ({len(content)} caracteres): {content[:80]}...")
+    assert content == second["choices"][0]["message"]["content"]
+    assert "5. RECOMENDAÇÕES:" in content
+    assert first["choices"][0]["finish_reason"] == "stop"
+
+def test_streaming_and_max_tokens():
+    with make_client().stream("POST", "/v1/chat/completions", json=chat_payload(stream=True, max_tokens=10)) as response:
+        events = [line[len("data: "):] for line in response.iter_lines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+    assert len(text.split()) >= 10
+    assert chunks[-1]["choices"][0]["finish_reason"] == "length"
+
+def test_cold_start_rejection_and_rate_limit():
+    client = make_client(cold_start_seconds=60)
+    response = client.post("/v1/completions", json={"prompt": "<image>\nteste"})
+    assert response.status_code == 503 and "estimated_time" in response.json()
+
+    client = make_client(reject_formats=["HF-Inference"], rate_limit_rps=0.001, rate_limit_burst=1)
+    assert client.post("/", json={"inputs": "teste"}).status_code == 422
+    limited = client.post("/", json={"inputs": "teste"})
+    assert limited.status_code == 429 and limited.headers["Retry-After"]
+
+def test_echo_and_payload_classification():
+    echoed = make_client(echo_probability=1.0).post("/v1/completions", json={"prompt": "<image>\nDescreva a imagem"})
+    assert echoed.json()["choices"][0]["text"] == "<image>\nDescreva a imagem"
+    assert classify_payload("/", {"inputs": {"text": "t", "image": "b64"}}) == "Direct-Image-Payload"
+    assert classify_payload("/v1/chat/completions", {"messages": [{"role": "user", "content": "x"}], "images": []}) == "MedGemma-Format"
+
+if __name__ == "__main__":
+    print("🧪 Testando servidor mock do endpoint HF")
+    print("=" * 50)
+    test_chat_report_is_deterministic()
+    test_streaming_and_max_tokens()
+    test_cold_start_rejection_and_rate_limit()
+    test_echo_and_payload_classification()
+    print("🎉 Todos os testes do servidor mock passaram!")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Teste da detecção de estudos reenviados por hash perceptual (não requer API).
+"""
+
+import asyncio
+import io
+
+import httpx
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from benchmarks.common import image_to_b64, synthetic_study
+from mock_hf_server import MockConfig, create_app
+from services.huggingface_service import HuggingFaceService
+from services.perceptual_hash import (
+    PerceptualHashIndex,
+    clinical_inputs_key,
+    compute_perceptual_hash,
+    hamming_distance
+)
+
+def make_study(seed):
+    """Cria uma imagem sintética com formas e ruído."""
+    rng = np.random.default_rng(seed)
+    array = rng.normal(100, 10, (600, 500))
+    for _ in range(6):
+        y, x = rng.integers(0, 450), rng.integers(0, 350)
+        array[y:y + 150, x:x + 150] += rng.integers(40, 120)
+    return Image.fromarray(np.clip(array, 0, 255).astype(np.uint8)).convert("RGB")
+
+def reexport(image):
+    """Simula reexportação: outro tamanho, JPEG e leve mudança de brilho."""
+    resized = image.resize((image.width * 2 // 3, image.height * 2 // 3))
+    buffer = io.BytesIO()
+    ImageEnhance.Brightness(resized).enhance(1.1).save(buffer, format="JPEG", quality=70)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+def test_reexported_study_is_near_duplicate():
+    for algorithm in ("phash", "dhash"):
+        original = compute_perceptual_hash(make_study(1), algorithm)
+        copy = compute_perceptual_hash(reexport(make_study(1)), algorithm)
+        other = compute_perceptual_hash(make_study(2), algorithm)
+        print(f"🔍 {algorithm}: cópia={hamming_distance(original, copy)} outro={hamming_distance(original, other)}")
+        assert hamming_distance(original, copy) <= 8
+        assert hamming_distance(original, other) > 12
+
+def test_index_requires_same_clinical_inputs():
+    index = PerceptualHashIndex(max_entries=2)
+    image_hash = compute_perceptual_hash(make_study(1))
+    key = clinical_inputs_key("45", "70", "Dor torácica há 2 semanas")
+    index.add(image_hash, key, "relatório anterior")
+
+    same_inputs = clinical_inputs_key(" 45", "70", "dor  torácica há 2 semanas")
+    match = index.find(image_hash ^ 0b101, same_inputs, max_distance=6)
+    assert match and match["value"] == "relatório anterior" and match["distance"] == 2
+
+    other_inputs = clinical_inputs_key("45", "70", "Febre")
+    assert index.find(image_hash, other_inputs, max_distance=6) is None
+
+    for language, modality in (("en", "chest_xray"), ("pt", "ct")):
+        other_report = clinical_inputs_key("45", "70", "Dor torácica há 2 semanas", language, modality)
+        assert other_report != clinical_inputs_key("45", "70", "Dor torácica há 2 semanas", "pt", "chest_xray")
+
+def test_index_is_bounded():
+    index = PerceptualHashIndex(max_entries=2)
+    for value in range(3):
+        index.add(value, "k", value)
+    assert len(index) == 2
+    assert index.find(0, "k", max_distance=0) is None
+
+def test_offer_mode_generates_fresh_report_with_candidate():
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.ASGITransport(app=create_app(MockConfig(latency="fixed:0", tokens_per_second=0)))
+    service.near_duplicate_mode = "offer"
+    image = image_to_b64(synthetic_study(seed=3))
+
+    async def analyze(language, **kwargs):
+        details = {}
+        report = await service.analyze_medical_image(
+            image, "45", "70", "Tosse persistente.", language=language, details=details, **kwargs
+        )
+        return report, details
+
+    async def main():
+        first, first_details = await analyze("pt")
+        second, second_details = await analyze("pt")
+        english, english_details = await analyze("en")
+        return first_details, (second, second_details), english_details
+
+    first_details, (second, second_details), english_details = asyncio.run(main())
+    candidate = second_details["reused_candidate"]
+    print(f"♻️ Candidato oferecido: distância={candidate['distance']}")
+    assert "reused_candidate" not in first_details and "reused_candidate" not in english_details
+    assert candidate["distance"] == 0 and "ESTUDO SEMELHANTE" in second
+    assert "ANÁLISE REAPROVEITADA" not in second
+
+if __name__ == "__main__":
+    print("🧪 Testando hash perceptual")
+    print("=" * 50)
+    test_reexported_study_is_near_duplicate()
+    test_index_requires_same_clinical_inputs()
+    test_index_is_bounded()
+    test_offer_mode_generates_fresh_report_with_candidate()
+    print("🎉 Todos os testes de hash perceptual passaram!")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Teste do cache de estado do prefixo estático (não requer modelo).
+"""
+
+from services.prefix_cache import PrefixStateCache
+
+def test_prefix_built_once_and_reused():
+    builds = []
+    cache = PrefixStateCache(max_entries=2)
+
+    def build():
+        builds.append(1)
+        return [1, 2, 3], {"kv": "estado"}, 3
+
+    assert cache.get("v2/pt/geral:abc") is None
+    cache.build("v2/pt/geral:abc", build)
+    ids, state, tokens = cache.get("v2/pt/geral:abc")
+    cache.record_reuse(tokens)
+    cache.record_mismatch()
+    stats = cache.stats()
+    print(f"📊 Estatísticas: {stats}")
+    assert len(builds) == 1 and state == {"kv": "estado"}
+    assert stats["reuses"] == 1 and stats["prefill_tokens_saved"] == 3 and stats["mismatches"] == 1
+
+def test_one_entry_per_prompt_version_bounded():
+    cache = PrefixStateCache(max_entries=2)
+    for key in ("v1/pt/geral:a", "v2/pt/geral:b", "v2/en/geral:c"):
+        cache.build(key, lambda: ([], None, 10))
+    assert cache.get("v1/pt/geral:a") is None
+    assert set(cache.stats()["prefixes"]) == {"v2/pt/geral:b", "v2/en/geral:c"}
+
+if __name__ == "__main__":
+    print("🧪 Testando cache do prefixo")
+    print("=" * 50)
+    test_prefix_built_once_and_reused()
+    test_one_entry_per_prompt_version_bounded()
+    print("🎉 Todos os testes do cache do prefixo passaram!")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Teste dos perfis sob demanda: CPU, memória e tarefas asyncio (não requer API).
+"""
+
+import asyncio
+import threading
+
+from services.profiling import memory_snapshot, sample_cpu, start_memory_tracing, stop_memory_tracing, task_stacks
+
+def busy_loop(stop: threading.Event):
+    total = 0
+    while not stop.is_set():
+        total += sum(range(1000))
+
+def test_cpu_profile_finds_busy_thread():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    try:
+        result = sample_cpu(0.3, interval=0.005)
+    finally:
+        stop.set()
+        worker.join()
+    busy = [line for line in result["collapsed"].splitlines() if line.startswith("busy;")]
+    print(f"🔥 {result['samples']} amostras, {len(busy)} pilhas da thread ocupada")
+    assert busy and all("busy_loop (test_profiling.py:" in line for line in busy)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in busy) > 10
+
+def test_memory_snapshot_reports_growth():
+    start_memory_tracing()
+    try:
+        memory_snapshot()
+        retained = [bytearray(1024) for _ in range(2000)]
+        result = memory_snapshot(limit=5, compare=True)
+    finally:
+        stop_memory_tracing()
+    print(f"🧠 Maior crescimento: {result['top'][0]}")
+    assert result["compared"]
+    assert "test_profiling.py" in result["top"][0]["location"]
+    assert result["top"][0]["size_diff_bytes"] >= 2000 * 1024
+    assert len(retained) == 2000
+
+def test_task_stacks_follow_awaits():
+    async def inner_wait(event):
+        await event.wait()
+
+    async def outer(event):
+        await inner_wait(event)
+
+    async def main():
+        event = asyncio.Event()
+        task = asyncio.create_task(outer(event), name="esperando")
+        await asyncio.sleep(0)
+        stacks = task_stacks()
+        event.set()
+        await task
+        return stacks
+
+    stacks = asyncio.run(main())
+    print(f"🧵 {stacks['collapsed'].strip()}")
+    waiting = [task for task in stacks["tasks"] if task["name"] == "esperando"]
+    assert [label.split(" ")[0] for label in waiting[0]["stack"][:2]] == ["outer", "inner_wait"]
+
+if __name__ == "__main__":
+    print("🧪 Testando perfis sob demanda")
+    print("=" * 50)
+    test_cpu_profile_finds_busy_thread()
+    test_memory_snapshot_reports_growth()
+    test_task_stacks_follow_awaits()
+    print("🎉 Todos os testes de perfis passaram!")
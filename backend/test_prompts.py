@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Teste do registro versionado de prompts (não requer API).
+"""
+
+from services.prompts import PROMPT_REGISTRY, PROMPT_VERSION, get_prompt_template
+
+def test_aliases_and_unknown_values_resolve_to_registered_keys():
+    assert get_prompt_template("EN-us", "X-Ray").key == f"{PROMPT_VERSION}/en/raio-x"
+    assert get_prompt_template("pt", "tomografia") is get_prompt_template(None, "ct")
+    assert get_prompt_template("xx", "pet").key == get_prompt_template().key
+    assert len(PROMPT_REGISTRY) == len({template.key for template in PROMPT_REGISTRY.values()})
+
+def test_unregistered_version_is_rejected():
+    try:
+        get_prompt_template(version="v0")
+    except Exception as error:
+        assert "v0" in str(error)
+    else:
+        raise AssertionError("versão inexistente deveria falhar")
+
+def test_static_prefix_comes_first_and_is_shared_by_patients():
+    template = get_prompt_template("pt", "tc")
+    first = template.render("45", "70", "Cefaleia súbita.")
+    second = template.render("8", "25", "Queda da própria altura.")
+    print(f"📋 {template.key}: prefixo de {len(template.static_prefix)} caracteres ({template.prefix_hash})")
+    assert first.startswith(template.static_prefix) and second.startswith(template.static_prefix)
+    assert "Cefaleia súbita." not in template.static_prefix
+    assert first[len(template.static_prefix):] != second[len(template.static_prefix):]
+
+def test_prefix_hash_changes_with_language_and_modality():
+    hashes = {(template.language, template.modality): template.prefix_hash for template in PROMPT_REGISTRY.values()}
+    assert len(set(hashes.values())) == len(hashes)
+    assert get_prompt_template("pt", "tc").prefix_hash == get_prompt_template("pt", "tc").prefix_hash
+
+if __name__ == "__main__":
+    print("🧪 Testando registro de prompts")
+    print("=" * 50)
+    test_aliases_and_unknown_values_resolve_to_registered_keys()
+    test_unregistered_version_is_rejected()
+    test_static_prefix_comes_first_and_is_shared_by_patients()
+    test_prefix_hash_changes_with_language_and_modality()
+    print("🎉 Todos os testes do registro de prompts passaram!")
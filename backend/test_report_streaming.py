@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Teste da parada antecipada do streaming e da detecção de truncamento (não requer API).
+"""
+
+import asyncio
+import json
+
+import httpx
+
+from mock_hf_server import MockConfig, create_app
+from services.huggingface_service import HuggingFaceService
+from services.prompts import get_prompt_template
+
+HEADERS = "\n\n".join([
+    "1. QUALIDADE DA IMAGEM:\n- Adequada.",
+    "2. ESTRUTURAS ANATÔMICAS:\n- Preservadas.",
+    "3. ACHADOS ANORMAIS:\n- Opacidade em base direita.",
+])
+BODY_MENTION = (
+    HEADERS + "\n\n4. IMPRESSÃO DIAGNÓSTICA:\n- Consolidação, ver recomendações abaixo.\n"
+    "Considerar também atelectasia.\n\nDiagnóstico diferencial: pneumonia versus atelectasia."
+    "\n\n5. RECOMENDAÇÕES:\n- TC de tórax."
+)
+COMPLETE_WITH_TRAILER = (
+    HEADERS + "\n\n4. IMPRESSÃO DIAGNÓSTICA:\n- Pneumonia.\n\n5. RECOMENDAÇÕES:\n- Controle radiológico."
+    "\n\nEspero que este relatório ajude na condução do caso e fico à disposição para dúvidas."
+)
+
+def stream(report_text="", echo_probability=0.0, max_tokens=1024, continue_truncated=False):
+    mock = create_app(MockConfig(
+        latency="fixed:0", tokens_per_second=0, report_text=report_text, echo_probability=echo_probability
+    ))
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.ASGITransport(app=mock)
+    prompt = get_prompt_template().render("45", "70", "Tosse persistente há 3 semanas.")
+    payload = {"model": "tgi", "messages": [{"role": "user", "content": prompt}], "max_tokens": max_tokens}
+
+    async def call():
+        async with service._http_client() as client:
+            result = await service._stream_completion(client, service.medgemma_url, payload, prompt)
+            if continue_truncated:
+                result["content"] = await service._recover_truncation(
+                    client, service.medgemma_url, payload, prompt, result["content"], result["finish_reason"]
+                )
+            return result
+
+    return service, prompt, asyncio.run(call())
+
+def test_echo_cancels_stream():
+    _, _, result = stream(echo_probability=1.0)
+    print(f"🔁 Echo: stop_reason={result['stop_reason']}, {len(result['content'])} caracteres")
+    assert result["echo"] and result["stop_reason"] == "echo"
+
+def test_complete_report_stops_before_trailing_paragraph():
+    _, _, result = stream(report_text=COMPLETE_WITH_TRAILER)
+    print(f"✅ Completo: stop_reason={result['stop_reason']}")
+    assert result["stop_reason"] == "complete"
+    assert result["content"].endswith("- Controle radiológico.")
+
+def test_section_words_in_body_do_not_stop_stream():
+    service, prompt, result = stream(report_text=BODY_MENTION)
+    print(f"📝 Menção no texto: stop_reason={result['stop_reason']}")
+    assert result["stop_reason"] is None
+    assert "Diagnóstico diferencial" in result["content"] and result["content"].endswith("- TC de tórax.")
+    assert not service._is_truncated(result["content"], prompt, None)
+
+def test_missing_section_is_truncated_despite_body_mention():
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    prompt = get_prompt_template().render("45", "70", "Tosse.")
+    partial = BODY_MENTION.split("\n\n5. RECOMENDAÇÕES")[0]
+    assert len(service._section_positions(partial)) == 4
+    assert service._is_truncated(partial, prompt, None)
+
+def test_truncated_report_is_continued():
+    service, prompt, result = stream(report_text=BODY_MENTION, max_tokens=20, continue_truncated=True)
+    print(f"🧵 Continuação: finish_reason={result['finish_reason']}, {len(result['content'])} caracteres")
+    assert result["finish_reason"] == "length"
+    assert len(service._section_positions(result["content"])) == 5
+    assert result["content"].endswith("- TC de tórax.")
+
+def test_english_report_is_continued_in_english():
+    sent = []
+
+    class Recording(httpx.AsyncBaseTransport):
+        def __init__(self, inner):
+            self.inner = inner
+
+        async def handle_async_request(self, request):
+            sent.append(json.loads(request.content))
+            return await self.inner.handle_async_request(request)
+
+    template = get_prompt_template("en")
+    mock = create_app(MockConfig(latency="fixed:0", tokens_per_second=0, report_text=BODY_MENTION))
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = Recording(httpx.ASGITransport(app=mock))
+    prompt = template.render("45", "70", "Persistent cough for 3 weeks.")
+    payload = {"model": "tgi", "messages": [{"role": "user", "content": prompt}], "max_tokens": 20}
+
+    async def call():
+        async with service._http_client() as client:
+            return await service._recover_truncation(
+                client, service.medgemma_url, payload, prompt, "1. QUALIDADE DA IMAGEM:", "length",
+                template.continuation_prompt
+            )
+
+    asyncio.run(call())
+    instruction = sent[0]["messages"][-1]["content"]
+    print(f"🇬🇧 Continuação: {instruction}")
+    assert instruction == template.continuation_prompt and instruction.startswith("Continue the report")
+    assert get_prompt_template("pt").continuation_prompt.startswith("Continue o relatório")
+
+def test_markdown_and_numbered_headers_are_sections():
+    text = "**1. QUALIDADE DA IMAGEM**:\n- ok\n## 2) ESTRUTURAS ANATÔMICAS\n- ok\n### ACHADOS ANORMAIS:\n- nenhum"
+    assert len(HuggingFaceService._section_positions(text)) == 3
+
+def test_non_sse_answer_to_stream_request_is_accepted():
+    requests = []
+
+    def ignore_stream(request):
+        # Endpoint que ignora "stream": true e responde com o JSON normal
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": COMPLETE_WITH_TRAILER},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 300, "completion_tokens": 60},
+        })
+
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = httpx.MockTransport(ignore_stream)
+    prompt = get_prompt_template().render("45", "70", "Tosse persistente há 3 semanas.")
+    result = asyncio.run(service._try_endpoint_formats(prompt, "aW1hZ2Vt", get_prompt_template()))
+    print(f"📄 JSON sem SSE: {len(requests)} requisição(ões)")
+    assert len(requests) == 1 and requests[0]["stream"] is True
+    assert "5. RECOMENDAÇÕES" in result
+    assert service.token_budget.stats()
+
+if __name__ == "__main__":
+    print("🧪 Testando parada antecipada do streaming")
+    print("=" * 50)
+    test_echo_cancels_stream()
+    test_complete_report_stops_before_trailing_paragraph()
+    test_section_words_in_body_do_not_stop_stream()
+    test_missing_section_is_truncated_despite_body_mention()
+    test_truncated_report_is_continued()
+    test_english_report_is_continued_in_english()
+    test_markdown_and_numbered_headers_are_sections()
+    test_non_sse_answer_to_stream_request_is_accepted()
+    print("🎉 Todos os testes de streaming passaram!")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Teste das sessões de perguntas de acompanhamento (não requer API).
+"""
+
+import time
+
+from services.sessions import ReportSession, SessionNotFoundError, SessionStore
+
+def make_session(session_id, image_size=100, max_turns=2):
+    return ReportSession(session_id, "x" * image_size, "prompt", "relatório", "pt", max_turns)
+
+def assert_missing(store, session_id):
+    try:
+        store.get(session_id)
+    except SessionNotFoundError:
+        return
+    raise AssertionError(f"sessão {session_id} deveria ter expirado")
+
+def test_idle_sessions_expire_and_use_renews():
+    store = SessionStore(ttl_seconds=0.1)
+    store.add(make_session("ativa"))
+    store.add(make_session("ociosa"))
+    time.sleep(0.06)
+    store.get("ativa")
+    time.sleep(0.06)
+    assert store.get("ativa").session_id == "ativa"
+    assert_missing(store, "ociosa")
+    assert len(store) == 1
+
+def test_memory_budget_evicts_least_recently_used():
+    store = SessionStore(memory_budget_bytes=1000)
+    for session_id in ("a", "b", "c"):
+        store.add(make_session(session_id, image_size=300))
+    store.get("a")
+    store.add(make_session("d", image_size=300))
+    print(f"💬 Sessões: {store.stats()}")
+    assert_missing(store, "b")
+    assert store.stats()["memory_bytes"] <= 1000
+
+def test_growth_is_rechecked_on_touch():
+    store = SessionStore(memory_budget_bytes=1000)
+    store.add(make_session("antiga", image_size=300))
+    session = make_session("nova", image_size=300, max_turns=10)
+    store.add(session)
+    session.add_exchange("pergunta", "r" * 500)
+    store.touch()
+    assert_missing(store, "antiga")
+    assert store.get("nova") is session
+
+def test_conversation_keeps_only_recent_turns():
+    session = make_session("s", max_turns=2)
+    for turn in range(3):
+        session.add_exchange(f"pergunta {turn}", f"resposta {turn}")
+    messages = session.build_messages("pergunta 3", include_image=False)
+    assert [message["content"] for message in messages] == [
+        "prompt", "relatório", "pergunta 1", "resposta 1", "pergunta 2", "resposta 2", "pergunta 3"
+    ]
+    with_image = session.build_messages("pergunta 3")[0]["content"]
+    assert with_image[1]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+
+if __name__ == "__main__":
+    print("🧪 Testando sessões de acompanhamento")
+    print("=" * 50)
+    test_idle_sessions_expire_and_use_renews()
+    test_memory_budget_evicts_least_recently_used()
+    test_growth_is_rechecked_on_touch()
+    test_conversation_keeps_only_recent_turns()
+    print("🎉 Todos os testes de sessões passaram!")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Teste do logging estruturado e do buffer de respostas do endpoint (não requer API).
+"""
+
+import json
+import logging
+
+from services.structured_logging import JsonFormatter, UpstreamBodyBuffer
+
+def test_json_formatter_puts_extra_fields_at_top_level():
+    record = logging.LogRecord("medai.test", logging.WARNING, __file__, 1, "falhou: %s", ("422",), None)
+    record.__dict__.update({"format": "HF-Inference", "status": 422})
+    entry = json.loads(JsonFormatter().format(record))
+    print(f"📝 {entry}")
+    assert entry["message"] == "falhou: 422"
+    assert entry["level"] == "WARNING"
+    assert entry["format"] == "HF-Inference"
+    assert entry["status"] == 422
+
+def test_upstream_body_buffer_is_bounded_and_newest_first():
+    buffer = UpstreamBodyBuffer(max_entries=2, max_chars=5)
+    buffer.add("http://a", "HF-Inference", 503, b"loading")
+    buffer.add("http://a", "ChatCompletions-Text", 200, "ok")
+    buffer.add("http://b", "ChatCompletions-Text", 200, "relatório")
+
+    bodies = buffer.recent()
+    print(f"📦 {bodies}")
+    assert [entry["url"] for entry in bodies] == ["http://b", "http://a"]
+    assert bodies[0]["body"] == "relat" and bodies[0]["truncated"]
+    assert bodies[1]["body"] == "ok" and not bodies[1]["truncated"]
+    assert buffer.recent(limit=1)[0]["url"] == "http://b"
+
+    disabled = UpstreamBodyBuffer(max_entries=0)
+    disabled.add("http://a", "HF-Inference", 200, "x")
+    assert disabled.recent() == []
+
+if __name__ == "__main__":
+    print("🧪 Testando logging estruturado")
+    print("=" * 50)
+    test_json_formatter_puts_extra_fields_at_top_level()
+    test_upstream_body_buffer_is_bounded_and_newest_first()
+    print("🎉 Todos os testes de logging passaram!")
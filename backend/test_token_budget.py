@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Teste do orçamento adaptativo de max_tokens (não requer API).
+"""
+
+from services.token_budget import TokenBudget
+
+def test_default_until_enough_samples():
+    budget = TokenBudget(max_budget=32000, min_samples=5)
+    for _ in range(4):
+        budget.record("full:ChatCompletions-Image-URL", "rx", 600, 4096)
+    assert budget.budget_for("full:ChatCompletions-Image-URL", "rx", 4096) == 4096
+
+def test_budget_follows_percentile_with_margin():
+    budget = TokenBudget(max_budget=32000, percentile=95, margin=0.25, min_samples=5, min_budget=256)
+    for tokens in range(500, 1500, 10):
+        budget.record("full:ChatCompletions-Image-URL", "rx", tokens, 4096)
+    learned = budget.budget_for("full:ChatCompletions-Image-URL", "rx", 4096)
+    print(f"📏 Orçamento aprendido: {learned}")
+    assert 1400 * 1.25 < learned < 1500 * 1.25
+    # Outra modalidade continua usando o padrão
+    assert budget.budget_for("full:ChatCompletions-Image-URL", "ct", 4096) == 4096
+
+def test_budget_is_clamped_and_stats_exposed():
+    budget = TokenBudget(max_budget=1000, min_samples=1, min_budget=256)
+    budget.record("simple:HF-Inference", "geral", 5000, 2048, truncated=True)
+    assert budget.budget_for("simple:HF-Inference", "geral", 2048) == 1000
+    stats = budget.stats()["simple:HF-Inference/geral"]
+    print(f"📊 Estatísticas: {stats}")
+    assert stats["truncations"] == 1 and stats["budget_tokens_total"] == 2048
+
+if __name__ == "__main__":
+    print("🧪 Testando orçamento de tokens")
+    print("=" * 50)
+    test_default_until_enough_samples()
+    test_budget_follows_percentile_with_margin()
+    test_budget_is_clamped_and_stats_exposed()
+    print("🎉 Todos os testes de orçamento passaram!")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Teste do tracing por requisição e do cabeçalho Server-Timing (não requer API).
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+
+import httpx
+
+from benchmarks.common import image_to_b64, synthetic_study
+from mock_hf_server import MockConfig, create_app
+from services.huggingface_service import HuggingFaceService
+from services.tracing import configure_tracing, server_timing, start_span
+
+def test_spans_cover_stages_and_attempts():
+    mock = create_app(MockConfig(latency="fixed:0", tokens_per_second=0, reject_formats=["ChatCompletions-Image-URL"]))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traces.jsonl")
+        configure_tracing("file", path, server_timing=True)
+        try:
+            async def call():
+                service = HuggingFaceService("mock", "http://mock-endpoint")
+                service.upstream_transport = httpx.ASGITransport(app=mock)
+                with start_span("POST /generate_report", kind="server") as root:
+                    await service.analyze_medical_image(
+                        image_to_b64(synthetic_study(512)), "45", "70", "Tosse persistente há 3 semanas."
+                    )
+                return root
+
+            root = asyncio.run(call())
+            header = server_timing(root)
+            print(f"⏱️ Server-Timing: {header}")
+            assert 'upstream_attempt;dur=' in header and 'desc="2x"' in header
+            assert "image_process;dur=" in header and header.endswith(f"total;dur={root.duration * 1000:.1f}")
+        finally:
+            configure_tracing("off")
+
+        with open(path) as traces:
+            spans = [
+                span for line in traces
+                for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+            ]
+
+    by_id = {span["spanId"]: span for span in spans}
+    attributes = lambda span: {item["key"]: list(item["value"].values())[0] for item in span["attributes"]}
+    attempts = [span for span in spans if span["name"] == "upstream_attempt"]
+    outcomes = [attributes(span)["outcome"] for span in attempts]
+    print(f"🧭 {len(spans)} spans exportados, tentativas: {outcomes}")
+    assert outcomes == ["422", "success"]
+    assert all(by_id[span["parentSpanId"]]["name"] == "generate" for span in attempts)
+    assert {span["traceId"] for span in spans} == {root.trace_id}
+
+    exchanges = [span for span in spans if span["name"] == "upstream_http"]
+    assert [attributes(span)["http.status_code"] for span in exchanges] == ["422", "200"]
+    assert all(by_id[span["parentSpanId"]]["name"] == "upstream_attempt" for span in exchanges)
+
+if __name__ == "__main__":
+    print("🧪 Testando tracing")
+    print("=" * 50)
+    test_spans_cover_stages_and_attempts()
+    print("🎉 Todos os testes de tracing passaram!")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Teste da gravação e reprodução do tráfego com o endpoint (não requer API).
+"""
+
+import asyncio
+import os
+import tempfile
+
+import httpx
+
+from benchmarks.common import image_to_b64, synthetic_study
+from mock_hf_server import MockConfig, create_app
+from services.huggingface_service import HuggingFaceService
+from services.traffic_archive import RecordingTransport, ReplayTransport, load_archive
+
+def analysis_section(report: str) -> str:
+    return report.split("ANÁLISE POR INTELIGÊNCIA ARTIFICIAL:")[1].split("═══")[0].strip()
+
+async def generate(transport) -> str:
+    service = HuggingFaceService("mock", "http://mock-endpoint")
+    service.upstream_transport = transport
+    return await service.analyze_medical_image(
+        image_to_b64(synthetic_study(512)), "45", "70", "Tosse persistente há 3 semanas."
+    )
+
+def test_record_then_replay_reproduces_report():
+    mock = create_app(MockConfig(latency="fixed:0", tokens_per_second=0, reject_formats=["ChatCompletions-Image-URL"]))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traffic.jsonl.gz")
+        recorder = RecordingTransport(path, transport=httpx.ASGITransport(app=mock))
+        recorded_report = asyncio.run(generate(recorder))
+
+        entries = load_archive(path)
+        print(f"⏺️ {len(entries)} trocas gravadas: {[entry['status'] for entry in entries]}")
+        assert [entry["status"] for entry in entries] == [422, 200]
+        assert entries[1]["chunks"][-1][1].endswith("data: [DONE]\n\n")  # corpo SSE completo
+        assert "chars>" in str(entries[1]["request"]["body"])  # imagem não vai para o arquivo
+
+        replay = ReplayTransport(path, speed=0)
+        replayed_report = asyncio.run(generate(replay))
+        print(f"⏯️ Reprodução: {replay.stats}")
+        assert analysis_section(replayed_report) == analysis_section(recorded_report)
+        assert replay.stats["misses"] == 0
+
+def test_replay_miss_is_a_transport_error():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "empty.jsonl.gz")
+        RecordingTransport(path)._append({"match": {"exact": "x", "shape": "y"}})
+        replay = ReplayTransport(path, speed=0)
+
+        async def call():
+            async with httpx.AsyncClient(transport=replay) as client:
+                await client.post("http://mock-endpoint/v1/completions", json={"prompt": "x"})
+
+        try:
+            asyncio.run(call())
+        except httpx.TransportError as error:
+            print(f"✅ Sem gravação correspondente: {error}")
+        else:
+            raise AssertionError("esperava ReplayMissError")
+
+if __name__ == "__main__":
+    print("🧪 Testando gravação/reprodução do tráfego")
+    print("=" * 50)
+    test_record_then_replay_reproduces_report()
+    test_replay_miss_is_a_transport_error()
+    print("🎉 Todos os testes de gravação/reprodução passaram!")
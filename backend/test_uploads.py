@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Teste dos uploads em blocos retomáveis (não requer API).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from services.uploads import UploadError, UploadNotFoundError, UploadOffsetError, UploadSpool
+
+DATA = bytes(range(256)) * 40  # 10 KB
+
+def expect(error_type, function, *args):
+    try:
+        function(*args)
+    except error_type as error:
+        return error
+    raise AssertionError(f"{function.__name__} deveria falhar com {error_type.__name__}")
+
+def test_chunks_must_follow_the_offset():
+    with tempfile.TemporaryDirectory() as spool_dir:
+        spool = UploadSpool(spool_dir, max_upload_bytes=1 << 20)
+        upload_id = spool.init(len(DATA), "estudo.dcm")["upload_id"]
+        spool.append(upload_id, 0, DATA[:4096], hashlib.sha256(DATA[:4096]).hexdigest())
+
+        gap = expect(UploadOffsetError, spool.append, upload_id, 8192, DATA[8192:])
+        assert gap.expected_offset == 4096
+        expect(UploadError, spool.append, upload_id, 4096, DATA[4096:8192], "0" * 64)
+        expect(UploadError, spool.commit, upload_id)
+        assert spool.status(upload_id)["offset"] == 4096
+
+        spool.append(upload_id, 4096, DATA[4096:])
+        result = spool.commit(upload_id, hashlib.sha256(DATA).hexdigest())
+        assert result["data"] == DATA and result["filename"] == "estudo.dcm"
+        expect(UploadNotFoundError, spool.status, upload_id)
+
+def test_upload_resumes_after_restart():
+    with tempfile.TemporaryDirectory() as spool_dir:
+        spool = UploadSpool(spool_dir, max_upload_bytes=1 << 20)
+        upload_id = spool.init(len(DATA))["upload_id"]
+        spool.append(upload_id, 0, DATA[:3000])
+
+        restarted = UploadSpool(spool_dir, max_upload_bytes=1 << 20)
+        status = restarted.status(upload_id)
+        print(f"🔁 Retomando após reinício: {status}")
+        assert status["offset"] == 3000 and not status["complete"]
+        restarted.append(upload_id, 3000, DATA[3000:])
+        assert restarted.commit(upload_id, hashlib.sha256(DATA).hexdigest())["data"] == DATA
+
+def test_size_limits_and_expiry():
+    with tempfile.TemporaryDirectory() as spool_dir:
+        spool = UploadSpool(spool_dir, max_upload_bytes=len(DATA), ttl_seconds=60)
+        expect(UploadError, spool.init, len(DATA) + 1)
+        upload_id = spool.init(100)["upload_id"]
+        expect(UploadError, spool.append, upload_id, 0, DATA[:101])
+
+        meta_path = os.path.join(spool_dir, f"{upload_id}.json")
+        with open(meta_path, encoding="utf-8") as meta:
+            info = json.load(meta)
+        info["created_at"] -= 120
+        with open(meta_path, "w", encoding="utf-8") as meta:
+            json.dump(info, meta)
+        assert UploadSpool(spool_dir, max_upload_bytes=len(DATA), ttl_seconds=60).cleanup_expired() == 1
+        assert os.listdir(spool_dir) == []
+
+if __name__ == "__main__":
+    print("🧪 Testando uploads em blocos")
+    print("=" * 50)
+    test_chunks_must_follow_the_offset()
+    test_upload_resumes_after_restart()
+    test_size_limits_and_expiry()
+    print("🎉 Todos os testes de uploads passaram!")
@@ -0,0 +1,88 @@
+import { API_CONFIG, buildApiUrl } from "@/lib/config";
+
+// Arquivos acima deste tamanho são enviados em blocos retomáveis
+export const CHUNKED_UPLOAD_THRESHOLD = 2 * 1024 * 1024;
+
+const MAX_ATTEMPTS_PER_CHUNK = 5;
+
+// crypto.subtle só existe em contexto seguro (https ou localhost)
+const canHash = (): boolean =>
+  typeof crypto !== "undefined" && typeof crypto.subtle !== "undefined";
+
+const sha256Hex = async (data: ArrayBuffer): Promise<string | null> => {
+  if (!canHash()) {
+    return null;
+  }
+  const digest = await crypto.subtle.digest("SHA-256", data);
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+};
+
+const wait = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Envia o arquivo em blocos (init/append/commit). Após uma queda de conexão,
+// consulta o offset recebido pelo servidor e continua de onde parou.
+export const uploadInChunks = async (file: File): Promise<string> => {
+  const initResponse = await fetch(buildApiUrl(API_CONFIG.ENDPOINTS.UPLOADS), {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ total_size: file.size, filename: file.name }),
+  });
+  if (!initResponse.ok) {
+    throw new Error("Falha ao iniciar o upload");
+  }
+  const { upload_id: uploadId, chunk_size: chunkSize } =
+    await initResponse.json();
+  const uploadUrl = buildApiUrl(`${API_CONFIG.ENDPOINTS.UPLOADS}/${uploadId}`);
+
+  let offset = 0;
+  let failures = 0;
+  while (offset < file.size) {
+    const chunk = await file.slice(offset, offset + chunkSize).arrayBuffer();
+    const checksum = await sha256Hex(chunk);
+    try {
+      const response = await fetch(`${uploadUrl}?offset=${offset}`, {
+        method: "PUT",
+        headers: {
+          "Content-Type": "application/octet-stream",
+          ...(checksum ? { "X-Chunk-SHA256": checksum } : {}),
+        },
+        body: chunk,
+      });
+      if (response.ok) {
+        offset = (await response.json()).offset;
+        failures = 0;
+        continue;
+      }
+      if (response.status === 409) {
+        // O servidor já tem outro offset (ex.: bloco recebido antes da queda)
+        offset = (await response.json()).detail.offset;
+        continue;
+      }
+      throw new Error(`Falha no envio do bloco: ${response.status}`);
+    } catch (error) {
+      failures += 1;
+      if (failures >= MAX_ATTEMPTS_PER_CHUNK) {
+        throw error;
+      }
+      await wait(1000 * 2 ** failures);
+      const status = await fetch(uploadUrl)
+        .then((response) => (response.ok ? response.json() : null))
+        .catch(() => null);
+      if (status) {
+        offset = status.offset;
+      }
+    }
+  }
+
+  const commitResponse = await fetch(`${uploadUrl}/commit`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ sha256: await sha256Hex(await file.arrayBuffer()) }),
+  });
+  if (!commitResponse.ok) {
+    throw new Error("Falha ao concluir o upload");
+  }
+  return (await commitResponse.json()).image_id;
+};
@@ -5,6 +5,8 @@ export const API_CONFIG = {
   // Endpoints da API
   ENDPOINTS: {
     GENERATE_REPORT: "/generate_report",
+    IMAGES: "/images",
+    UPLOADS: "/uploads",
     HEALTH: "/health",
   },
 };